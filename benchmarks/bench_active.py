@@ -0,0 +1,105 @@
+# Incremental rolling DAU / WAU / MAU (funnel_rca.active) on synthetic exports.
+# Checks the engine against a brute-force distinct count per day and window,
+# fed all at once, one cache partition at a time (also with --straddle, so
+# events arrive out of order across weeks) and with a partition applied twice
+# through analysis.rolling_active; then times adding the last week to the saved
+# state against recomputing from scratch.
+#
+#   python -m benchmarks.bench_active [--scale 10] [--straddle]
+
+import argparse
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_partitioned import straddle
+from benchmarks.synthetic import generate
+from funnel_rca.active import WINDOWS, RollingActive, day_numbers
+from funnel_rca.analysis import rolling_active
+from funnel_rca.cache import open_cache, read_manifest, sync_cache
+from funnel_rca.flags import active_mask
+
+
+def active_days(cache, start = None):
+    weeks = (start, start) if start is not None else None
+    df = open_cache(cache, columns = ['PseudoID', 'EventDate', 'EventName', 'screen'], weeks = weeks)
+    df = df[active_mask(df) & df['PseudoID'].notna().to_numpy()]
+    return pd.DataFrame({'user': df['PseudoID'].astype(str).to_numpy(), 'day': day_numbers(df['EventDate'])})
+
+
+def brute_force(pairs):
+    """Distinct users active in [day - w + 1, day] for every day, by expanding each active day over its window."""
+    pairs = pairs.drop_duplicates()
+    days = np.arange(pairs['day'].min(), pairs['day'].max() + 1)
+    out = {}
+    for name, w in WINDOWS.items():
+        spread = pd.DataFrame({'user': np.repeat(pairs['user'].to_numpy(), w),
+                               'day': (pairs['day'].to_numpy()[:, None] + np.arange(w)).ravel()})
+        out[name] = spread.drop_duplicates().groupby('day').size().reindex(days, fill_value = 0).to_numpy()
+    return pd.DataFrame(out, index = pd.DatetimeIndex(days.astype('datetime64[D]'), name = 'EventDate'))
+
+
+def engine_for(batches, engine = None, users = None):
+    engine = engine if engine is not None else RollingActive()
+    users = users if users is not None else {}
+    for pairs in batches:
+        codes = pairs['user'].map(lambda u: users.setdefault(u, len(users))).to_numpy()
+        engine.update(codes, pairs['day'].to_numpy())
+    return engine
+
+
+def same(a, b):
+    pd.testing.assert_frame_equal(a, b, check_dtype = False, check_freq = False)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--scale', type = int, default = 10)
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--out', default = 'bench_data')
+    ap.add_argument('--straddle', action = 'store_true')
+    args = ap.parse_args()
+
+    path = generate(args.scale, args.data, args.out)
+    if args.straddle:
+        path = straddle(path, Path(args.out) / f'x{args.scale}_straddle')
+    cache = path / 'event_cache'
+    sync_cache(path, cache)
+    starts = sorted(e['start'] for e in read_manifest(cache).values())
+
+    everything = active_days(cache)
+    t = time.perf_counter()
+    expected = brute_force(everything)
+    print(f'brute force        {time.perf_counter() - t:7.3f}s')
+
+    same(expected, engine_for([everything]).rolling())
+    weekly = [active_days(cache, s) for s in starts]
+    same(expected, engine_for(weekly).rolling())
+    # neighbouring partitions swapped: the late path over the bitmaps
+    swapped = [weekly[i ^ 1] if i ^ 1 < len(weekly) else weekly[i] for i in range(len(weekly))]
+    same(expected, engine_for(swapped).rolling())
+    print('all at once, week by week and with swapped weeks: identical')
+
+    shutil.rmtree(cache / 'active', ignore_errors = True)
+    t = time.perf_counter()
+    same(expected, rolling_active(cache))
+    print(f'rolling_active     {time.perf_counter() - t:7.3f}s  (from scratch, {len(starts)} weeks)')
+    t = time.perf_counter()
+    same(expected, rolling_active(cache))
+    print(f'rolling_active     {time.perf_counter() - t:7.3f}s  (nothing new)')
+
+    # adding the newest week to the state of the others vs recomputing all of them
+    users = {}
+    engine = engine_for(weekly[:-1], users = users)
+    t = time.perf_counter()
+    engine_for(weekly[-1:], engine, users)
+    incremental = time.perf_counter() - t
+    t = time.perf_counter()
+    engine_for(weekly)
+    full = time.perf_counter() - t
+    same(expected, engine.rolling())
+    print(f'new week           {incremental:7.3f}s  vs full recompute {full:7.3f}s')
+    print(f'{len(expected)} days, {len(everything)} active events')
@@ -0,0 +1,80 @@
+# Entry point -> order attribution: self-merge + cumcount of step 11 vs the as-of engine
+# in funnel_rca.attribution. Checks both give the same (order, entry point) pairs on the
+# shipped weeks, then times them with extra taps and orders per session, where the
+# self-merge grows with taps x orders per session.
+#
+#   python -m benchmarks.bench_attribution [--cache event_cache] [--taps 50] [--orders 20]
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from funnel_rca.attribution import attribute, touchpoints
+from funnel_rca.cache import open_cache, sync_cache
+from funnel_rca.encoding import Codebook, encode_frame
+from funnel_rca.funnels import FUNNELS, classify
+
+
+def self_merge(ep, ep_orders):
+    ep_merge = ep.merge(ep_orders, on = ['PseudoID', 'SessionID', 'EventDate'], suffixes = ('_e', '_o'))
+    ep_merge = ep_merge[ep_merge['EventTimestamp_o'] > ep_merge['EventTimestamp_e']]
+    ep_merge = ep_merge.sort_values(by = ['PseudoID', 'SessionID', 'EventDate', 'EventTimestamp_e'], ascending = False)
+    ep_merge['rnk'] = ep_merge.groupby(['PseudoID', 'SessionID', 'EventDate']).cumcount() + 1
+    return ep_merge[ep_merge['rnk'] == 1][['EventDate', 'order_id', 'EntryPoint', 'AppVersion_o']]
+
+
+def pairs(df):
+    return set(zip(df['order_id'], df['EntryPoint']))
+
+
+def repeat(df, n, sign, seed = 0):
+    # every row repeated n times, shifted up to a minute earlier (sign=-1) or later (sign=1)
+    rng = np.random.default_rng(seed)
+    out = df.loc[df.index.repeat(n)].reset_index(drop = True)
+    out['EventTimestamp'] += sign * pd.to_timedelta(rng.integers(0, 60_000, len(out)), unit = 'ms')
+    if 'order_id' in out:
+        out['order_id'] = out['order_id'] + '_' + (out.groupby('order_id').cumcount()).astype(str)
+    return out
+
+
+def timed(fn, *args, **kwargs):
+    t = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return time.perf_counter() - t, out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--cache', default = 'event_cache')
+    ap.add_argument('--taps', type = int, default = 50)
+    ap.add_argument('--orders', type = int, default = 20)
+    args = ap.parse_args()
+
+    sync_cache(args.data, args.cache)
+    data_fin = encode_frame(open_cache(args.cache), Codebook(f'{args.cache}/codes'))
+    data_fin[['funnel', 'funnel_order']] = classify(data_fin, FUNNELS['food_delivery']['steps'])
+    data_fin['EntryPoint'] = classify(data_fin, FUNNELS['food_delivery']['entry_points'], label = 'EntryPoint')['EntryPoint']
+    ep, ep_orders = touchpoints(data_fin)
+
+    t_old, old = timed(self_merge, ep, ep_orders)
+    t_new, new = timed(attribute, ep, ep_orders)
+    assert pairs(old) == pairs(new), 'as-of attribution differs from the self-merge'
+    print(f'shipped weeks: {len(ep)} entry clicks, {len(ep_orders)} orders, {len(new)} attributed, identical pairs')
+    print(f'  self-merge {t_old * 1000:.1f}ms, as-of {t_new * 1000:.1f}ms')
+
+    taps, orders = repeat(ep, args.taps, -1), repeat(ep_orders, args.orders, 1)
+    t_old, old = timed(self_merge, taps, orders)
+    t_new, new = timed(attribute, taps, orders)
+    print(f'x{args.taps} taps, x{args.orders} orders: {len(taps)} entry clicks, {len(orders)} orders')
+    print(f'  self-merge {t_old * 1000:.1f}ms, as-of {t_new * 1000:.1f}ms')
+
+    for model, window in (('first', None), ('last', '10min'), ('first', '10min')):
+        _, out = timed(attribute, ep, ep_orders, model = model, window = window)
+        print(f'  {model} touch, window {window}: {len(out)} attributed orders')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Automated drill-down (funnel_rca.drilldown) on synthetic exports.
+# Plants a regression - the before weeks are repeated after the last week,
+# with a share of the orders of one (DeviceCategory, TrafficSource) segment
+# lost, so that is the only change - and checks that the segment comes out on
+# top; checks that the per-partition cubes give the same
+# counts as one cube over all sessions; then times refreshing the cube after
+# an ingest and scoring every candidate with several worker counts.
+#
+#   python -m benchmarks.bench_drilldown [--scale 10] [--workers 1 2 4] [--planted android push 0.5]
+
+import argparse
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate
+from funnel_rca.analysis import prepare
+from funnel_rca.cache import sync_cache
+from funnel_rca.cube import Cube
+from funnel_rca.drilldown import DRILL_DIMENSIONS, TARGETS, drill_cube, rank_causes, session_frame
+
+
+BEFORE = ('2025-10-06', '2025-11-02')
+
+
+def plant(frame, device, source, share, before = BEFORE, seed = 0):
+    """`frame` plus a copy of its `before` weeks moved past its last week, where `share` of the
+    orders of (device, source) sessions are lost. Returns the frame and the weeks of the copy."""
+    weeks = frame['EventWeek']
+    copy = frame[(weeks.map(lambda w: w.start_time) >= before[0]) & (weeks.map(lambda w: w.start_time) <= before[1])].copy()
+    copy['EventWeek'] = copy['EventWeek'] + ((weeks.max() - pd.Period(before[0], freq = 'W-SUN')).n + 1)
+    for col in ('SessionID', 'PseudoID', 'order_id', 'SessionswPurchases', 'UserswPurchases'):
+        copy[col] = copy[col] + '_copy'
+    hit = (copy['DeviceCategory'] == device) & (copy['TrafficSource'] == source) & copy['SessionswPurchases'].notna()
+    sessions = copy.loc[hit, 'SessionID'].unique()
+    lost = sessions[np.random.default_rng(seed).random(len(sessions)) < share]
+    copy.loc[copy['SessionID'].isin(lost), ['order_id', 'SessionswPurchases', 'UserswPurchases']] = None
+    after = (str(copy['EventWeek'].min().start_time.date()), str(copy['EventWeek'].max().start_time.date()))
+    return pd.concat([frame, copy], ignore_index = True), after
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--scale', type = int, default = 10)
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--out', default = 'bench_data')
+    ap.add_argument('--workers', type = int, nargs = '+', default = [1, 2, 4])
+    ap.add_argument('--planted', nargs = 3, default = ['android', 'push', '0.5'], metavar = ('DEVICE', 'SOURCE', 'SHARE'))
+    args = ap.parse_args()
+
+    path = generate(args.scale, args.data, args.out)
+    cache = path / 'event_cache'
+    sync_cache(path, cache)
+
+    shutil.rmtree(cache / 'drill', ignore_errors = True)
+    t = time.perf_counter()
+    cube = drill_cube(cache, workers = 1)
+    print(f'drill cube           {time.perf_counter() - t:7.2f}s  (all partitions)')
+    t = time.perf_counter()
+    drill_cube(cache)
+    print(f'drill cube           {time.perf_counter() - t:7.2f}s  (nothing new)')
+
+    frame = session_frame(prepare(cache, encode = False))
+    whole = Cube.build(frame, ['EventWeek'] + DRILL_DIMENSIONS, list(TARGETS.values()))
+    for m in TARGETS.values():
+        by = ['EventWeek', 'AppVersion', 'EntryPoint']
+        assert whole.query(by, m).equals(cube.query(by, m)), m
+    print('per-partition cubes match one cube over all sessions')
+
+    device, source, share = args.planted
+    frame, after = plant(frame, device, source, float(share))
+    planted = Cube.build(frame, ['EventWeek'] + DRILL_DIMENSIONS, list(TARGETS.values()))
+    for workers in args.workers:
+        t = time.perf_counter()
+        ranked = rank_causes(planted, BEFORE, after, 'orders', workers = workers)
+        print(f'rank_causes x{workers:<3}     {time.perf_counter() - t:7.2f}s')
+    print(ranked.head(5).round(3).to_string())
+    top = ranked.iloc[0]
+    assert (top['dimensions'], top['segment']) == ('DeviceCategory x TrafficSource', f'{device} x {source}'), top
+    print(f'planted cause {device} x {source} ranked first')
@@ -0,0 +1,69 @@
+# Approximate (HLL) vs exact distinct counts for the weekly/monthly baseline of step 4.
+# Fails if any weekly or monthly estimate is off by more than 3 standard errors
+# (plus one for rounding of small counts).
+#
+#   python -m benchmarks.bench_hll [--cache event_cache] [--scale 10] [--error 0.01]
+
+import argparse
+import time
+
+import pandas as pd
+
+from funnel_rca.cache import open_cache, sync_cache
+from funnel_rca.flags import ACTIVE_EVENTS, add_flags
+from funnel_rca.sketch import SketchFrame, period_labels
+
+
+COLUMNS = ['SessionID', 'PseudoID', 'ActiveUsers', 'SessionswPurchases', 'UserswPurchases', 'order_id']
+
+
+def prepare(data_fin, scale):
+    # replicas get their own IDs, so distinct counts grow with the scale
+    frames = []
+    for i in range(scale):
+        df = data_fin.copy()
+        for col in ['PseudoID', 'SessionID', 'order_id']:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str) + f'_{i}')
+        frames.append(df)
+    # the flags of the analysis, with the same active events
+    return add_flags(pd.concat(frames, ignore_index = True), ACTIVE_EVENTS)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--cache', default = 'event_cache')
+    ap.add_argument('--scale', type = int, default = 1)
+    ap.add_argument('--error', type = float, default = 0.01)
+    args = ap.parse_args()
+
+    sync_cache(args.data, args.cache)
+    data_fin = prepare(open_cache(args.cache), args.scale)
+
+    t = time.perf_counter()
+    exact_week = data_fin.groupby('EventWeek')[COLUMNS].nunique()
+    exact_month = data_fin.groupby('EventMonth')[COLUMNS].nunique()
+    t_exact = time.perf_counter() - t
+
+    t = time.perf_counter()
+    daily = SketchFrame.build(data_fin, 'EventDate', COLUMNS, error = args.error)
+    t_build = time.perf_counter() - t
+    t = time.perf_counter()
+    approx_week = daily.rollup(period_labels('W-SUN', name = 'EventWeek')).estimate()
+    approx_month = daily.rollup(period_labels('M', name = 'EventMonth')).estimate()
+    t_rollup = time.perf_counter() - t
+
+    print(f'rows: {len(data_fin)}, precision: {daily.p}, standard error: {daily.error:.4f}')
+    print(f'exact nunique: {t_exact:.3f}s, sketch build: {t_build:.3f}s, rollups: {t_rollup * 1000:.1f}ms')
+    for name, exact, approx in (('week', exact_week, approx_week), ('month', exact_month, approx_month)):
+        rel = (approx - exact).abs() / exact
+        print(f'{name}: max relative error per column')
+        print(rel.max().round(4).to_string())
+        bound = 3 * daily.error * exact + 1
+        bad = (approx - exact).abs() > bound
+        assert not bad.to_numpy().any(), f'{name} estimates out of bound:\n{approx[bad.any(axis = 1)]}'
+    print('all estimates within bound')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# JSON flattening benchmark: json.loads + pd.json_normalize (step 3 of the notebook)
+# vs the projection-aware decoder in funnel_rca.params.
+#
+#   python -m benchmarks.bench_json [--data .] [--scale 10] [--repeat 3]
+
+import argparse
+import json
+import time
+
+import pandas as pd
+
+from funnel_rca.loader import load_exports
+from funnel_rca.params import flatten
+
+
+def json_normalize_path(data_union):
+    event_params = pd.json_normalize(data_union['EventParams'].map(json.loads))
+    event_params = event_params[['screen', 'service', 'button', 'order_id', 'reason']]
+    user_prop = pd.json_normalize(data_union['UserProperties'].map(json.loads))
+    user_prop = user_prop[['cohort_month', 'is_new_user', 'app_version']]
+    return data_union.iloc[:,:-2].join([event_params, user_prop])
+
+
+def best_of(fn, arg, repeat):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn(arg)
+        times.append(time.perf_counter() - t)
+    return min(times), out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--scale', type = int, default = 1, help = 'repeat the shipped rows N times')
+    ap.add_argument('--repeat', type = int, default = 3)
+    args = ap.parse_args()
+
+    data_union = load_exports(args.data)
+    data_union = pd.concat([data_union] * args.scale, ignore_index = True)
+    rows = len(data_union)
+
+    t_old, old = best_of(json_normalize_path, data_union, args.repeat)
+    t_new, new = best_of(flatten, data_union, args.repeat)
+
+    # same values for every projected key
+    for c in old.columns[-8:]:
+        assert old[c].astype(object).fillna('').equals(new[c].astype(object).fillna('')), c
+
+    print(f'rows: {rows}')
+    print(f'json_normalize: {t_old:.3f}s ({rows / t_old:,.0f} rows/s), {old.memory_usage(deep = True).sum() / 2**20:.1f} MiB')
+    print(f'flatten:        {t_new:.3f}s ({rows / t_new:,.0f} rows/s), {new.memory_usage(deep = True).sum() / 2**20:.1f} MiB')
+    print(f'speedup:        {t_old / t_new:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
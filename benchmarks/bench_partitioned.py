@@ -0,0 +1,64 @@
+# Partition-parallel execution (funnel_rca.partitioned) vs the single-process
+# pandas path on synthetic exports, for several worker counts. Checks that all
+# tables are identical - also with --straddle, where the first day of every
+# weekly file is moved into the previous file, so files cross the Sunday cut
+# and a week's events come from two partitions.
+#
+#   python -m benchmarks.bench_partitioned [--scale 10] [--workers 1 2 4 8] [--straddle]
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from benchmarks.synthetic import generate
+from funnel_rca.analysis import run
+from funnel_rca.cache import sync_cache
+from funnel_rca.loader import find_exports
+from funnel_rca.partitioned import aggregate, tables
+
+
+def straddle(src, dst):
+    """Copy of the exports in `src` where each file's first day is appended to the previous file."""
+    dst = Path(dst)
+    dst.mkdir(parents = True, exist_ok = True)
+    weeks = [(f, pd.read_csv(f, dtype = str, keep_default_na = False)) for _, _, f in find_exports(src)]
+    moved = [w[w['EventDate'] == w['EventDate'].min()] for _, w in weeks]
+    for i, (f, week) in enumerate(weeks):
+        out = week if i == 0 else week.drop(moved[i].index)
+        if i + 1 < len(weeks):
+            out = pd.concat([out, moved[i + 1]])
+        out.to_csv(dst / f.name, index = False)
+    return dst
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--scale', type = int, default = 10)
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--out', default = 'bench_data')
+    ap.add_argument('--workers', type = int, nargs = '+', default = [1, 2, 4, 8])
+    ap.add_argument('--straddle', action = 'store_true')
+    args = ap.parse_args()
+
+    path = generate(args.scale, args.data, args.out)
+    if args.straddle:
+        path = straddle(path, Path(args.out) / f'x{args.scale}_straddle')
+    cache = path / 'event_cache'
+    sync_cache(path, cache)
+    print(f'{os.cpu_count()} cores')
+
+    t = time.perf_counter()
+    expected = run(path, cache)
+    print(f'pandas            {time.perf_counter() - t:7.2f}s')
+
+    for workers in args.workers:
+        t = time.perf_counter()
+        got = tables(aggregate(cache, workers))
+        print(f'partitioned x{workers:<3}  {time.perf_counter() - t:7.2f}s')
+        for name, df in got.items():
+            pd.testing.assert_frame_equal(expected[name], df, check_dtype = False, check_categorical = False,
+                                          check_index_type = False, check_column_type = False)
+    print(f'{len(got)} tables identical')
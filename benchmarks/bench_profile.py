@@ -0,0 +1,79 @@
+# Cost of the instrumentation (funnel_rca.profiling) on synthetic exports.
+# Times analysis.run with profiling off and on (same tables either way),
+# then projects the cost of the disabled hooks: the traced calls of one run
+# times the extra cost of calling a traced function while profiling is off.
+# Writes the trace and the flame graph profile of the profiled run and prints
+# the stages by self time and the largest frames.
+#
+#   python -m benchmarks.bench_profile [--scale 10] [--repeat 3]
+
+import argparse
+import json
+import timeit
+from pathlib import Path
+
+import pandas as pd
+
+from benchmarks.synthetic import generate
+from funnel_rca import profiling
+from funnel_rca.analysis import run
+from funnel_rca.cache import sync_cache
+
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t = timeit.default_timer()
+        out = fn()
+        times.append(timeit.default_timer() - t)
+    return out, min(times)
+
+
+def noop():
+    return None
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--scale', type = int, default = 10)
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--out', default = 'bench_data')
+    ap.add_argument('--repeat', type = int, default = 3)
+    args = ap.parse_args()
+
+    path = generate(args.scale, args.data, args.out)
+    cache = path / 'event_cache'
+    sync_cache(path, cache)
+
+    assert profiling.active() is None, f'unset {profiling.ENV} to time the disabled hooks'
+    expected, off = best(lambda: run(path, cache), args.repeat)
+    tracers = []
+
+    def profiled():
+        profiling.enable()
+        try:
+            return run(path, cache)
+        finally:
+            tracers.append(profiling.disable())
+
+    got, on = best(profiled, args.repeat)
+    for name in expected:
+        pd.testing.assert_frame_equal(expected[name], got[name], check_freq = False)
+    tracer = tracers[-1]
+    print(f'run, profiling off   {off:7.3f}s')
+    print(f'run, profiling on    {on:7.3f}s  ({on / off - 1:+.1%}, {len(tracer.spans)} spans, '
+          f'{tracer.overhead:.3f}s measuring frames)')
+
+    n = 1_000_000
+    plain = timeit.timeit(noop, number = n) / n
+    hooked = timeit.timeit(profiling.traced(noop), number = n) / n
+    cost = (hooked - plain) * len(tracer.spans)
+    print(f'disabled hook        {(hooked - plain) * 1e9:7.0f}ns per call, {cost * 1e6:.1f}us per run ({cost / off:.6%})')
+
+    trace, folded = tracer.write(Path(args.out) / f'x{args.scale}_profile.json')
+    lines = folded.read_text().splitlines()
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert len(json.loads(trace.read_text())['spans']) == len(tracer.spans)
+    print(f'trace {trace}, {len(lines)} stacks in {folded}')
+    print(tracer.summary().head(8).round(3).to_string())
+    print(pd.DataFrame(tracer.frames).head(5).to_string(index = False))
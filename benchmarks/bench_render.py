@@ -0,0 +1,79 @@
+# Batch figure rendering (funnel_rca.render) on synthetic exports.
+# Draws every figure serially the way the CLI used to (plots.all_figures and
+# savefig one by one), then with render_figures in pools of --workers processes:
+# the files must be byte for byte the same. Then reruns with nothing changed
+# (every figure skipped) and with the orders of one app version changed (only
+# its figure redrawn), assembles the HTML report and checks that the files of
+# a format no longer asked for are removed.
+#
+#   python -m benchmarks.bench_render [--scale 10] [--workers 1 2 4]
+
+import argparse
+import shutil
+import time
+from pathlib import Path
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from benchmarks.synthetic import generate
+from funnel_rca.analysis import run
+from funnel_rca.plots import all_figures
+from funnel_rca.render import render_figures, report
+
+
+def serial(results, out):
+    out.mkdir(parents = True, exist_ok = True)
+    for name, figs in all_figures(results).items():
+        for i, fig in enumerate(figs):
+            fig.savefig(out / (f'{name}.png' if len(figs) == 1 else f'{name}_{i}.png'), bbox_inches = 'tight')
+            plt.close(fig)
+
+
+def timed(label, fn):
+    t = time.perf_counter()
+    out = fn()
+    print(f'{label:<24} {time.perf_counter() - t:7.2f}s')
+    return out
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--scale', type = int, default = 10)
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--out', default = 'bench_data')
+    ap.add_argument('--workers', type = int, nargs = '+', default = [1, 2, 4])
+    args = ap.parse_args()
+
+    path = generate(args.scale, args.data, args.out)
+    results = run(path, path / 'event_cache')
+    target = Path(args.out) / f'x{args.scale}_figures'
+    shutil.rmtree(target, ignore_errors = True)
+
+    timed('serial', lambda: serial(results, target / 'serial'))
+    for workers in args.workers:
+        drawn = timed(f'render x{workers}', lambda: render_figures(results, target / 'batch', workers = workers, force = True))
+    assert (drawn['status'] == 'drawn').all()
+    for f in (target / 'serial').iterdir():
+        assert f.read_bytes() == (target / 'batch' / f.name).read_bytes(), f.name
+    print(f'{len(drawn)} figures, same files as the serial run')
+
+    drawn = timed('render, unchanged', lambda: render_figures(results, target / 'batch'))
+    assert (drawn['status'] == 'skipped').all()
+
+    ep_merge_gr = results['ep_merge_gr'].copy()
+    version = ep_merge_gr['AppVersion_o'].unique()[1]
+    rows = ep_merge_gr['AppVersion_o'] == version
+    ep_merge_gr.loc[rows, ep_merge_gr.columns[2:]] *= 0.5
+    drawn = timed(f'render, {version} changed', lambda: render_figures(dict(results, ep_merge_gr = ep_merge_gr), target / 'batch'))
+    assert list(drawn.index[drawn['status'] == 'drawn']) == ['orders_by_entry_point_1'], drawn
+
+    page = timed('report', lambda: report(target / 'batch'))
+    assert page.read_text().count('<img') == len(drawn)
+    print(f'{page}: {page.stat().st_size / 2**20:.1f} MiB')
+
+    # png + svg, then png only: the svg files go
+    render_figures(results, target / 'formats', formats = ('png', 'svg'), workers = 1)
+    render_figures(results, target / 'formats', formats = ('png',), workers = 1)
+    assert not list((target / 'formats').glob('*.svg'))
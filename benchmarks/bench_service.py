@@ -0,0 +1,169 @@
+# Load test of the query service (funnel_rca.service) on synthetic exports.
+# Starts the service on all weeks but the last one, runs every distinct query
+# once (cache misses), then a skewed mix of them from concurrent clients
+# (mostly cache hits) and reports latency percentiles and throughput. Then
+# ingests the last week while the clients keep going: POST /refresh must
+# reload the data, no request may fail, and the unfiltered endpoints must
+# match the tables of analysis.run.
+#
+#   python -m benchmarks.bench_service [--scale 10] [--clients 8] [--requests 2000] [--url http://127.0.0.1:8765]
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+from benchmarks.synthetic import generate
+from funnel_rca.analysis import run
+from funnel_rca.cache import sync_cache
+from funnel_rca.loader import find_exports
+from funnel_rca.service import frame_json
+
+
+class Client:
+    """One keep-alive connection per thread."""
+
+    def __init__(self, url):
+        self.host, self.port = urlsplit(url).hostname, urlsplit(url).port
+        self.local = threading.local()
+
+    def request(self, method, path):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout = 120)
+        t = time.perf_counter()
+        self.local.conn.request(method, path)
+        response = self.local.conn.getresponse()
+        body = response.read()
+        return response.status, body, time.perf_counter() - t
+
+    def get(self, path):
+        status, body, _ = self.request('GET', path)
+        assert status == 200, (path, body)
+        return json.loads(body)
+
+
+def report(label, latencies, seconds):
+    ms = np.array(latencies) * 1000
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    print(f'{label:<24} {len(ms):6d} requests  {len(ms) / seconds:8.1f}/s  '
+          f'p50 {p50:7.2f}ms  p90 {p90:7.2f}ms  p99 {p99:7.2f}ms  max {ms.max():7.2f}ms')
+
+
+def queries(client):
+    """Every combination of a few week ranges, services and versions the endpoints take."""
+    status = client.get('/')
+    weeks = [w.split('/')[0] for w in status['weeks']]
+    versions = client.get('/versions')['tables']['sessions']['columns'][:3]
+    values = {'weeks': [None, f'{weeks[0]}:{weeks[3]}', f'{weeks[-4]}:{weeks[-1]}'] + weeks[-6:],
+              'service': [None, 'food_delivery', 'grocery_delivery'],
+              'version': [None] + versions + [','.join(versions[:2])]}
+    paths = []
+    for endpoint, filters in status['endpoints'].items():
+        for combo in product(*(values[f] for f in filters)):
+            params = {f: v for f, v in zip(filters, combo) if v is not None}
+            paths.append(f'/{endpoint}?{urlencode(params)}' if params else f'/{endpoint}')
+    return paths
+
+
+def load(client, paths, n, clients, seed = 0):
+    """`n` requests from `clients` threads, drawn with Zipf-like weights over `paths`."""
+    weights = 1 / np.arange(1, len(paths) + 1)
+    picks = np.random.default_rng(seed).choice(len(paths), size = n, p = weights / weights.sum())
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = clients) as pool:
+        done = list(pool.map(lambda i: client.request('GET', paths[i]), picks))
+    failed = [(paths[i], s) for i, (s, _, _) in zip(picks, done) if s != 200]
+    assert not failed, failed[:5]
+    return [d[2] for d in done], time.perf_counter() - t
+
+
+def check(client, data, cache):
+    expected = run(data, cache)
+    pairs = [('/baseline', 'baseline', expected['df_group_week']),
+             ('/service_split', 'order_types', expected['order_types']),
+             ('/service_split', 'buyers_by_types', expected['buyers_by_types']),
+             ('/funnel', 'funnel', expected['funnel_fin']),
+             ('/entry_points', 'orders', expected['ep_merge_gr_t'])]
+    for path, table, frame in pairs:
+        got, want = client.get(path)['tables'][table], frame_json(frame)
+        assert got['index'] == want['index'] and got['columns'] == want['columns'] and got['data'] == want['data'], path
+    rate = client.get('/versions')['tables']['entry_rate']
+    want = expected['app_entry_rate'].to_numpy(dtype = float)
+    assert np.allclose(np.array(rate['data'][:-1], dtype = float), want, equal_nan = True), '/versions'
+    print('unfiltered endpoints match analysis.run')
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--scale', type = int, default = 10)
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--out', default = 'bench_data')
+    ap.add_argument('--clients', type = int, default = 8)
+    ap.add_argument('--requests', type = int, default = 2000)
+    ap.add_argument('--cache-size', type = int, default = 1024)
+    ap.add_argument('--url', default = None, help = 'load test a running service instead (no ingest)')
+    args = ap.parse_args()
+
+    server = None
+    if args.url is None:
+        path = generate(args.scale, args.data, args.out)
+        sync_cache(path, path / 'event_cache')
+        # the service's own data dir: every export but the last, and a copy of the cache
+        work = Path(args.out) / f'x{args.scale}_service'
+        shutil.rmtree(work, ignore_errors = True)
+        (work / 'data').mkdir(parents = True)
+        exports = [f for _, _, f in find_exports(path)]
+        for f in exports[:-1]:
+            os.symlink(f.resolve(), work / 'data' / f.name)
+        shutil.copytree(path / 'event_cache', work / 'event_cache',
+                        ignore = shutil.ignore_patterns('store', 'drill', 'active', 'cube'))
+        server = subprocess.Popen([sys.executable, '-m', 'funnel_rca.service', '--data', str(work / 'data'),
+                                   '--cache', str(work / 'event_cache'), '--port', '0', '--cache-size', str(args.cache_size)],
+                                  stdout = subprocess.PIPE, text = True)
+        line = server.stdout.readline()
+        print(line.strip())
+        args.url = line.split(' on ')[1].split()[0]
+
+    try:
+        client = Client(args.url)
+        paths = queries(client)
+        cold = [client.request('GET', p)[2] for p in paths]
+        report(f'cold ({len(paths)} distinct)', cold, sum(cold))
+        latencies, seconds = load(client, paths, args.requests, args.clients)
+        report(f'mixed, {args.clients} clients', latencies, seconds)
+        print('cache:', client.get('/')['cache'])
+
+        if server is not None:
+            weeks = len(client.get('/')['weeks'])
+            os.symlink(exports[-1].resolve(), work / 'data' / exports[-1].name)
+            latencies, seconds = [], 0
+            with ThreadPoolExecutor(max_workers = 1) as pool:
+                refresh = pool.submit(Client(args.url).request, 'POST', '/refresh')
+                # the clients keep going until the reload is done
+                while not refresh.done() or not seconds:
+                    more, s = load(client, paths, args.requests // 4, args.clients, seed = len(latencies))
+                    latencies, seconds = latencies + more, seconds + s
+                status, body, refreshed = refresh.result()
+            body = json.loads(body)
+            assert status == 200 and body['reloaded'] and body['version'] != body['previous'], body
+            assert len(client.get('/')['weeks']) == weeks + 1
+            print(f'ingest + reload {refreshed:7.2f}s  version {body["previous"]} -> {body["version"]}')
+            report('mixed, during reload', latencies, seconds)
+            status, body, _ = Client(args.url).request('POST', '/refresh')
+            assert not json.loads(body)['reloaded']
+            check(client, work / 'data', work / 'event_cache')
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
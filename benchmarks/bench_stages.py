@@ -0,0 +1,74 @@
+# Stage memoization (funnel_rca.stages) on synthetic exports.
+# Runs the pipeline cold, warm, with another attribution window (only the
+# attribution stage may be recomputed) and with fewer active events (the
+# flags and the tables counting them, not the cube, funnels or attribution);
+# every run must give the tables of analysis.run with the same settings. Then
+# checks that a small --memo-size keeps the store within its limit.
+#
+#   python -m benchmarks.bench_stages [--scale 10]
+
+import argparse
+import shutil
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from benchmarks.synthetic import generate
+from funnel_rca.analysis import run
+from funnel_rca.cache import sync_cache
+from funnel_rca.flags import ACTIVE_EVENTS
+from funnel_rca.stages import MemoStore, analysis_pipeline, results
+
+
+def same(a, b):
+    assert a.keys() == b.keys()
+    for name in a:
+        pd.testing.assert_frame_equal(a[name], b[name], check_freq = False)
+
+
+def timed(label, pipeline, expected_misses):
+    t = time.perf_counter()
+    out = results(pipeline)
+    report = pipeline.report
+    misses = set(report.index[report['status'].isin(['miss', 'computed'])]) - {'classified', 'data_fin'}
+    print(f'{label:<22} {time.perf_counter() - t:7.2f}s  recomputed: {", ".join(sorted(misses)) or "-"}')
+    assert misses == set(expected_misses), report
+    return out
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--scale', type = int, default = 10)
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--out', default = 'bench_data')
+    args = ap.parse_args()
+
+    path = generate(args.scale, args.data, args.out)
+    cache = path / 'event_cache'
+    sync_cache(path, cache)
+    memo = Path(args.out) / f'x{args.scale}_memo'
+    shutil.rmtree(memo, ignore_errors = True)
+    store = MemoStore(memo)
+
+    everything = ['events', 'flags', 'funnel', 'entry_points', 'cube', 'active_rolling', 'baseline', 'service_split',
+                  'funnel_counts', 'strict_funnel', 'app_version', 'entry_point_groups', 'attribution']
+    expected = run(path, cache)
+    same(expected, timed('cold', analysis_pipeline(cache, store = store), everything))
+    same(expected, timed('warm', analysis_pipeline(cache, store = store), []))
+
+    window = analysis_pipeline(cache, attribution_window = '30min', store = store)
+    same(run(path, cache, attribution_window = '30min'), timed('attribution window', window, ['attribution']))
+
+    fewer = set(sorted(ACTIVE_EVENTS)[:5])
+    flags = analysis_pipeline(cache, active_events = fewer, store = store)
+    # only data_fin carries the flags: the cube, the funnels and the attribution are not recomputed
+    out = timed('fewer active events', flags, ['flags', 'active_rolling', 'baseline', 'service_split'])
+    assert not out['df_group_week']['ActiveUsers'].equals(expected['df_group_week']['ActiveUsers'])
+    same(expected, timed('back to all events', analysis_pipeline(cache, store = store), []))
+
+    print(f'store: {len(store.index)} results, {store.size / 2**20:.1f} MiB')
+    small = MemoStore(memo, max_size = '20MB')
+    analysis_pipeline(cache, attribution_model = 'first', store = small).run()
+    print(f'20MB store: {len(small.index)} results, {small.size / 2**20:.1f} MiB')
+    assert small.size <= small.max_bytes or len(small.index) == 1
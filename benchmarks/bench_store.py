@@ -0,0 +1,95 @@
+# Memory-mapped event store (funnel_rca.store) vs the data_fin path on synthetic
+# exports: attribution (both models, with and without a window) and the strict
+# funnel must give the same tables; times both and the one-off build. Then
+# splits the sessions over worker processes that each open the store: their
+# attributions must add up to the whole one, and their resident memory shows
+# the columns as shared file pages (RssFile) rather than private copies (RssAnon).
+#
+#   python -m benchmarks.bench_store [--scale 10] [--workers 4]
+
+import argparse
+import shutil
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate
+from funnel_rca.analysis import order_attribution, prepare, strict_funnel
+from funnel_rca.cache import sync_cache
+from funnel_rca.store import EventStore, open_store
+
+
+def rss():
+    """RssAnon / RssFile of this process in MiB (Linux)."""
+    status = Path('/proc/self/status')
+    if not status.exists():
+        return {}
+    fields = dict(line.split(':', 1) for line in status.read_text().splitlines() if line.startswith('Rss'))
+    return {k: int(v.split()[0]) / 1024 for k, v in fields.items()}
+
+
+def scan(path, first, last):
+    start = rss()
+    store = EventStore(path)
+    # touch every column of the range, as a full session scan would
+    rows = slice(int(store.offsets[first]), int(store.offsets[last]))
+    for col in store.columns.values():
+        np.asarray(col[rows]).sum(dtype = np.int64)
+    out = store.attribute(sessions = (first, last))
+    return out, {k: v - start[k] for k, v in rss().items() if k in start}
+
+
+def best(fn, repeat = 3):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t)
+    return out, min(times)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--scale', type = int, default = 10)
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--out', default = 'bench_data')
+    ap.add_argument('--workers', type = int, default = 4)
+    args = ap.parse_args()
+
+    path = generate(args.scale, args.data, args.out)
+    cache = path / 'event_cache'
+    sync_cache(path, cache)
+    data_fin = prepare(cache)
+
+    shutil.rmtree(cache / 'store', ignore_errors = True)
+    t = time.perf_counter()
+    store = open_store(cache, data_fin)
+    size = sum(f.stat().st_size for f in (cache / 'store').glob('*.npy')) / 2**20
+    print(f'build      {time.perf_counter() - t:7.3f}s  {len(store)} rows, {store.sessions} sessions, {size:.1f} MiB on disk'
+          f' (data_fin {data_fin.memory_usage(deep = True).sum() / 2**20:.1f} MiB in memory)')
+
+    for model, window in (('last', None), ('first', None), ('last', '10min'), ('first', '10min')):
+        expected, t_frame = best(lambda: order_attribution(data_fin, model, window))
+        got, t_store = best(lambda: order_attribution(None, model, window, store))
+        for a, b in zip(expected[1:], got[1:]):
+            pd.testing.assert_frame_equal(a, b)
+        print(f'attribution {model:<5} {str(window):<5}  data_fin {t_frame:6.3f}s  store {t_store:6.3f}s')
+
+    expected, t_frame = best(lambda: strict_funnel(data_fin))
+    got, t_store = best(lambda: strict_funnel(None, store = store))
+    pd.testing.assert_frame_equal(expected, got)
+    print(f'strict funnel          data_fin {t_frame:6.3f}s  store {t_store:6.3f}s')
+
+    bounds = np.linspace(0, store.sessions, args.workers + 1).astype(int)
+    # spawned, not forked, so a worker's memory is only what it maps and computes itself
+    with ProcessPoolExecutor(max_workers = args.workers, mp_context = multiprocessing.get_context('spawn')) as pool:
+        parts = list(pool.map(scan, [store.path] * args.workers, bounds[:-1], bounds[1:]))
+    whole = store.attribute()
+    pd.testing.assert_frame_equal(pd.concat([p[0] for p in parts], ignore_index = True), whole)
+    print(f'{args.workers} workers: attributions add up to the whole store')
+    for i, (_, mem) in enumerate(parts):
+        print(f'  worker {i} scan: ' + ', '.join(f'+{v:.1f} MiB {k}' for k, v in mem.items()))
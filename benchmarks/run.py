@@ -0,0 +1,179 @@
+# Stage-by-stage benchmark of the pipeline on synthetic exports at 1x / 10x / 100x.
+# Each stage is timed (best of --repeat) and then run once more under tracemalloc
+# for its peak allocation (Python and NumPy heap; Arrow-backed strings only show
+# in the size of the stage's result, which is recorded as well). Results are
+# appended to benchmarks/results.jsonl and compared with the previous run of the
+# same stage and scale, so a regression shows up as soon as it lands.
+#
+#   python -m benchmarks.run [--scales 1 10 100] [--stages load flatten ...] [--repeat 3]
+#                            [--threshold 0.2] [--fail-on-regression]
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate
+from funnel_rca.analysis import app_version_rate, baseline, order_attribution
+from funnel_rca.cache import clean
+from funnel_rca.cube import Cube
+from funnel_rca.encoding import Codebook, encode_frame
+from funnel_rca.flags import add_flags
+from funnel_rca.funnels import FUNNELS, classify
+from funnel_rca.loader import load_exports
+
+
+RESULTS = Path(__file__).with_name('results.jsonl')
+
+
+# every stage takes the state left by the previous ones and returns (key, value) to store;
+# measure() stores it only after the timed and traced runs, so all of them see the same
+# input (flags and funnel set columns of data_fin in place, which a rerun sets again)
+
+def load(st):
+    # one worker: tracemalloc only sees this process
+    return 'raw', load_exports(st['path'], workers = 1)
+
+
+def flatten(st):
+    return 'data_fin', clean(st['raw'])
+
+
+def encode(st):
+    return 'data_fin', encode_frame(st['data_fin'].copy(), Codebook())
+
+
+def flags(st):
+    return 'data_fin', add_flags(st['data_fin'])
+
+
+def weekly(st):
+    return 'weekly', baseline(st['data_fin'])
+
+
+def funnel(st):
+    data_fin = st['data_fin']
+    fd = FUNNELS['food_delivery']
+    data_fin[['funnel', 'funnel_order']] = classify(data_fin, fd['steps'])
+    data_fin['EntryPoint'] = classify(data_fin, fd['entry_points'], label = 'EntryPoint')['EntryPoint']
+    return 'data_fin', data_fin
+
+
+def cube(st):
+    return 'cube', Cube.build(st['data_fin'])
+
+
+def app_version(st):
+    return 'app', app_version_rate(st['cube'])
+
+
+def attribution(st):
+    return 'ep_merge', order_attribution(st['data_fin'])
+
+
+STAGES = {f.__name__: f for f in (load, flatten, encode, flags, weekly, funnel, cube, app_version, attribution)}
+
+
+def size_mib(value):
+    if isinstance(value, tuple):
+        return sum(size_mib(v) for v in value)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.memory_usage(deep = True).sum() / 2**20
+    if isinstance(value, Cube):
+        return size_mib(tuple(value.tables.values()))
+    return 0.0
+
+
+def measure(fn, st, repeat):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        key, value = fn(st)
+        times.append(time.perf_counter() - t)
+    # on the stage's input, not its own output: encode would re-encode integer codes
+    tracemalloc.start()
+    fn(st)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    st[key] = value
+    return key, min(times), peak / 2**20
+
+
+def git_rev():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, check = True)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output = True, text = True).stdout
+        return out.stdout.strip() + ('+' if dirty.strip() else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous(results = RESULTS):
+    """Latest recorded result per (host, scale, stage)."""
+    last = {}
+    if results.exists():
+        for line in results.read_text().splitlines():
+            r = json.loads(line)
+            last[r['host'], r['scale'], r['stage']] = r
+    return last
+
+
+def run(scales, stages, data_dir = '.', out_dir = 'bench_data', repeat = 3, threshold = 0.2, results = RESULTS):
+    last = previous(results)
+    meta = {'rev': git_rev(), 'time': datetime.datetime.now().isoformat(timespec = 'seconds'),
+            'host': platform.node(), 'python': platform.python_version(),
+            'pandas': pd.__version__, 'numpy': np.__version__}
+    regressions = []
+    with open(results, 'a') as fh:
+        for scale in scales:
+            st = {'path': generate(scale, data_dir, out_dir)}
+            for name, fn in STAGES.items():
+                # later stages need the output of the earlier ones, so every stage runs;
+                # only the selected ones are repeated, profiled and recorded
+                if name not in stages:
+                    key, value = fn(st)
+                    st[key] = value
+                    continue
+                key, seconds, peak = measure(fn, st, repeat)
+                rec = dict(meta, scale = scale, stage = name, seconds = round(seconds, 4),
+                           peak_mib = round(peak, 1), result_mib = round(size_mib(st[key]), 1),
+                           rows = len(st.get('data_fin', st.get('raw'))))
+                fh.write(json.dumps(rec) + '\n')
+                fh.flush()
+
+                prev = last.get((rec['host'], scale, name))
+                change = ''
+                if prev:
+                    dt = seconds / prev['seconds'] - 1 if prev['seconds'] else 0
+                    dm = peak / prev['peak_mib'] - 1 if prev['peak_mib'] else 0
+                    change = f"time {dt:+.0%}  mem {dm:+.0%}  vs {prev['rev']}"
+                    if dt > threshold or dm > threshold:
+                        change += '  REGRESSION'
+                        regressions.append((scale, name))
+                print(f'{scale:>4}x  {name:<12} {rec["rows"]:>10,} rows  {seconds:8.3f}s  {peak:9.1f} MiB peak  {rec["result_mib"]:9.1f} MiB out  {change}')
+            # the 100x frames are large, free them before the next scale
+            st.clear()
+    return regressions
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--scales', type = int, nargs = '+', default = [1, 10, 100])
+    ap.add_argument('--stages', nargs = '+', choices = list(STAGES), default = list(STAGES))
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--out', default = 'bench_data')
+    ap.add_argument('--repeat', type = int, default = 3)
+    ap.add_argument('--threshold', type = float, default = 0.2, help = 'relative slowdown / memory growth reported as a regression')
+    ap.add_argument('--fail-on-regression', action = 'store_true')
+    args = ap.parse_args()
+    found = run(args.scales, set(args.stages), args.data, args.out, args.repeat, args.threshold)
+    if found and args.fail_on_regression:
+        sys.exit(1)
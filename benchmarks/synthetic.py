@@ -0,0 +1,69 @@
+# Synthetic weekly exports shaped like the real ones, at a multiple of their size.
+# Every shipped week is written `scale` times into one file of the same name:
+# replica 0 is the original, replica i re-keys PseudoID, SessionID and the
+# user_id / order_id inside the JSON blobs with an _r<i> suffix and shifts each
+# session by a random offset of up to a minute, so the columns, JSON payloads
+# and session structure match the exports while users, sessions and orders
+# scale with the row count.
+#
+#   python -m benchmarks.synthetic --scale 10 [--data .] [--out bench_data]
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from funnel_rca.loader import find_exports
+
+
+_JSON_IDS = r'"(user_id|order_id)":"([^"]*)"'
+# the generated files are kept between runs; bump when the generator changes
+VERSION = 1
+
+
+def replica(week, i, rng):
+    """Copy `i` of a raw weekly export (read as strings) with its own users, sessions and orders."""
+    if i == 0:
+        return week
+    out = week.copy()
+    suffix = f'_r{i}'
+    out['PseudoID'] = out['PseudoID'] + suffix
+    out['SessionID'] = out['SessionID'] + suffix
+    for col in ('UserProperties', 'EventParams'):
+        out[col] = out[col].str.replace(_JSON_IDS, rf'"\1":"\2{suffix}"', regex = True)
+    sessions, codes = np.unique(week['SessionID'].to_numpy(), return_inverse = True)
+    shift = rng.integers(0, 60_000, len(sessions))[codes]
+    out['EventTimestamp'] = (out['EventTimestamp'].astype('int64') + shift).astype(str)
+    return out
+
+
+def generate(scale, data_dir = '.', out_dir = 'bench_data', seed = 0):
+    """Write the exports of `data_dir` at `scale`x to out_dir/x<scale>; reuses an earlier run with the same inputs."""
+    exports = find_exports(data_dir)
+    target = Path(out_dir) / f'x{scale}'
+    stamp = {'version': VERSION, 'seed': seed, 'files': {f.name: f.stat().st_size for _, _, f in exports}}
+    done = target / 'synthetic.json'
+    if done.exists() and json.loads(done.read_text()) == stamp:
+        return target
+
+    target.mkdir(parents = True, exist_ok = True)
+    rng = np.random.default_rng(seed)
+    for _, _, f in exports:
+        week = pd.read_csv(f, dtype = str, keep_default_na = False)
+        dest = target / f.name
+        for i in range(scale):
+            replica(week, i, rng).to_csv(dest, mode = 'w' if i == 0 else 'a', header = i == 0, index = False)
+    done.write_text(json.dumps(stamp))
+    return target
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--scale', type = int, default = 10)
+    ap.add_argument('--data', default = '.')
+    ap.add_argument('--out', default = 'bench_data')
+    ap.add_argument('--seed', type = int, default = 0)
+    args = ap.parse_args()
+    print(generate(args.scale, args.data, args.out, args.seed))
@@ -0,0 +1,32 @@
+"""Food Delivery funnel root cause analysis: reusable pipeline pieces.
+
+Plotting lives in funnel_rca.plots and is not imported here.
+"""
+
+from .active import RollingActive, day_numbers
+from .analysis import (app_version_rate, baseline, entry_points, funnel_counts, order_attribution,
+                       prepare, rolling_active, run, service_split, strict_funnel)
+from .attribution import attribute, touchpoints
+from .cache import clean, open_cache, sync_cache
+from .cube import Cube
+from .encoding import Codebook, decode_frame, encode_frame, memory_usage
+from .flags import ACTIVE_EVENTS, active_mask, add_flags
+from .funnels import FUNNELS, Rule, classify, compile_rules
+from .loader import find_exports, iter_weeks, load_exports, read_export
+from .params import EVENT_PARAMS, USER_PROPERTIES, extract_keys, flatten
+from .sequence import sequence_funnel, session_paths
+from .sketch import SketchFrame, period_labels
+
+__all__ = ['RollingActive', 'day_numbers',
+           'app_version_rate', 'baseline', 'entry_points', 'funnel_counts', 'order_attribution',
+           'prepare', 'rolling_active', 'run', 'service_split', 'strict_funnel',
+           'attribute', 'touchpoints',
+           'clean', 'open_cache', 'sync_cache',
+           'Cube',
+           'Codebook', 'decode_frame', 'encode_frame', 'memory_usage',
+           'ACTIVE_EVENTS', 'active_mask', 'add_flags',
+           'FUNNELS', 'Rule', 'classify', 'compile_rules',
+           'find_exports', 'iter_weeks', 'load_exports', 'read_export',
+           'EVENT_PARAMS', 'USER_PROPERTIES', 'extract_keys', 'flatten',
+           'sequence_funnel', 'session_paths',
+           'SketchFrame', 'period_labels']
@@ -0,0 +1,143 @@
+# Incremental rolling DAU / WAU / MAU.
+# Per user (indexed by the PseudoID dictionary code) the engine keeps the last
+# active day and a 64-day activity bitmap ending on it - 12 bytes per user.
+# A day of activity makes the user count in a window for the days [day, day + w),
+# minus the days an earlier activity already covered; those spans go into one
+# difference array over days per window, so a new week costs O(its active
+# events) and the rolling counts for every day are a cumulative sum.
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .profiling import traced
+
+
+WINDOWS = {'DAU': 1, 'WAU': 7, 'MAU': 28}
+HORIZON = 64
+_NEVER = np.iinfo(np.int32).min // 2
+
+
+def day_numbers(dates):
+    """Days since 1970-01-01 of EventDate strings / datetimes."""
+    return pd.to_datetime(pd.Series(dates)).to_numpy(dtype = 'datetime64[D]').astype(np.int64)
+
+
+class RollingActive:
+    """Distinct active users over rolling windows (DAU/WAU/MAU) for every day, updated incrementally."""
+
+    def __init__(self, windows = WINDOWS):
+        self.windows = dict(windows)
+        self.last = np.full(0, _NEVER, dtype = np.int32)
+        self.mask = np.zeros(0, dtype = np.uint64)
+        self.origin = None
+        self.end = None
+        self.diff = np.zeros((len(self.windows), 0), dtype = np.int64)
+        # sources already applied, e.g. cache partition -> content hash
+        self.applied = {}
+
+    @property
+    def late_days(self):
+        """How far before a user's last active day an event may still arrive and be counted exactly."""
+        return HORIZON - max(self.windows.values())
+
+    def _reserve(self, users, lo, hi):
+        if users > len(self.last):
+            self.last = np.concatenate([self.last, np.full(users - len(self.last), _NEVER, dtype = np.int32)])
+            self.mask = np.concatenate([self.mask, np.zeros(users - len(self.mask), dtype = np.uint64)])
+        hi += max(self.windows.values()) + 1
+        if self.origin is None:
+            self.origin = lo
+        if lo < self.origin:
+            self.diff = np.concatenate([np.zeros((len(self.windows), self.origin - lo), dtype = np.int64), self.diff], axis = 1)
+            self.origin = lo
+        if hi - self.origin > self.diff.shape[1]:
+            self.diff = np.concatenate([self.diff, np.zeros((len(self.windows), hi - self.origin - self.diff.shape[1]), dtype = np.int64)], axis = 1)
+
+    @traced
+    def update(self, users, days):
+        """Add active events: `users` are non-negative user codes, `days` day numbers (see day_numbers)."""
+        users = np.asarray(users, dtype = np.int64)
+        days = np.asarray(days, dtype = np.int64)
+        if not len(users):
+            return self
+        lo = days.min()
+        key = np.unique(users << 32 | (days - lo))
+        users, days = key >> 32, (key & 0xFFFFFFFF) + lo
+        self._reserve(int(users.max()) + 1, int(lo), int(days.max()))
+        self.end = int(days.max()) if self.end is None else max(self.end, int(days.max()))
+
+        # users with a day at or before their last known day need the bitmap, the rest is vectorized
+        first = np.r_[True, users[1:] != users[:-1]]
+        late_user = np.zeros(len(self.last), dtype = bool)
+        late_user[users[first][days[first] <= self.last[users[first]]]] = True
+        late = late_user[users]
+        self._update_late(users[late], days[late])
+
+        users, days = users[~late], days[~late]
+        if not len(users):
+            return self
+        first = np.r_[True, users[1:] != users[:-1]]
+        prev = np.where(first, self.last[users], np.r_[_NEVER, days[:-1]])
+        for row, w in enumerate(self.windows.values()):
+            start = np.maximum(days, prev + w)
+            new = start < days + w
+            np.add.at(self.diff[row], start[new] - self.origin, 1)
+            np.add.at(self.diff[row], days[new] + w - self.origin, -1)
+
+        starts = np.flatnonzero(first)
+        ends = np.r_[starts[1:], len(users)] - 1
+        u, newest = users[starts], days[ends]
+        age = newest[np.repeat(np.arange(len(u)), np.diff(np.r_[starts, len(users)]))] - days
+        bits = np.where(age < HORIZON, np.left_shift(np.uint64(1), np.minimum(age, HORIZON - 1).astype(np.uint64)), np.uint64(0))
+        shift = newest - self.last[u]
+        kept = np.where(shift < HORIZON, self.mask[u] << np.minimum(shift, HORIZON - 1).astype(np.uint64), np.uint64(0))
+        self.mask[u] = kept | np.bitwise_or.reduceat(bits, starts)
+        self.last[u] = newest
+        return self
+
+    def _update_late(self, users, days):
+        for u in np.unique(users):
+            new = set(days[users == u].tolist())
+            last, mask = int(self.last[u]), int(self.mask[u])
+            if min(new) < last - self.late_days:
+                raise ValueError(f'activity on day {min(new)} is more than {self.late_days} days before '
+                                 f'the last known activity ({last}) of user {u}')
+            known = {last - i for i in range(HORIZON) if mask >> i & 1}
+            for row, w in enumerate(self.windows.values()):
+                covered = {x + k for x in known for k in range(w)}
+                for day in {x + k for x in new - known for k in range(w)} - covered:
+                    self.diff[row, day - self.origin] += 1
+                    self.diff[row, day + 1 - self.origin] -= 1
+            newest = max(last, max(new))
+            self.mask[u] = sum(1 << (newest - x) for x in known | new if newest - x < HORIZON)
+            self.last[u] = newest
+
+    @traced
+    def rolling(self):
+        """DAU, WAU, MAU for every day from the first to the last day with activity."""
+        if self.origin is None:
+            return pd.DataFrame(columns = list(self.windows), index = pd.DatetimeIndex([], name = 'EventDate'))
+        n = self.end - self.origin + 1
+        counts = np.cumsum(self.diff, axis = 1)[:, :n]
+        index = pd.DatetimeIndex(np.arange(self.origin, self.end + 1).astype('datetime64[D]'), name = 'EventDate')
+        return pd.DataFrame(counts.T, index = index, columns = list(self.windows))
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents = True, exist_ok = True)
+        np.savez(path / 'state.npz', last = self.last, mask = self.mask, diff = self.diff)
+        meta = {'windows': self.windows, 'origin': self.origin, 'end': self.end, 'applied': self.applied}
+        (path / 'active.json').write_text(json.dumps(meta))
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        meta = json.loads((path / 'active.json').read_text())
+        engine = cls(meta['windows'])
+        with np.load(path / 'state.npz') as state:
+            engine.last, engine.mask, engine.diff = state['last'], state['mask'], state['diff']
+        engine.origin, engine.end, engine.applied = meta['origin'], meta['end'], meta['applied']
+        return engine
@@ -0,0 +1,305 @@
+# The steps of the notebook as pure functions: each takes data_fin and/or the
+# cube and returns DataFrames, nothing is plotted (see funnel_rca.plots).
+# run() chains them into every result of the analysis.
+
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+
+from .active import RollingActive, day_numbers
+from .attribution import attribute, touchpoints
+from .cache import open_cache, read_manifest, sync_cache
+from .cube import open_cube
+from .encoding import Codebook, encode_frame, memory_usage
+from .flags import ACTIVE_EVENTS, active_mask, add_flags
+from .funnels import FUNNELS, classify
+from .profiling import traced
+from .sequence import sequence_funnel, session_paths
+from .sketch import DEFAULT_ERROR, SketchFrame, period_labels
+
+
+BASELINE_COLS = ['SessionID', 'PseudoID', 'ActiveUsers', 'SessionswPurchases', 'UserswPurchases', 'order_id']
+
+
+@traced
+def prepare(cache_dir = 'event_cache', funnel = 'food_delivery', active_events = ACTIVE_EVENTS, report = False,
+            weeks = None, encode = True):
+    """Step 3: data_fin from the cache, encoded, with the flags, funnel steps and entry points.
+
+    `weeks` limits it to some partitions (see open_cache); encode=False keeps
+    IDs as strings, e.g. for partitions prepared in separate processes.
+    """
+    data_fin = open_cache(cache_dir, weeks = weeks)
+    mem_before = memory_usage(data_fin)
+    if encode:
+        data_fin = encode_frame(data_fin, Codebook(f'{cache_dir}/codes'))
+    if report:
+        print(pd.concat([mem_before, memory_usage(data_fin)], axis = 1, keys = ['MiB before', 'MiB after']).round(2))
+    data_fin = add_flags(data_fin, active_events)
+    data_fin[['funnel', 'funnel_order']] = classify(data_fin, FUNNELS[funnel]['steps'])
+    data_fin['EntryPoint'] = classify(data_fin, FUNNELS[funnel]['entry_points'], label = 'EntryPoint')['EntryPoint']
+    return data_fin
+
+
+@traced
+def baseline(data_fin, approx = False, error = DEFAULT_ERROR):
+    """Step 4: distinct sessions, users, active users, buyers and orders per week and per month."""
+    if approx:
+        daily_sketches = SketchFrame.build(data_fin, 'EventDate', BASELINE_COLS, error = error)
+        return (daily_sketches.rollup(period_labels('W-SUN', name = 'EventWeek')).estimate(),
+                daily_sketches.rollup(period_labels('M', name = 'EventMonth')).estimate())
+    return (data_fin.groupby('EventWeek')[BASELINE_COLS].nunique(),
+            data_fin.groupby('EventMonth')[BASELINE_COLS].nunique())
+
+
+@traced
+def rolling_active(cache_dir = 'event_cache', active_events = ACTIVE_EVENTS):
+    """Step 4: rolling DAU / WAU / MAU (1, 7 and 28 day windows) of active users for every day.
+
+    The engine state is kept in <cache_dir>/active, per set of active events,
+    and only cache partitions it has not seen yet are read; a changed or
+    removed partition, or a new one starting more than late_days before the
+    last day applied, rebuilds it.
+    """
+    path = Path(cache_dir) / 'active' / hashlib.sha256(repr(sorted(active_events)).encode()).hexdigest()[:16]
+    engine = RollingActive.load(path) if (path / 'active.json').exists() else RollingActive()
+    entries = sorted(read_manifest(cache_dir).values(), key = lambda e: e['start'])
+    current = {e['partition']: e['sha256'] for e in entries}
+    new = [e['start'] for e in entries if e['partition'] not in engine.applied]
+    if (any(current.get(p) != h for p, h in engine.applied.items())
+            or (new and engine.end is not None and day_numbers(new).min() < engine.end - engine.late_days)):
+        engine = RollingActive()
+    codebook = Codebook(f'{cache_dir}/codes')
+    for e in entries:
+        if e['partition'] in engine.applied:
+            continue
+        week = open_cache(cache_dir, columns = ['PseudoID', 'EventDate', 'EventName', 'screen'], weeks = (e['start'], e['start']))
+        week = week[active_mask(week, active_events) & week['PseudoID'].notna().to_numpy()]
+        engine.update(codebook.encode('PseudoID', week['PseudoID']), day_numbers(week['EventDate']))
+        engine.applied[e['partition']] = e['sha256']
+    codebook.save()
+    engine.save(path)
+    return engine.rolling()
+
+
+@traced
+def service_split(data_fin, cube, approx = False, error = DEFAULT_ERROR):
+    """Step 5: weekly orders, buyers, purchase sessions and payment failures per service.
+
+    Returns a dict with order_types, buyers_by_types, sessions_by_types,
+    cancelled_order_fd, cancelled_order_gd, orders_all and orders_per_buyer.
+    """
+    if approx:
+        service_sketches = (SketchFrame.build(data_fin[data_fin['service'].notna()], ['EventDate', 'service'],
+                                              ['order_id', 'UserswPurchases', 'SessionswPurchases'], error = error)
+                            .rollup(period_labels('W-SUN', name = 'EventWeek')).estimate())
+        order_types = service_sketches['order_id'].unstack()
+        buyers_by_types = service_sketches['UserswPurchases'].unstack()
+        sessions_by_types = service_sketches['SessionswPurchases'].unstack()
+    else:
+        order_types = cube.query(['EventWeek', 'service'], 'order_id')['order_id'].unstack()
+        buyers_by_types = (data_fin[data_fin['service'].notna()][['EventWeek', 'UserswPurchases', 'service']]
+                           .pivot_table(values = 'UserswPurchases', index = 'EventWeek', columns = 'service', aggfunc = 'nunique'))
+        sessions_by_types = (data_fin[data_fin['service'].notna()][['EventWeek', 'SessionswPurchases', 'service']]
+                             .pivot_table(values = 'SessionswPurchases', index = 'EventWeek', columns = 'service', aggfunc = 'nunique'))
+
+    cancelled = {}
+    for service, suffix in (('food_delivery', 'fd'), ('grocery_delivery', 'gd')):
+        cancelled[suffix] = (data_fin[(data_fin['service'] == service) & (data_fin['reason'].notna())][['EventWeek', 'order_id', 'service', 'reason']]
+                             .pivot_table(values = 'order_id', index = 'EventWeek', aggfunc = 'nunique'))
+    return service_tables(order_types, buyers_by_types, sessions_by_types, cancelled['fd'], cancelled['gd'])
+
+
+def service_tables(order_types, buyers_by_types, sessions_by_types, cancelled_order_fd, cancelled_order_gd):
+    """The step 5 dict from the weekly per-service counts (also used by funnel_rca.sql)."""
+    orders_all = (order_types.merge(pd.concat([cancelled_order_fd.add_suffix('_fd'), cancelled_order_gd.add_suffix('_gd')], axis = 1),
+                                    left_index = True, right_index = True, how = 'left'))
+    orders_all['cancellation_ratio_fd'] = orders_all['order_id_fd'] / orders_all['food_delivery']
+    orders_all['cancellation_ratio_gd'] = orders_all['order_id_gd'] / orders_all['grocery_delivery']
+
+    orders_per_buyer = order_types.merge(buyers_by_types, left_index = True, right_index = True, suffixes = ('_o', '_b')).reset_index()
+    orders_per_buyer['orders_per_buyer_fd'] = orders_per_buyer['food_delivery_o'] / orders_per_buyer['food_delivery_b']
+    orders_per_buyer['orders_per_buyer_gd'] = orders_per_buyer['grocery_delivery_o'] / orders_per_buyer['grocery_delivery_b']
+    orders_per_buyer = orders_per_buyer.iloc[:-1, [0, 5, 6]]
+
+    return {'order_types': order_types, 'buyers_by_types': buyers_by_types, 'sessions_by_types': sessions_by_types,
+            'cancelled_order_fd': cancelled_order_fd, 'cancelled_order_gd': cancelled_order_gd,
+            'orders_all': orders_all, 'orders_per_buyer': orders_per_buyer}
+
+
+@traced
+def funnel_counts(cube):
+    """Step 6: (funnel_fin, funnel_prep_det) - sessions and users per funnel step with conversion
+    from the first and the previous step, and users per step and week."""
+    is_step = {'funnel': lambda f: f != ''}
+    return funnel_tables(cube.query(['funnel', 'funnel_order'], ['SessionID', 'PseudoID'], where = is_step),
+                         cube.query(['EventWeek', 'funnel', 'funnel_order'], ['SessionID', 'PseudoID'], where = is_step))
+
+
+def funnel_tables(by_step, by_week_step):
+    """(funnel_fin, funnel_prep_det) from distinct sessions and users per (funnel, funnel_order)
+    and per (EventWeek, funnel, funnel_order)."""
+    funnel_prep_gr = by_step.reset_index().set_index('funnel_order')
+    ep_users = max(funnel_prep_gr[funnel_prep_gr['funnel'] == 'Enter Funnel']['PseudoID'])
+    ep_sessions = max(funnel_prep_gr[funnel_prep_gr['funnel'] == 'Enter Funnel']['SessionID'])
+
+    funnel_fin = funnel_prep_gr.sort_index()
+    funnel_fin['Sessions_CR_1st'] = funnel_fin['SessionID'] / ep_sessions
+    funnel_fin['Users_CR_1st'] = funnel_fin['PseudoID'] / ep_users
+    funnel_fin['Sessions_CR_prev'] = funnel_fin['SessionID'] / funnel_fin['SessionID'].shift(1)
+    funnel_fin['Users_CR_prev'] = funnel_fin['PseudoID'] / funnel_fin['PseudoID'].shift(1)
+
+    funnel_prep_det = (by_week_step.reset_index().set_index('EventWeek')
+                       .pivot_table(values = 'PseudoID', index = 'EventWeek', columns = ['funnel_order', 'funnel']))
+    return funnel_fin, funnel_prep_det
+
+
+@traced
+def strict_funnel(data_fin, funnel = 'food_delivery', store = None):
+    """Step 7: sessions that passed the funnel steps in order, see funnel_rca.sequence.
+
+    With an EventStore (funnel_rca.store) the sessions are scanned from it instead of data_fin.
+    """
+    sequence = FUNNELS[funnel]['sequence']
+    paths = store.session_paths(sequence) if store is not None else session_paths(data_fin, sequence)
+    return sequence_funnel(paths, sequence, labels = {r.order: r.label for r in FUNNELS[funnel]['steps']})
+
+
+@traced
+def app_version_rate(cube):
+    """Step 9: (app, t) - weekly sessions per app version, all and entering the funnel, and their ratio."""
+    return app_version_tables(cube.query(['EventWeek', 'AppVersion'], 'SessionID'),
+                              cube.query(['EventWeek', 'AppVersion'], 'SessionID', where = {'funnel_order': 1}))
+
+
+def app_version_tables(sessions, funnel_sessions):
+    """(app, t) from distinct sessions per (EventWeek, AppVersion), all and entering the funnel."""
+    app_ver_ausers = sessions.reset_index().pivot_table(values = 'SessionID', index = 'EventWeek', columns = 'AppVersion')
+    app_ver_fdusers = funnel_sessions.reset_index().pivot_table(values = 'SessionID', index = 'EventWeek', columns = 'AppVersion')
+    app = pd.merge(app_ver_ausers, app_ver_fdusers, left_index = True, right_index = True, suffixes = ('_a', '_fd'))
+
+    l = int(len(app.columns) / 2)
+    num = app.iloc[:-1, l:].to_numpy()
+    den = app.iloc[:-1, :l].to_numpy()
+    t = pd.DataFrame(num / den, index = app.iloc[:-1].index, columns = app.iloc[:, :l].columns)
+    return app, t
+
+
+@traced
+def entry_points(cube):
+    """Step 10: weekly users and sessions per app version and funnel entry point."""
+    return entry_point_table(cube.query(['EventWeek', 'AppVersion', 'EntryPoint'], ['PseudoID', 'SessionID'],
+                                        where = {'EntryPoint': lambda e: e != ''}))
+
+
+def entry_point_table(ep_groups):
+    """ep_groups from distinct users and sessions per (EventWeek, AppVersion, EntryPoint)."""
+    return ep_groups.pivot_table(values = ['PseudoID', 'SessionID'], index = ['EventWeek', 'AppVersion'], columns = 'EntryPoint').reset_index()
+
+
+@traced
+def order_attribution(data_fin, model = 'last', window = None, store = None):
+    """Step 11: (ep_merge, ep_merge_gr, ep_merge_gr_t) - orders with their entry point,
+    weekly orders per app version and entry point, and weekly orders per entry point.
+
+    With an EventStore (funnel_rca.store) the orders are attributed from it instead of data_fin.
+    """
+    if store is not None:
+        return attribution_tables(store.attribute(model, window))
+    ep, ep_orders = touchpoints(data_fin)
+    ep_merge = (attribute(ep, ep_orders, model = model, window = window)
+                .rename(columns = {'AppVersion': 'AppVersion_o'})[['EventDate', 'order_id', 'EntryPoint', 'AppVersion_o']])
+    return attribution_tables(ep_merge)
+
+
+def attribution_tables(ep_merge):
+    """(ep_merge, ep_merge_gr, ep_merge_gr_t) from the attributed orders (EventDate, order_id, EntryPoint, AppVersion_o)."""
+    ep_merge['EventWeek'] = pd.to_datetime(ep_merge['EventDate']).dt.to_period('W-SUN')
+    ep_merge_gr = pd.DataFrame(ep_merge.groupby(['EventWeek', 'EntryPoint', 'AppVersion_o'])['order_id'].nunique())
+    ep_merge_gr = ep_merge_gr.pivot_table(values = 'order_id', index = ['EventWeek', 'AppVersion_o'], columns = 'EntryPoint').reset_index()
+    ep_merge_gr_t = (pd.DataFrame(ep_merge.groupby(['EventWeek', 'EntryPoint'])['order_id'].nunique())
+                     .pivot_table(values = 'order_id', index = 'EventWeek', columns = 'EntryPoint'))
+    return ep_merge, ep_merge_gr, ep_merge_gr_t
+
+
+@traced
+def run(data_dir = '.', cache_dir = 'event_cache', approx = False, error = DEFAULT_ERROR,
+        attribution_model = 'last', attribution_window = None, workers = None, backend = 'pandas', memory_limit = None,
+        memo = None, memo_size = '2GB', event_store = False):
+    """The whole analysis without plots: every result table by name.
+
+    backend='partitioned' prepares every week in its own process and merges
+    per-week partial aggregates (funnel_rca.partitioned); backend='duckdb'
+    computes the same tables as SQL over the event cache (funnel_rca.sql)
+    without loading the events into memory, and has no strict funnel
+    (funnel_seq). Approximate counts are only available with 'pandas'.
+
+    With `memo` (a directory) the pandas path runs as the stages of
+    funnel_rca.stages, memoized there up to `memo_size`; only stages whose
+    inputs or definitions changed are recomputed, and a hit / miss report per
+    stage is printed. event_store=True runs the strict funnel and the
+    attribution over the memory-mapped EventStore of the cache (funnel_rca.store);
+    it cannot be combined with memo.
+    """
+    if backend not in ('pandas', 'partitioned', 'duckdb'):
+        raise ValueError(f"unknown backend {backend!r}, expected 'pandas', 'partitioned' or 'duckdb'")
+    if backend != 'pandas' and approx:
+        raise ValueError("approx is only available with backend = 'pandas'")
+    if backend != 'pandas' and memo is not None:
+        raise ValueError("memo is only available with backend = 'pandas'")
+    if backend != 'pandas' and event_store:
+        raise ValueError("event_store is only available with backend = 'pandas'")
+    if memo is not None and event_store:
+        raise ValueError('event_store is not available with memo')
+    sync_cache(data_dir, cache_dir, workers = workers)
+
+    if memo is not None:
+        from .stages import MemoStore, analysis_pipeline, results as stage_results
+
+        pipeline = analysis_pipeline(cache_dir, approx = approx, error = error, attribution_model = attribution_model,
+                                     attribution_window = attribution_window, store = MemoStore(memo, memo_size))
+        results = stage_results(pipeline)
+        print(pipeline.report.round(3).to_string())
+        return results
+
+    results = {'active_rolling': rolling_active(cache_dir)}
+
+    if backend == 'partitioned':
+        from .partitioned import aggregate, tables
+
+        results.update(tables(aggregate(cache_dir, workers), attribution_model, attribution_window))
+        return results
+
+    if backend == 'duckdb':
+        from .sql import DuckDBBackend
+
+        db = DuckDBBackend(cache_dir = cache_dir, memory_limit = memory_limit)
+        try:
+            results['df_group_week'], results['df_group_month'] = db.baseline()
+            results.update(db.service_split())
+            results['funnel_fin'], results['funnel_prep_det'] = db.funnel_counts()
+            results['app'], results['app_entry_rate'] = db.app_version_rate()
+            results['ep_groups'] = db.entry_points()
+            _, results['ep_merge_gr'], results['ep_merge_gr_t'] = db.order_attribution(attribution_model, attribution_window)
+        finally:
+            db.close()
+        return results
+
+    data_fin = prepare(cache_dir)
+    cube = open_cube(cache_dir, data_fin)
+    if event_store:
+        from .store import open_store
+
+        store = open_store(cache_dir, data_fin)
+    else:
+        store = None
+
+    results['df_group_week'], results['df_group_month'] = baseline(data_fin, approx, error)
+    results.update(service_split(data_fin, cube, approx, error))
+    results['funnel_fin'], results['funnel_prep_det'] = funnel_counts(cube)
+    results['funnel_seq'] = strict_funnel(data_fin, store = store)
+    results['app'], results['app_entry_rate'] = app_version_rate(cube)
+    results['ep_groups'] = entry_points(cube)
+    _, results['ep_merge_gr'], results['ep_merge_gr_t'] = order_attribution(data_fin, attribution_model, attribution_window, store)
+    return results
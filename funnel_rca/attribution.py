@@ -0,0 +1,61 @@
+# Entry point -> order attribution with a sorted as-of join.
+# Each order is linked to one entry point click of the same session in
+# O(n log n): the last one before it (last touch) or the first one (first
+# touch), optionally only within an attribution window.
+
+import pandas as pd
+
+from .profiling import traced
+
+
+SESSION_KEYS = ['PseudoID', 'SessionID', 'EventDate']
+# funnel_order of the 'Order created fail Page' / 'Order created success Page' steps
+ORDER_STEPS = [12, 13]
+
+
+@traced
+def touchpoints(data_fin, order_steps = ORDER_STEPS):
+    """Entry point clicks and order events of data_fin, each without duplicate rows."""
+    cols = SESSION_KEYS + ['EventTimestamp', 'AppVersion']
+    entries = (data_fin.loc[data_fin['EntryPoint'] != '', cols + ['EntryPoint']]
+               .drop_duplicates().reset_index(drop = True))
+    orders = (data_fin.loc[data_fin['order_id'].notna() & data_fin['funnel_order'].isin(order_steps), cols + ['order_id']]
+              .drop_duplicates().reset_index(drop = True))
+    return entries, orders
+
+
+@traced
+def attribute(entries, orders, model = 'last', window = None, by = SESSION_KEYS, keep_unattributed = False):
+    """Attribute every order to an entry point of the same `by` session.
+
+    model='last' picks the latest entry point strictly before the order,
+    model='first' the earliest one. `window` (a Timedelta) only considers entry
+    points at most that long before the order. Returns the order rows with
+    EntryPoint, EventTimestamp_e (entry time) and AppVersion_e added; orders
+    without an entry point are dropped unless keep_unattributed=True.
+    """
+    if model not in ('last', 'first'):
+        raise ValueError(f"unknown attribution model {model!r}, expected 'last' or 'first'")
+    by = list(by)
+    window = pd.Timedelta(window) if window is not None else None
+
+    e = entries[by + ['EventTimestamp', 'EntryPoint', 'AppVersion']].rename(
+        columns = {'EventTimestamp': 'EventTimestamp_e', 'AppVersion': 'AppVersion_e'})
+    e['_t'] = e['EventTimestamp_e']
+    o = orders.copy()
+    if model == 'last':
+        o['_t'] = o['EventTimestamp']
+        how = dict(direction = 'backward', allow_exact_matches = False, tolerance = window)
+    else:
+        # earliest entry point at or after the window start (or the session start: any entry point)
+        start = o['EventTimestamp'] - window if window is not None else min(o['EventTimestamp'].min(), e['_t'].min())
+        o['_t'] = pd.Series(start, index = o.index).astype(e['_t'].dtype)
+        how = dict(direction = 'forward', allow_exact_matches = True)
+
+    out = pd.merge_asof(o.sort_values('_t'), e.sort_values('_t'), on = '_t', by = by, **how).drop(columns = '_t')
+    if model == 'first':
+        late = ~(out['EventTimestamp_e'] < out['EventTimestamp'])
+        out.loc[late, ['EntryPoint', 'EventTimestamp_e', 'AppVersion_e']] = None
+    if not keep_unattributed:
+        out = out[out['EntryPoint'].notna()]
+    return out.reset_index(drop = True)
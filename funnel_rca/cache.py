@@ -0,0 +1,134 @@
+# Persistent columnar cache of the cleaned event table (data_fin).
+# One Parquet partition per weekly export, keyed by source file name and
+# content hash, so a new weekly file is the only thing ingested on rerun.
+
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .loader import CHUNKSIZE, find_exports, read_export
+from .params import flatten
+from .profiling import traced
+
+
+MANIFEST = 'manifest.json'
+
+
+@traced
+def clean(chunk):
+    """Raw export rows -> data_fin rows: projected JSON keys, EventMonth/EventWeek, parsed EventTimestamp."""
+    data_fin = flatten(chunk)
+    event_date = pd.to_datetime(data_fin['EventDate'])
+    data_fin['EventMonth'] = event_date.dt.to_period('M')
+    data_fin['EventWeek'] = event_date.dt.to_period('W-SUN')
+    data_fin['EventTimestamp'] = pd.to_datetime(data_fin['EventTimestamp'], unit = 'ms')
+    return data_fin
+
+
+def file_hash(file, block = 1 << 20):
+    h = hashlib.sha256()
+    with open(file, 'rb') as fh:
+        while chunk := fh.read(block):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_manifest(cache_dir):
+    p = Path(cache_dir) / MANIFEST
+    return json.loads(p.read_text()) if p.exists() else {}
+
+
+def _write_manifest(cache_dir, manifest):
+    p = Path(cache_dir) / MANIFEST
+    tmp = p.with_suffix('.tmp')
+    tmp.write_text(json.dumps(manifest, indent = 1, sort_keys = True))
+    os.replace(tmp, p)
+
+
+@traced
+def _ingest(file, partition, chunksize = CHUNKSIZE):
+    """Clean one weekly export and write it as a single Parquet partition."""
+    table = pa.Table.from_pandas(read_export(file, chunksize = chunksize, transform = clean), preserve_index = False)
+    partition.mkdir(parents = True, exist_ok = True)
+    tmp = partition / 'part.parquet.tmp'
+    pq.write_table(table, tmp)
+    os.replace(tmp, partition / 'part.parquet')
+    return table.num_rows
+
+
+@traced
+def sync_cache(data_dir = '.', cache_dir = 'event_cache', workers = None):
+    """Bring the cache in line with the exports in `data_dir`.
+
+    Only new or changed files (by sha256 of the content) are parsed, in a
+    process pool; partitions of files that disappeared are dropped. Files whose
+    size and mtime match the manifest are not rehashed. Returns the names of
+    the ingested files.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents = True, exist_ok = True)
+    manifest = read_manifest(cache_dir)
+
+    todo = []
+    current = {}
+    for start, end, f in find_exports(data_dir):
+        st = f.stat()
+        entry = manifest.get(f.name)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            current[f.name] = entry
+            continue
+        digest = file_hash(f)
+        if entry and entry['sha256'] == digest:
+            current[f.name] = dict(entry, mtime_ns = st.st_mtime_ns)
+            continue
+        current[f.name] = {'sha256': digest, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                           'partition': f'week={start.isoformat()}', 'start': start.isoformat(), 'end': end.isoformat()}
+        todo.append(f)
+
+    for name, entry in manifest.items():
+        if name not in current:
+            shutil.rmtree(cache_dir / entry['partition'], ignore_errors = True)
+
+    if todo:
+        workers = workers or min(len(todo), os.cpu_count() or 1)
+        partitions = [cache_dir / current[f.name]['partition'] for f in todo]
+        if workers == 1:
+            rows = list(map(_ingest, todo, partitions))
+        else:
+            with ProcessPoolExecutor(max_workers = workers) as pool:
+                rows = list(pool.map(_ingest, todo, partitions))
+        for f, n in zip(todo, rows):
+            current[f.name]['rows'] = n
+
+    _write_manifest(cache_dir, current)
+    return [f.name for f in todo]
+
+
+@traced
+def open_cache(cache_dir = 'event_cache', columns = None, weeks = None):
+    """Cached data_fin as a DataFrame, read through memory-mapped Parquet files.
+
+    `weeks` optionally limits the partitions to exports starting in that
+    (first, last) date range, given as ISO strings.
+    """
+    cache_dir = Path(cache_dir)
+    entries = sorted(read_manifest(cache_dir).values(), key = lambda e: e['start'])
+    if weeks is not None:
+        first, last = weeks
+        entries = [e for e in entries if first <= e['start'] <= last]
+    tables = [pq.read_table(cache_dir / e['partition'] / 'part.parquet', columns = columns, memory_map = True)
+              for e in entries]
+    if not tables:
+        return pd.DataFrame(columns = columns)
+    data_fin = pa.concat_tables(tables, promote_options = 'permissive').unify_dictionaries().to_pandas()
+    # unified dictionaries are in order of appearance, keep categories sorted as elsewhere
+    for col in data_fin.select_dtypes('category'):
+        data_fin[col] = data_fin[col].cat.reorder_categories(sorted(data_fin[col].cat.categories))
+    return data_fin
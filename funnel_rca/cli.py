@@ -0,0 +1,100 @@
+# Headless entry point: runs the whole analysis and writes every result table
+# (and, with --plots, every figure) to an output directory.
+#
+#   python -m funnel_rca [--data .] [--cache event_cache] [--out results] [--approx]
+#                        [--attribution-model last] [--attribution-window 30min] [--plots [--plot-format png svg]]
+#                        [--backend partitioned|duckdb] [--workers 8] [--memory-limit 2GB] [--memo memo --memo-size 2GB]
+#                        [--event-store]
+#                        [--drilldown 2025-10-06:2025-11-02 2025-11-17:2025-12-14 [--drill-target orders]]
+#                        [--profile trace.json]
+
+import argparse
+import time
+from pathlib import Path
+
+from . import profiling
+from .analysis import run
+from .drilldown import TARGETS, drill_cube, rank_causes
+from .profiling import traced
+from .sketch import DEFAULT_ERROR
+
+
+def _weeks(spec):
+    # 'first:last' or a single date
+    return tuple(spec.split(':', 1)) if ':' in spec else spec
+
+
+@traced
+def write_results(results, out):
+    out = Path(out)
+    out.mkdir(parents = True, exist_ok = True)
+    for name, df in results.items():
+        df.to_csv(out / f'{name}.csv')
+
+
+def write_figures(results, out, formats = ('png',), workers = None):
+    import matplotlib
+    matplotlib.use('Agg')
+    from .render import render_figures, report
+
+    drawn = render_figures(results, out, formats, workers)
+    print(f"{(drawn['status'] == 'drawn').sum()} of {len(drawn)} figures drawn, the others did not change; "
+          f'report: {report(out)}')
+    return drawn
+
+
+def main(argv = None):
+    ap = argparse.ArgumentParser(prog = 'funnel_rca', description = 'Food Delivery funnel root cause analysis, without a notebook.')
+    ap.add_argument('--data', default = '.', help = 'directory with the weekly exports')
+    ap.add_argument('--cache', default = 'event_cache')
+    ap.add_argument('--out', default = 'results', help = 'directory for the result tables (CSV) and figures (PNG)')
+    ap.add_argument('--approx', action = 'store_true', help = 'HLL distinct counts for the baseline and service split')
+    ap.add_argument('--error', type = float, default = DEFAULT_ERROR)
+    ap.add_argument('--attribution-model', choices = ['last', 'first'], default = 'last')
+    ap.add_argument('--attribution-window', default = None, help = "e.g. '30min'")
+    ap.add_argument('--workers', type = int, default = None)
+    ap.add_argument('--backend', choices = ['pandas', 'partitioned', 'duckdb'], default = 'pandas',
+                    help = 'partitioned merges per-week partial aggregates computed in --workers processes; '
+                           'duckdb runs the metrics as SQL over the event cache, spilling to disk beyond --memory-limit')
+    ap.add_argument('--memory-limit', default = None, help = "DuckDB memory limit, e.g. '2GB'")
+    ap.add_argument('--memo', default = None, help = 'directory to memoize the stages of the pandas path in; '
+                                                     'only stages whose inputs or definitions changed are recomputed')
+    ap.add_argument('--memo-size', default = '2GB', help = 'evict the least recently used stage results beyond this size')
+    ap.add_argument('--event-store', action = 'store_true',
+                    help = 'strict funnel and attribution over the memory-mapped, session-sorted event store')
+    ap.add_argument('--plots', action = 'store_true',
+                    help = 'also render the figures in --workers processes, skipping those whose data did not change, '
+                           'and put them into report.html (imports matplotlib)')
+    ap.add_argument('--plot-format', nargs = '+', choices = ['png', 'svg'], default = ['png'])
+    ap.add_argument('--drilldown', nargs = 2, metavar = ('BEFORE', 'AFTER'), default = None,
+                    help = "rank the segments explaining the change between two week ranges ('first:last' or a date)")
+    ap.add_argument('--drill-target', choices = sorted(TARGETS), default = 'orders')
+    ap.add_argument('--profile', default = None, metavar = 'TRACE',
+                    help = f'write a JSON trace of every stage (time, CPU, peak memory, rows) and a .folded flame graph '
+                           f'profile next to it; {profiling.ENV}=TRACE does the same for any entry point')
+    args = ap.parse_args(argv)
+
+    if args.profile:
+        profiling.enable()
+    t = time.perf_counter()
+    results = run(args.data, args.cache, approx = args.approx, error = args.error, workers = args.workers,
+                  attribution_model = args.attribution_model, attribution_window = args.attribution_window,
+                  backend = args.backend, memory_limit = args.memory_limit, memo = args.memo, memo_size = args.memo_size,
+                  event_store = args.event_store)
+    if args.drilldown:
+        results['drilldown'] = rank_causes(drill_cube(args.cache, workers = args.workers), _weeks(args.drilldown[0]),
+                                           _weeks(args.drilldown[1]), args.drill_target, workers = args.workers, top = None)
+    write_results(results, args.out)
+    if args.plots:
+        write_figures(results, args.out, args.plot_format, args.workers)
+    print(f'{len(results)} tables written to {args.out} in {time.perf_counter() - t:.1f}s')
+    if args.profile:
+        tracer = profiling.disable()
+        trace, folded = tracer.write(args.profile)
+        print(tracer.summary().head(10).round(3).to_string())
+        print(f'trace written to {trace}, flame graph profile to {folded}')
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# Materialized pre-aggregate cube over the analysis dimensions.
+# Built once from data_fin, stored next to the event cache (open_cube) and
+# queried for any rollup / slice of its dimensions without going back to the
+# raw events; it is only rebuilt when the cache or the funnel rules change.
+#
+# Distinct counts are not additive, so the cube keeps what is needed to merge
+# them: in exact mode the distinct (dimensions, id) pairs per measure, in
+# approximate mode one HLL sketch per dimension combination.
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .cache import read_manifest
+from .funnels import definition
+from .loader import concat_frames
+from .profiling import traced
+from .sketch import DEFAULT_ERROR, SketchFrame
+
+
+DIMENSIONS = ['EventWeek', 'service', 'AppVersion', 'EntryPoint', 'funnel_order', 'funnel']
+# distinct users, sessions and orders
+MEASURES = ['PseudoID', 'SessionID', 'order_id']
+
+
+def distinct_rows(frame):
+    """frame.drop_duplicates() through groupby codes: Period columns are compared as ordinals,
+    where drop_duplicates would box every value into a Period object."""
+    codes = frame.groupby(list(frame.columns), observed = True, dropna = False, sort = False).ngroup().to_numpy()
+    _, first = np.unique(codes, return_index = True)
+    return frame.iloc[np.sort(first)].reset_index(drop = True)
+
+
+def _mask(frame, where):
+    """Row mask for {dimension: value | list of values | callable(column) -> mask}."""
+    mask = np.ones(len(frame), dtype = bool)
+    for dim, cond in (where or {}).items():
+        col = frame[dim]
+        if callable(cond):
+            m = cond(col)
+        elif isinstance(cond, (list, tuple, set, range)):
+            m = col.isin(list(cond))
+        else:
+            m = col == cond
+        mask &= np.asarray(m, dtype = bool)
+    return mask
+
+
+class Cube:
+    """Distinct users / sessions / orders per combination of DIMENSIONS."""
+
+    def __init__(self, dimensions, measures, tables = None, sketches = None):
+        self.dimensions = list(dimensions)
+        self.measures = list(measures)
+        self.tables = tables
+        self.sketches = sketches
+
+    @property
+    def approx(self):
+        return self.sketches is not None
+
+    @classmethod
+    @traced
+    def build(cls, data_fin, dimensions = DIMENSIONS, measures = MEASURES, approx = False, error = DEFAULT_ERROR):
+        dimensions = list(dimensions)
+        if approx:
+            return cls(dimensions, measures, sketches = SketchFrame.build(data_fin, dimensions, measures, error = error))
+        tables = {m: distinct_rows(data_fin[dimensions + [m]].dropna(subset = [m])) for m in measures}
+        return cls(dimensions, measures, tables = tables)
+
+    @classmethod
+    def concat(cls, cubes):
+        """Merge cubes built from disjoint (or overlapping) slices of the events, e.g. one per week."""
+        cubes = list(cubes)
+        first = cubes[0]
+        if first.approx:
+            sketches = first.sketches
+            for c in cubes[1:]:
+                sketches = sketches.merge(c.sketches)
+            return cls(first.dimensions, first.measures, sketches = sketches)
+        tables = {m: distinct_rows(concat_frames([c.tables[m] for c in cubes])) for m in first.measures}
+        return cls(first.dimensions, first.measures, tables = tables)
+
+    def query(self, by, measures = None, where = None):
+        """Distinct counts per `by` group, like data_fin[where].groupby(by)[measures].nunique().
+
+        `where` slices any cube dimension ({dim: value | list | callable}).
+        Groups with a missing dimension value are dropped, as groupby does.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        measures = self.measures if measures is None else ([measures] if isinstance(measures, str) else list(measures))
+        if self.approx:
+            return self._query_sketch(by, measures, where)
+        out = []
+        for m in measures:
+            t = self.tables[m]
+            t = t[_mask(t, where)]
+            out.append(t.groupby(by, observed = True)[m].nunique())
+        return pd.concat(out, axis = 1)
+
+    def _query_sketch(self, by, measures, where):
+        sf = self.sketches
+        keys = sf.index.to_frame(index = False)
+        sf = sf.select(_mask(keys, where))
+        keys = sf.index.to_frame(index = False)
+        known = keys[by].notna().all(axis = 1).to_numpy()
+        sf = sf.select(known)
+        labels = (pd.MultiIndex.from_frame(keys.loc[known, by]) if len(by) > 1
+                  else pd.Index(keys.loc[known, by[0]], name = by[0]))
+        est = sf.rollup(labels).estimate()
+        return est[measures]
+
+    def save(self, path, fingerprint = None):
+        path = Path(path)
+        path.mkdir(parents = True, exist_ok = True)
+        meta = {'dimensions': self.dimensions, 'measures': self.measures, 'approx': self.approx, 'fingerprint': fingerprint}
+        if self.approx:
+            meta['p'] = self.sketches.p
+            self.sketches.index.to_frame(index = False).to_parquet(path / 'index.parquet', index = False)
+            np.savez_compressed(path / 'sketches.npz', **self.sketches.sketches)
+        else:
+            for m, t in self.tables.items():
+                t.to_parquet(path / f'{m}.parquet', index = False)
+        (path / 'cube.json').write_text(json.dumps(meta))
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        meta = json.loads((path / 'cube.json').read_text())
+        if meta['approx']:
+            keys = pd.read_parquet(path / 'index.parquet')
+            index = pd.MultiIndex.from_frame(keys) if keys.shape[1] > 1 else pd.Index(keys.iloc[:, 0])
+            with np.load(path / 'sketches.npz') as regs:
+                sketches = {m: regs[m] for m in meta['measures']}
+            return cls(meta['dimensions'], meta['measures'], sketches = SketchFrame(index, sketches, meta['p']))
+        tables = {m: pd.read_parquet(path / f'{m}.parquet') for m in meta['measures']}
+        return cls(meta['dimensions'], meta['measures'], tables = tables)
+
+
+@traced
+def open_cube(cache_dir = 'event_cache', data_fin = None, funnel = 'food_delivery', dimensions = DIMENSIONS, measures = MEASURES):
+    """The exact Cube of the event cache in <cache_dir>/cube, rebuilt from data_fin (prepared from
+    the cache if not given) when the cache, the rules of the funnel or the dimensions and measures changed."""
+    path = Path(cache_dir) / 'cube'
+    manifest = {e['partition']: e['sha256'] for e in read_manifest(cache_dir).values()}
+    fingerprint = {'manifest': manifest, **definition(funnel), 'dimensions': list(dimensions), 'measures': list(measures)}
+    if (path / 'cube.json').exists() and json.loads((path / 'cube.json').read_text()).get('fingerprint') == fingerprint:
+        return Cube.load(path)
+    if data_fin is None:
+        from .analysis import prepare
+
+        data_fin = prepare(cache_dir, funnel)
+    cube = Cube.build(data_fin, dimensions, measures)
+    cube.save(path, fingerprint)
+    return cube
@@ -0,0 +1,234 @@
+# Automated drill-down: which segments explain the change of a metric.
+# Steps 5-11 narrow the drop down by hand (service, funnel step, app version,
+# entry point). Here every dimension and every pair of dimensions is scored
+# from a cube of sessions - one row per session with its service, app
+# version, device, traffic source, entry point, deepest funnel step and user
+# cohort - so the candidates only need distinct counts out of pre-aggregated
+# (dimensions, id) pairs, never the raw events. Candidates are independent
+# and are scored in a process pool.
+#
+# A segment's score is how far it moved beyond its share of the total change,
+# as a fraction of the total: a change spread evenly over all segments scores
+# 0 everywhere; losing 70% of the orders of a segment that had a tenth of
+# them, and nothing else, scores -0.063. Changes are measured against the segment's before
+# rate (e.g. orders per session) by default, so volume moving between
+# segments - users updating to a new app version - is not taken for a cause.
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .analysis import prepare
+from .attribution import attribute, touchpoints
+from .cache import read_manifest
+from .cube import Cube
+from .funnels import FUNNELS, definition
+from .profiling import traced
+
+
+DRILL_DIMENSIONS = ['service', 'AppVersion', 'DeviceCategory', 'TrafficSource', 'EntryPoint', 'funnel',
+                    'is_new_user', 'cohort_month']
+# target metric -> cube measure
+TARGETS = {
+    'orders': 'order_id',
+    'buyers': 'UserswPurchases',
+    'purchase_sessions': 'SessionswPurchases',
+    'sessions': 'SessionID',
+    'users': 'PseudoID',
+}
+NONE = 'none'
+
+
+@traced
+def session_frame(data_fin, funnel = 'food_delivery'):
+    """One row per session (and per order of it) with the session's value of every DRILL_DIMENSIONS.
+
+    EntryPoint is the entry point the session's first order is attributed to
+    (step 11, last touch), or the session's last entry point click if it has
+    no order; funnel is the deepest funnel step the session reached.
+    """
+    first = (data_fin.sort_values('EventTimestamp', kind = 'stable')
+             .drop_duplicates('SessionID')
+             .set_index('SessionID')[['PseudoID', 'EventWeek', 'AppVersion', 'DeviceCategory', 'TrafficSource',
+                                      'is_new_user', 'cohort_month']])
+    sessions = first.astype({c: object for c in first.columns if c not in ('EventWeek', 'PseudoID')})
+    sessions['is_new_user'] = sessions['is_new_user'].map({True: 'True', False: 'False'})
+
+    with_service = data_fin.loc[data_fin['service'].notna(), ['SessionID', 'service']].drop_duplicates('SessionID')
+    sessions['service'] = with_service.set_index('SessionID')['service'].astype(object)
+
+    entries, orders = touchpoints(data_fin)
+    last_click = entries.sort_values('EventTimestamp', kind = 'stable').drop_duplicates('SessionID', keep = 'last')
+    sessions['EntryPoint'] = last_click.set_index('SessionID')['EntryPoint']
+    first_order = orders.sort_values('EventTimestamp', kind = 'stable').drop_duplicates('SessionID')
+    attributed = attribute(entries, first_order, keep_unattributed = True).set_index('SessionID')['EntryPoint']
+    sessions.loc[attributed.index, 'EntryPoint'] = attributed
+
+    labels = {r.order: r.label for r in FUNNELS[funnel]['steps']}
+    sessions['funnel'] = data_fin.groupby('SessionID', observed = True)['funnel_order'].max().map(labels)
+    sessions[DRILL_DIMENSIONS] = sessions[DRILL_DIMENSIONS].fillna(NONE)
+
+    purchases = data_fin.loc[data_fin['SessionswPurchases'].notna(), 'SessionID'].unique()
+    sessions['SessionswPurchases'] = sessions.index.where(sessions.index.isin(purchases))
+    sessions['UserswPurchases'] = sessions['PseudoID'].where(sessions['SessionswPurchases'].notna())
+
+    session_orders = data_fin.loc[data_fin['order_id'].notna(), ['SessionID', 'order_id']].drop_duplicates()
+    return (sessions.rename_axis('SessionID').reset_index()
+            .merge(session_orders, on = 'SessionID', how = 'left'))
+
+
+def _partition_cube(cache_dir, start, funnel):
+    frame = session_frame(prepare(cache_dir, funnel, weeks = (start, start), encode = False), funnel)
+    return Cube.build(frame, ['EventWeek'] + DRILL_DIMENSIONS, list(TARGETS.values()))
+
+
+@traced
+def drill_cube(cache_dir = 'event_cache', funnel = 'food_delivery', workers = None):
+    """Cube of sessions over EventWeek and DRILL_DIMENSIONS, from the whole event cache.
+
+    One cube per cache partition is kept in <cache_dir>/drill, per funnel
+    and version of its rules, and only partitions added or changed since the
+    last call are prepared, so it is cheap to refresh after every weekly ingest.
+    """
+    rules = hashlib.sha256(json.dumps(definition(funnel)).encode()).hexdigest()[:16]
+    path = Path(cache_dir) / 'drill' / f'{funnel}-{rules}'
+    path.mkdir(parents = True, exist_ok = True)
+    applied_file = path / 'applied.json'
+    applied = json.loads(applied_file.read_text()) if applied_file.exists() else {}
+    entries = sorted(read_manifest(cache_dir).values(), key = lambda e: e['start'])
+    todo = [e for e in entries if applied.get(e['partition']) != e['sha256']]
+    workers = workers or min(len(todo), os.cpu_count() or 1) or 1
+    if workers == 1:
+        cubes = [_partition_cube(cache_dir, e['start'], funnel) for e in todo]
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            cubes = list(pool.map(_partition_cube, [cache_dir] * len(todo), [e['start'] for e in todo], [funnel] * len(todo)))
+    for e, cube in zip(todo, cubes):
+        cube.save(path / e['partition'])
+        applied[e['partition']] = e['sha256']
+    applied = {e['partition']: applied[e['partition']] for e in entries}
+    applied_file.write_text(json.dumps(applied))
+    if not applied:
+        raise ValueError(f'no partitions in the event cache {cache_dir}, run sync_cache first')
+    return Cube.concat(Cube.load(path / p) for p in applied)
+
+
+def week_range(weeks, spec):
+    """The weeks of `weeks` in `spec`: one date / week, or a (first, last) pair of them."""
+    first, last = (spec, spec) if isinstance(spec, (str, pd.Period, pd.Timestamp)) else spec
+    first = pd.Period(first, freq = 'W-SUN').start_time
+    last = pd.Period(last, freq = 'W-SUN').start_time
+    return [w for w in weeks if first <= w.start_time <= last]
+
+
+# candidate scoring runs in pool workers; the cube is sent once per worker
+_state = {}
+
+
+def _init(cube, measures, before, after):
+    _state.update(cube = cube, measures = measures, before = before, after = after)
+
+
+def _score(dims):
+    cube, measures = _state['cube'], _state['measures']
+    counts = pd.concat({p: cube.query(list(dims), measures, where = {'EventWeek': _state[p]}) for p in ('before', 'after')},
+                       axis = 1).fillna(0)
+    values = [s if isinstance(s, tuple) else (s,) for s in counts.index]
+    return dims, values, counts
+
+
+@traced
+def rank_causes(cube, before, after, target = 'orders', base = 'sessions', depth = 2, workers = None, top = 20):
+    """Segments of up to `depth` dimensions ranked by how much of the change of `target` they explain.
+
+    `before` and `after` are weeks or (first, last) week ranges (see week_range);
+    before counts are scaled to the length of the after period. With a `base`
+    metric each segment's `expected` value is its after `base` volume at its
+    before rate target / base (for a segment new since then, the mean before
+    rate of its dimension values that are not new, else the overall rate),
+    so a shift of volume between segments - e.g. users moving to a new app
+    version - is not taken for a cause; base=None compares the counts (the
+    only mode that drills into the funnel step a session got to).
+    `contribution` is the segment's share of the total difference to the
+    expected value, `share` its share of the expected total, and `score` the part of
+    its difference beyond share * total difference, relative to the expected
+    total; rows are ranked by the absolute score, negative means worse than
+    the rest.
+    """
+    for name in (target, base):
+        if name is not None and name not in TARGETS:
+            raise ValueError(f'unknown metric {name!r}, expected one of {sorted(TARGETS)}')
+    if base == target:
+        base = None
+    measure = TARGETS[target]
+    volume = TARGETS[base] if base is not None else measure
+    measures = [measure] + ([volume] if base is not None else [])
+    weeks = sorted(cube.tables[measure]['EventWeek'].unique())
+    before, after = week_range(weeks, before), week_range(weeks, after)
+    if not before or not after:
+        raise ValueError('no data in the before or after period')
+    scale = len(after) / len(before)
+
+    def total(m, period):
+        table = cube.tables[m]
+        return table.loc[table['EventWeek'].isin(period), m].nunique()
+
+    target_before, target_after = total(measure, before) * scale, total(measure, after)
+    volume_before, volume_after = total(volume, before) * scale, total(volume, after)
+    rate = target_before / volume_before if base is not None else None
+    expected_total = volume_after * rate if base is not None else target_before
+    total_delta = target_after - expected_total
+
+    # the deepest funnel step follows from whether the session ordered, it cannot explain a rate
+    dimensions = [d for d in DRILL_DIMENSIONS if base is None or d != 'funnel']
+    candidates = [c for k in range(1, depth + 1) for c in combinations(dimensions, k)]
+    workers = workers or min(len(candidates), os.cpu_count() or 1) or 1
+    if workers == 1:
+        _init(cube, measures, before, after)
+        scored = [_score(c) for c in candidates]
+    else:
+        with ProcessPoolExecutor(max_workers = workers, initializer = _init, initargs = (cube, measures, before, after)) as pool:
+            scored = list(pool.map(_score, candidates, chunksize = 4))
+
+    rows = []
+    # before rate of every single dimension value: a segment new since then is expected at the
+    # mean rate of its values that are not new (e.g. of the service, for service x new app version)
+    parent_rate, single = {}, {}
+    for dims, values, counts in sorted(scored, key = lambda c: len(c[0])):
+        out = pd.DataFrame({'dimensions': ' x '.join(dims), 'segment': [' x '.join(map(str, v)) for v in values],
+                            'before': counts[('before', measure)].to_numpy() * scale,
+                            'after': counts[('after', measure)].to_numpy()})
+        if base is not None:
+            v_before = counts[('before', volume)].to_numpy() * scale
+            v_after = counts[('after', volume)].to_numpy()
+            out['rate_before'] = np.divide(out['before'], v_before, out = np.full(len(out), np.nan), where = v_before > 0)
+            out['rate_after'] = np.divide(out['after'], v_after, out = np.full(len(out), np.nan), where = v_after > 0)
+            if len(dims) == 1:
+                parent_rate.update(((dims[0], v[0]), r) for v, r in zip(values, out['rate_before']))
+            fallback = [pd.Series([parent_rate.get((d, x)) for d, x in zip(dims, v)], dtype = float).mean()
+                        if len(dims) > 1 else np.nan for v in values]
+            rate_before = out['rate_before'].fillna(pd.Series(fallback, index = out.index)).fillna(rate)
+            out['expected'] = v_after * rate_before
+        else:
+            out['expected'] = out['before']
+        out['share'] = out['expected'] / expected_total
+        if len(dims) == 1:
+            single.update(((dims[0], v[0]), c) for v, c in zip(values, zip(out['before'], out['after'])))
+        else:
+            # a pair with the same counts as one of its values alone adds nothing to it
+            same = [any(single.get((d, x)) == c for d, x in zip(dims, v)) for v, c in zip(values, zip(out['before'], out['after']))]
+            out = out[~np.array(same, dtype = bool)]
+        rows.append(out)
+    ranked = pd.concat(rows, ignore_index = True)
+    ranked['delta'] = ranked['after'] - ranked['expected']
+    ranked['contribution'] = ranked['delta'] / total_delta if total_delta else np.nan
+    ranked['score'] = (ranked['delta'] - ranked['share'] * total_delta) / expected_total
+    order = ranked['score'].abs().sort_values(ascending = False, kind = 'stable').index
+    ranked = ranked.loc[order].reset_index(drop = True)
+    return ranked.head(top) if top else ranked
@@ -0,0 +1,98 @@
+# Integer encoding of the ID columns and the string dimensions.
+# Codes come from a shared dictionary that is persisted next to the event
+# cache and only ever appended to, so a value keeps its code across weekly loads.
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .profiling import traced
+
+
+# high-cardinality IDs become plain integer code columns
+ID_COLUMNS = ['PseudoID', 'SessionID']
+# low-cardinality dimensions become categoricals whose codes are the dictionary codes
+DIM_COLUMNS = ['EventName', 'screen', 'button', 'service', 'AppVersion', 'TrafficSource', 'DeviceCategory']
+
+
+class Codebook:
+    """Append-only value -> code dictionary per column, stored as one Parquet file per column."""
+
+    def __init__(self, path = None):
+        self.path = Path(path) if path is not None else None
+        self._values = {}
+        self._index = {}
+        self._dirty = set()
+        if self.path is not None and self.path.exists():
+            for f in self.path.glob('*.parquet'):
+                self._set(f.stem, pd.read_parquet(f)['value'].to_numpy(dtype = object))
+
+    def _set(self, column, values):
+        self._values[column] = values
+        self._index[column] = pd.Index(values, dtype = object)
+
+    def values(self, column):
+        """All known values of `column`; position is the code."""
+        return self._values.get(column, np.array([], dtype = object))
+
+    def encode(self, column, values):
+        """Codes for `values`, adding unseen values at the end. Missing values get -1."""
+        values = pd.Series(values, dtype = object).to_numpy()
+        if column not in self._index:
+            self._set(column, np.array([], dtype = object))
+        codes = self._index[column].get_indexer(values)
+        new = (codes < 0) & pd.notna(values)
+        if new.any():
+            # new values of one batch are added in sorted order
+            added = np.sort(pd.unique(values[new]).astype(object))
+            self._set(column, np.concatenate([self._values[column], added]))
+            self._dirty.add(column)
+            codes[new] = self._index[column].get_indexer(values[new])
+        return codes.astype(np.int32)
+
+    def decode(self, column, codes):
+        # code -1 lands on the trailing None
+        return np.append(self.values(column), None)[np.asarray(codes)]
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.mkdir(parents = True, exist_ok = True)
+        for column in self._dirty:
+            pd.DataFrame({'value': self._values[column]}).to_parquet(self.path / f'{column}.parquet', index = False)
+        self._dirty.clear()
+
+
+@traced
+def encode_frame(data_fin, codebook, id_columns = ID_COLUMNS, dim_columns = DIM_COLUMNS):
+    """Replace ID and dimension columns by their dictionary codes and save the dictionary.
+
+    IDs become int32 code columns (nullable Int32 if any value is missing),
+    dimensions become categoricals on the full dictionary, so comparisons with
+    the original strings keep working while groupbys run on the codes.
+    """
+    data_fin = data_fin.copy(deep = False)
+    for col in id_columns:
+        codes = codebook.encode(col, data_fin[col])
+        missing = codes < 0
+        data_fin[col] = pd.arrays.IntegerArray(codes, missing) if missing.any() else codes
+    for col in dim_columns:
+        codes = codebook.encode(col, data_fin[col])
+        data_fin[col] = pd.Categorical.from_codes(codes, categories = pd.Index(codebook.values(col), dtype = object).astype(str))
+    codebook.save()
+    return data_fin
+
+
+def decode_frame(data_fin, codebook, id_columns = ID_COLUMNS):
+    """Turn ID code columns back into the original strings."""
+    data_fin = data_fin.copy(deep = False)
+    for col in id_columns:
+        codes = data_fin[col].fillna(-1).to_numpy(dtype = np.int64)
+        data_fin[col] = codebook.decode(col, codes)
+    return data_fin
+
+
+def memory_usage(df):
+    """Deep memory usage per column in MiB."""
+    return df.memory_usage(deep = True, index = False) / 2**20
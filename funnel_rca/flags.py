@@ -0,0 +1,68 @@
+# Core per-event flags of step 3: active users (MAU/WAU) and purchases.
+
+import numpy as np
+import pandas as pd
+
+from .profiling import traced
+
+
+# event-screen pairs that reflect real product engagement;
+# registration/login and other idle or non-product actions are left out
+ACTIVE_EVENTS = {
+    ('add_payment_info', 'checkout'),
+    ('click', 'store_page'),
+    ('click', 'store_list'),
+    ('click', 'checkout'),
+    ('click', 'order_page'),
+    ('click', 'menu'),
+    ('click', 'restaurant_list'),
+    ('click', 'order_history'),
+    ('click', 'profile'),
+    ('click', 'profile_edit'),
+    ('click', 'services_hub'),
+    ('click', 'home'),
+    ('payment_failed', 'payment'),
+    ('purchase', 'payment'),
+    ('screen_view', 'order_status'),
+    ('screen_view', 'store_page'),
+    ('screen_view', 'store_list'),
+    ('screen_view', 'checkout'),
+    ('screen_view', 'order_page'),
+    ('screen_view', 'menu'),
+    ('screen_view', 'home'),
+    ('screen_view', 'restaurant_list'),
+    ('screen_view', 'support'),
+    ('screen_view', 'profile_edit'),
+    ('screen_view', 'services_hub'),
+    ('screen_view', 'order_history'),
+    ('screen_view', 'profile'),
+}
+
+
+def _codes(column):
+    column = column if isinstance(column.dtype, pd.CategoricalDtype) else column.astype('category')
+    return column.cat.codes.to_numpy(), column.cat.categories
+
+
+def active_mask(data_fin, active_events = ACTIVE_EVENTS):
+    """Whether each (EventName, screen) pair is in active_events, via a lookup table over the category codes."""
+    events, event_values = _codes(data_fin['EventName'])
+    screens, screen_values = _codes(data_fin['screen'])
+    # one extra row / column that code -1 (missing) lands on, never active
+    table = np.zeros((len(event_values) + 1, len(screen_values) + 1), dtype = bool)
+    e = event_values.get_indexer([e for e, _ in active_events])
+    s = screen_values.get_indexer([s for _, s in active_events])
+    known = (e >= 0) & (s >= 0)
+    table[e[known], s[known]] = True
+    return table[events, screens]
+
+
+@traced
+def add_flags(data_fin, active_events = ACTIVE_EVENTS):
+    """ActiveUsers, UserswPurchases and SessionswPurchases: the ID where the event counts, else missing."""
+    active = active_mask(data_fin, active_events)
+    purchase = data_fin['order_id'].notna() & (data_fin['screen'] == 'payment')
+    data_fin['ActiveUsers'] = data_fin['PseudoID'].where(active)
+    data_fin['UserswPurchases'] = data_fin['PseudoID'].where(purchase)
+    data_fin['SessionswPurchases'] = data_fin['SessionID'].where(purchase)
+    return data_fin
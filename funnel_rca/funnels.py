@@ -0,0 +1,136 @@
+# Declarative funnel definitions and a single-pass rule engine.
+# A rule matches on (EventName, screen, button, service); None matches anything,
+# a list matches any of its values. All rules of a funnel are compiled into one
+# small lookup table indexed by the codes of the four columns, so every row is
+# classified by one gather instead of one .loc per rule.
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .profiling import traced
+
+
+Rule = namedtuple('Rule', ['label', 'order', 'EventName', 'screen', 'button', 'service'])
+
+KEYS = ['EventName', 'screen', 'button', 'service']
+
+_ENTRY_SCREENS = ['home', 'services_hub', 'order_history']
+
+
+def _steps(service, tiles, browse):
+    """Standard delivery funnel: entry tile, service specific browsing steps, shared checkout steps."""
+    steps = [Rule('Enter Funnel', 1, 'click', _ENTRY_SCREENS, tiles, None)]
+    steps += [Rule(label, i, event, screen, button, service)
+              for i, (label, event, screen, button) in enumerate(browse, start = 2)]
+    n = len(steps) + 1
+    steps += [Rule(label, i, event, screen, button, service)
+              for i, (label, event, screen, button) in enumerate([
+                  ('View Order', 'screen_view', 'order_page', None),
+                  ('Go to Checkout', 'click', 'order_page', 'checkout'),
+                  ('Checkout Screen View', 'screen_view', 'checkout', None),
+                  ('Add payment Info(opt.)', 'add_payment_info', 'checkout', None),
+                  ('Click to pay', 'click', 'checkout', 'pay'),
+                  ('Order created fail Page', 'payment_failed', 'payment', None),
+                  ('Order created success Page', 'purchase', 'payment', None),
+              ], start = n)]
+    return steps
+
+
+FUNNELS = {
+    'food_delivery': {
+        'steps': _steps('food_delivery', ['food_home_tile', 'food_hub_tile', 'food_order_again'], [
+            ('Restaurant List View', 'screen_view', 'restaurant_list', None),
+            ('Choose Restaurant', 'click', 'restaurant_list', 'select_restaurant'),
+            ('Restaurant Menu View', 'screen_view', 'menu', None),
+            ('Add Menu Item', 'click', 'menu', 'add_item'),
+            ('Go to Cart', 'click', 'menu', 'go_to_cart'),
+        ]),
+        # steps a session has to pass in order in the strict funnel: the optional payment info
+        # and the failed payment page (an alternative outcome) are left out
+        'sequence': [1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 13],
+        'entry_points': [
+            Rule('Home', 1, 'click', _ENTRY_SCREENS, 'food_home_tile', None),
+            Rule('Hub', 2, 'click', _ENTRY_SCREENS, 'food_hub_tile', None),
+            Rule('Order History', 3, 'click', _ENTRY_SCREENS, 'food_order_again', None),
+        ],
+    },
+    'grocery_delivery': {
+        'steps': _steps('grocery_delivery', ['grocery_home_tile', 'grocery_hub_tile', 'grocery_order_again'], [
+            ('Store List View', 'screen_view', 'store_list', None),
+            ('Choose Store', 'click', 'store_list', 'select_store'),
+            ('Store Page View', 'screen_view', 'store_page', None),
+            ('Add Store Item', 'click', 'store_page', 'add_item'),
+            ('Go to Cart', 'click', 'store_page', 'go_to_cart'),
+        ]),
+        'sequence': [1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 13],
+        'entry_points': [
+            Rule('Home', 1, 'click', _ENTRY_SCREENS, 'grocery_home_tile', None),
+            Rule('Hub', 2, 'click', _ENTRY_SCREENS, 'grocery_hub_tile', None),
+            Rule('Order History', 3, 'click', _ENTRY_SCREENS, 'grocery_order_again', None),
+        ],
+    },
+}
+
+
+def definition(funnel):
+    """The rules of FUNNELS[funnel] as plain lists, to fingerprint what is derived from them."""
+    spec = FUNNELS[funnel]
+    return {'funnel': funnel, 'steps': [list(r) for r in spec['steps']], 'sequence': list(spec['sequence']),
+            'entry_points': [list(r) for r in spec['entry_points']]}
+
+
+def _codes(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    return pd.factorize(column)
+
+
+def compile_rules(rules, categories):
+    """Lookup table over the rule-referenced values of each key column.
+
+    Returns (remaps, table): remaps[k] maps a code of column k (-1 for missing
+    as the last slot) to a compact index, where the last compact index stands
+    for every value no rule names. table[i, j, l, m] is 1 + the index of the
+    last matching rule (later rules win, like consecutive .loc assignments),
+    or 0 if none matches.
+    """
+    remaps, slots = [], []
+    for k, key in enumerate(KEYS):
+        named = sorted({v for r in rules for v in _as_list(getattr(r, key)) or []})
+        pos = pd.Index(categories[k]).get_indexer(named)
+        remap = np.full(len(categories[k]) + 1, len(named), dtype = np.intp)
+        remap[pos[pos >= 0]] = np.flatnonzero(pos >= 0)
+        remaps.append(remap)
+        slots.append({v: i for i, v in enumerate(named)})
+
+    table = np.zeros([len(s) + 1 for s in slots], dtype = np.int32)
+    for i, rule in enumerate(rules, start = 1):
+        idx = []
+        for k, key in enumerate(KEYS):
+            values = _as_list(getattr(rule, key))
+            idx.append(np.arange(len(slots[k]) + 1) if values is None else [slots[k][v] for v in values])
+        table[np.ix_(*idx)] = i
+    return remaps, table
+
+
+def _as_list(value):
+    if value is None:
+        return None
+    return [value] if isinstance(value, str) else list(value)
+
+
+@traced
+def classify(data_fin, rules, label = 'funnel', order = 'funnel_order'):
+    """Label every row with the rule it matches, in one vectorized pass.
+
+    Returns a DataFrame with `label` ('' when no rule matches) and `order`
+    (0 when no rule matches) aligned with data_fin.
+    """
+    codes, categories = zip(*(_codes(data_fin[k]) for k in KEYS))
+    remaps, table = compile_rules(rules, categories)
+    hit = table[tuple(remap[c] for remap, c in zip(remaps, codes))]
+    labels = np.array([''] + [r.label for r in rules], dtype = object)
+    orders = np.array([0] + [r.order for r in rules], dtype = np.int64)
+    return pd.DataFrame({label: labels[hit], order: orders[hit]}, index = data_fin.index)
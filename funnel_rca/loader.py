@@ -0,0 +1,115 @@
+# Local loader for the weekly GA4-like exports.
+# Finds delivery_app_app_data_<start>_<end>_part2.csv files, parses them in a
+# process pool and hands them out one week at a time.
+
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from .profiling import traced
+
+
+FILE_RE = re.compile(r'^delivery_app_app_data_(\d{8})_(\d{8})_part2\.csv$')
+
+COLUMNS = ['EventDate', 'EventTimestamp', 'PseudoID', 'SessionID', 'EventName',
+           'TrafficSource', 'DeviceCategory', 'AppVersion', 'UserProperties', 'EventParams']
+
+# low-cardinality dimensions are read straight into categoricals
+DTYPES = {
+    'EventDate': 'str',
+    'EventTimestamp': 'int64',
+    'PseudoID': 'str',
+    'SessionID': 'str',
+    'EventName': 'category',
+    'TrafficSource': 'category',
+    'DeviceCategory': 'category',
+    'AppVersion': 'category',
+    'UserProperties': 'str',
+    'EventParams': 'str',
+}
+
+CHUNKSIZE = 50_000
+
+
+def find_exports(path = '.'):
+    """Weekly export files under `path` as (start, end, file) sorted by start date."""
+    found = []
+    for f in Path(path).iterdir():
+        m = FILE_RE.match(f.name)
+        if m:
+            start, end = (datetime.strptime(s, '%d%m%Y').date() for s in m.groups())
+            found.append((start, end, f))
+    return sorted(found)
+
+
+@traced
+def read_export(file, usecols = None, chunksize = CHUNKSIZE, transform = None):
+    """Read one weekly export with explicit dtypes, chunk by chunk.
+
+    `transform` is applied to every chunk before the chunks are combined, so
+    wide raw columns (e.g. the JSON blobs) can be dropped early. It has to be a
+    module-level function when used from a process pool.
+    """
+    cols = usecols or COLUMNS
+    dtype = {c: t for c, t in DTYPES.items() if c in cols}
+    chunks = pd.read_csv(file, usecols = cols, dtype = dtype, chunksize = chunksize)
+    if transform is not None:
+        chunks = (transform(c) for c in chunks)
+    return concat_frames(list(chunks))
+
+
+def concat_frames(frames):
+    """pd.concat that keeps categorical columns categorical across weeks."""
+    if not frames:
+        return pd.DataFrame(columns = COLUMNS)
+    frames = [f for f in frames if len(f)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0].reset_index(drop = True)
+    frames = [f.copy(deep = False) for f in frames]
+    for col, dtype in frames[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            cats = sorted(set().union(*(f[col].cat.categories for f in frames)))
+            for f in frames:
+                f[col] = f[col].cat.set_categories(cats)
+    return pd.concat(frames, ignore_index = True)
+
+
+def iter_weeks(path = '.', workers = None, usecols = None, chunksize = CHUNKSIZE, transform = None):
+    """Yield (start, end, DataFrame) per weekly export in date order.
+
+    Files are parsed in a process pool; at most `workers` files are in flight at
+    a time, so peak memory depends on the number of workers rather than on the
+    number of weeks on disk.
+    """
+    exports = find_exports(path)
+    workers = workers or min(len(exports), os.cpu_count() or 1) or 1
+    if workers == 1:
+        for start, end, f in exports:
+            yield start, end, read_export(f, usecols, chunksize, transform)
+        return
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        pending = deque()
+        todo = iter(exports)
+        for start, end, f in todo:
+            pending.append((start, end, pool.submit(read_export, f, usecols, chunksize, transform)))
+            if len(pending) >= workers:
+                break
+        while pending:
+            start, end, fut = pending.popleft()
+            nxt = next(todo, None)
+            if nxt is not None:
+                pending.append((nxt[0], nxt[1], pool.submit(read_export, nxt[2], usecols, chunksize, transform)))
+            yield start, end, fut.result()
+
+
+@traced
+def load_exports(path = '.', workers = None, usecols = None, chunksize = CHUNKSIZE, transform = None, concat = True):
+    """All weekly exports, either as one DataFrame (concat=True) or a list of weekly frames."""
+    weeks = [df for _, _, df in iter_weeks(path, workers, usecols, chunksize, transform)]
+    return concat_frames(weeks) if concat else weeks
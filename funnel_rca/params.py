@@ -0,0 +1,99 @@
+# Projection-aware decoding of the UserProperties / EventParams JSON columns.
+# Only the requested keys are pulled out of the raw strings with one
+# key-targeted regex scan per key; no Python dict is built per row.
+
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pandas' own str.extract is used instead
+    pa = pc = None
+
+from .profiling import traced
+
+
+# keys used by the analysis and the dtype each one is decoded into
+EVENT_PARAMS = {
+    'screen': 'category',
+    'service': 'category',
+    'button': 'category',
+    'order_id': 'str',
+    'reason': 'category',
+}
+USER_PROPERTIES = {
+    'cohort_month': 'category',
+    'is_new_user': 'boolean',
+    'app_version': 'category',
+}
+
+# `"key": "string"` or `"key": bare-token`, only in key position (after `{` or `,`)
+_KEY_RE = r'[{{,]\s*"{key}"\s*:\s*(?:"(?P<s>(?:[^"\\]|\\.)*)"|(?P<r>[^,}}\s]+))'
+
+
+def _scan_arrow(arr, key):
+    """Raw string value of `key` per row as an arrow array (null where missing / null)."""
+    found = pc.extract_regex(arr, _KEY_RE.format(key = re.escape(key)))
+    s = pc.struct_field(found, 's')
+    r = pc.struct_field(found, 'r')
+    raw = pc.if_else(pc.equal(r, ''), s, r)
+    raw = pc.if_else(pc.equal(r, 'null'), pa.scalar(None, pa.string()), raw)
+    if pc.any(pc.match_substring(s, '\\')).as_py():
+        # escaped strings are rare, decode just those
+        raw = pa.array([json.loads('"' + v + '"') if v is not None and '\\' in v else v
+                        for v in raw.to_pylist()], type = pa.string())
+    return raw
+
+
+def _scan_object(values, key):
+    """Same as _scan_arrow on an object array, via pandas' str.extract."""
+    found = pd.Series(values, dtype = object).str.extract(_KEY_RE.format(key = re.escape(key)))
+    s = found['s'].to_numpy(dtype = object)
+    r = found['r'].to_numpy(dtype = object)
+    raw = np.where(pd.isna(r) | (r == ''), s, r).astype(object)
+    raw[pd.isna(raw) | (r == 'null')] = None
+    for i in np.flatnonzero(pd.Series(s, dtype = object).str.contains('\\', regex = False, na = False).to_numpy(dtype = bool)):
+        raw[i] = json.loads('"' + raw[i] + '"')
+    return pd.Series(raw, dtype = object)
+
+
+def _cast(raw, dtype):
+    if dtype == 'boolean':
+        return raw.map({'true': True, 'false': False}).astype('boolean')
+    if dtype in ('float64', 'Float64', 'Int64'):
+        return pd.to_numeric(raw).astype(dtype)
+    return raw.astype(dtype)
+
+
+@traced
+def extract_keys(column, keys):
+    """Decode only `keys` ({key: dtype}) from a Series of flat JSON objects."""
+    if pc is not None:
+        arr = pa.array(column, type = pa.string(), from_pandas = True)
+        cols = {}
+        for k, t in keys.items():
+            raw = _scan_arrow(arr, k)
+            # categoricals straight from the arrow dictionary, without an object round trip
+            if t == 'category':
+                cat = raw.dictionary_encode().to_pandas()
+                cols[k] = cat.cat.reorder_categories(sorted(cat.cat.categories))
+            else:
+                cols[k] = _cast(raw.to_pandas(), t)
+    else:
+        values = column.to_numpy(dtype = object)
+        cols = {k: _cast(_scan_object(values, k), t) for k, t in keys.items()}
+    out = pd.DataFrame(cols)
+    out.index = column.index
+    return out
+
+
+@traced
+def flatten(data_union, event_params = EVENT_PARAMS, user_properties = USER_PROPERTIES):
+    """Replace the two JSON columns by typed columns for the projected keys."""
+    return (data_union.drop(columns = ['UserProperties', 'EventParams'])
+            .join([extract_keys(data_union['EventParams'], event_params),
+                   extract_keys(data_union['UserProperties'], user_properties)]))
@@ -0,0 +1,108 @@
+# Partition-parallel execution of the analysis.
+# Every cache partition (one weekly export) is prepared in its own process and
+# reduced to mergeable partials: exact cubes of distinct (dimensions, id) pairs,
+# plus the few rows the session-level steps need (entry point clicks, orders,
+# funnel events). Partials are keyed by each event's own EventWeek / EventMonth,
+# not by the file it came from, so events on the other side of a Sunday cut or
+# a month boundary land in the right group, and merging takes the union of the
+# distinct pairs - distinct counts are never summed.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .analysis import (BASELINE_COLS, app_version_tables, attribution_tables, entry_point_table,
+                       funnel_tables, prepare, service_tables)
+from .attribution import attribute, touchpoints
+from .cache import read_manifest
+from .cube import Cube
+from .funnels import FUNNELS
+from .loader import concat_frames
+from .profiling import traced
+from .sequence import sequence_funnel, session_paths
+
+
+PERIODS = ['EventWeek', 'EventMonth']
+SERVICE_MEASURES = ['SessionID', 'UserswPurchases', 'SessionswPurchases', 'FailedOrders']
+
+
+@traced
+def partials(cache_dir, start, funnel = 'food_delivery'):
+    """Mergeable partial aggregates of the cache partition starting at `start`."""
+    data_fin = prepare(cache_dir, funnel, weeks = (start, start), encode = False)
+    # orders with a payment failure reason, for the cancellation counts of step 5
+    data_fin['FailedOrders'] = data_fin['order_id'].where(data_fin['reason'].notna())
+    entries, orders = touchpoints(data_fin)
+    return {
+        'cube': Cube.build(data_fin),
+        'baseline': Cube.build(data_fin, PERIODS, BASELINE_COLS),
+        'service': Cube.build(data_fin, ['EventWeek', 'service'], SERVICE_MEASURES),
+        'entries': entries,
+        'orders': orders,
+        'steps': data_fin.loc[data_fin['funnel_order'] > 0, ['SessionID', 'EventTimestamp', 'funnel_order']],
+    }
+
+
+@traced
+def merge(parts):
+    """One set of partials from the partials of several partitions."""
+    parts = list(parts)
+    merged = {k: Cube.concat(p[k] for p in parts) for k in ('cube', 'baseline', 'service')}
+    for k in ('entries', 'orders'):
+        merged[k] = concat_frames([p[k] for p in parts]).drop_duplicates().reset_index(drop = True)
+    merged['steps'] = concat_frames([p['steps'] for p in parts])
+    return merged
+
+
+@traced
+def aggregate(cache_dir = 'event_cache', workers = None, funnel = 'food_delivery'):
+    """Partials of every cache partition, computed in a process pool and merged."""
+    starts = sorted(e['start'] for e in read_manifest(cache_dir).values())
+    workers = workers or min(len(starts), os.cpu_count() or 1) or 1
+    if workers == 1:
+        return merge(partials(cache_dir, s, funnel) for s in starts)
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        return merge(pool.map(partials, [cache_dir] * len(starts), starts, [funnel] * len(starts)))
+
+
+def _counts(cube, by, measures):
+    # groupby().nunique() / pivot_table(aggfunc = 'nunique') count 0 for a group without values,
+    # the cube leaves it out; SessionID is set on every event, so it lists every group
+    out = cube.query(by, ['SessionID'] + [m for m in measures if m != 'SessionID'])
+    return out[measures].fillna(0).astype('int64')
+
+
+@traced
+def tables(merged, attribution_model = 'last', attribution_window = None, funnel = 'food_delivery'):
+    """The result tables of analysis.run from merged partials."""
+    cube, base, service = merged['cube'], merged['baseline'], merged['service']
+    results = {}
+    results['df_group_week'] = _counts(base, 'EventWeek', BASELINE_COLS)
+    results['df_group_month'] = _counts(base, 'EventMonth', BASELINE_COLS)
+
+    per_service = _counts(service, ['EventWeek', 'service'], ['UserswPurchases', 'SessionswPurchases'])
+    cancelled = {suffix: (service.query('EventWeek', 'FailedOrders', where = {'service': name})
+                          .rename(columns = {'FailedOrders': 'order_id'}))
+                 for name, suffix in (('food_delivery', 'fd'), ('grocery_delivery', 'gd'))}
+    results.update(service_tables(cube.query(['EventWeek', 'service'], 'order_id')['order_id'].unstack(),
+                                  per_service['UserswPurchases'].unstack(), per_service['SessionswPurchases'].unstack(),
+                                  cancelled['fd'], cancelled['gd']))
+
+    is_step = {'funnel': lambda f: f != ''}
+    results['funnel_fin'], results['funnel_prep_det'] = funnel_tables(
+        cube.query(['funnel', 'funnel_order'], ['SessionID', 'PseudoID'], where = is_step),
+        cube.query(['EventWeek', 'funnel', 'funnel_order'], ['SessionID', 'PseudoID'], where = is_step))
+
+    sequence = FUNNELS[funnel]['sequence']
+    results['funnel_seq'] = sequence_funnel(session_paths(merged['steps'], sequence), sequence,
+                                            labels = {r.order: r.label for r in FUNNELS[funnel]['steps']})
+
+    results['app'], results['app_entry_rate'] = app_version_tables(
+        cube.query(['EventWeek', 'AppVersion'], 'SessionID'),
+        cube.query(['EventWeek', 'AppVersion'], 'SessionID', where = {'funnel_order': 1}))
+    results['ep_groups'] = entry_point_table(
+        cube.query(['EventWeek', 'AppVersion', 'EntryPoint'], ['PseudoID', 'SessionID'], where = {'EntryPoint': lambda e: e != ''}))
+
+    ep_merge = (attribute(merged['entries'], merged['orders'], model = attribution_model, window = attribution_window)
+                .rename(columns = {'AppVersion': 'AppVersion_o'})[['EventDate', 'order_id', 'EntryPoint', 'AppVersion_o']])
+    _, results['ep_merge_gr'], results['ep_merge_gr_t'] = attribution_tables(ep_merge)
+    return results
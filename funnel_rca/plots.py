@@ -0,0 +1,171 @@
+# Figures of the notebook, drawn from the results of funnel_rca.analysis.
+# matplotlib and seaborn are imported on first use only, so importing
+# funnel_rca (or running the CLI without --plots) never loads them.
+# Every function returns the figures it created.
+
+
+def _plt():
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def baseline(df_group_week, df_group_month):
+    """Step 4: weekly and monthly sessions, users, buyers and orders."""
+    fig, pl = _plt().subplots(nrows = 4, ncols = 2, figsize = (18, 12), constrained_layout = True)
+    panels = [(slice(0, 1), 'Sessions', True), (slice(1, -3), 'Users, Active Users', False),
+              (slice(4, 5), 'Users w/Purchases', True), (slice(5, 6), 'Orders', True)]
+    for row, (cols, title, no_legend) in enumerate(panels):
+        for col, (df, period) in enumerate(((df_group_week, 'Weeks'), (df_group_month, 'Months'))):
+            df.iloc[:-1, cols].plot(kind = 'line', ax = pl[row, col])
+            pl[row, col].set_title(f'{period}: {title}')
+            pl[row, col].set_xlabel('')
+            if no_legend:
+                pl[row, col].legend('')
+    return [fig]
+
+
+def rolling_active(active_rolling):
+    """Step 4: daily, 7-day and 28-day active users for every day."""
+    fig, ax = _plt().subplots(figsize = (18, 5), constrained_layout = True)
+    active_rolling.plot(kind = 'line', ax = ax)
+    ax.set_title('Active Users: DAU, WAU (7 days), MAU (28 days)')
+    ax.set_xlabel('')
+    return [fig]
+
+
+def services(split):
+    """Step 5: Food vs Grocery orders, buyers, orders per buyer and payment failures (a service_split dict)."""
+    fig, plx = _plt().subplots(nrows = 5, ncols = 2, figsize = (18, 15), constrained_layout = True)
+
+    def line(data, ax, title, legend = ''):
+        data.plot(kind = 'line', ax = ax)
+        ax.set_title(title)
+        ax.set_xlabel('')
+        ax.legend(legend)
+
+    order_types = split['order_types']
+    line(order_types.iloc[1:-1, :1], plx[0, 0], 'Food Delivery - Orders')
+    line(order_types.iloc[1:-1, 1:], plx[0, 1], 'Grocery Delivery - Orders')
+    for df in (split['buyers_by_types'], split['sessions_by_types']):
+        line(df.iloc[:-1, :1], plx[1, 0], 'Food Delivery - Users and Sessions w/Purchases', ['Users', 'Sessions'])
+        line(df.iloc[:-1, 1], plx[1, 1], 'Grocery Delivery - Users and Sessions w/Purchases', ['Users', 'Sessions'])
+
+    orders_per_buyer = split['orders_per_buyer']
+    for ax, cols, title in ((plx[2, 0], [0, 1], 'Food Delivery: Orders / Users w/Purchases Ratio'),
+                            (plx[2, 1], [0, 2], 'Grocery Delivery: Orders / Users w/Purchases Ratio')):
+        orders_per_buyer.iloc[:, cols].plot(kind = 'line', x = 'EventWeek', ax = ax)
+        ax.set_title(title)
+        ax.set_xlabel('')
+        ax.legend('')
+
+    line(split['cancelled_order_fd'].iloc[:-1], plx[3, 0], 'Food Delivery: Orders w/Payment Failed')
+    line(split['cancelled_order_gd'].iloc[:-1], plx[3, 1], 'Grocery Delivery: Orders w/Payment Failed')
+    line(split['orders_all'].iloc[:-1, 3], plx[4, 0], 'Food Delivery - Failure ratio')
+    line(split['orders_all'].iloc[:-1, 4], plx[4, 1], 'Grocery Delivery - Failure ratio')
+    return [fig]
+
+
+def funnel(funnel_fin):
+    """Step 7: sessions and users per funnel step."""
+    fig, f = _plt().subplots(nrows = 1, ncols = 2, figsize = (15, 5), constrained_layout = True)
+    for ax, col in zip(f, ('SessionID', 'PseudoID')):
+        funnel_fin.sort_index(ascending = False).plot(kind = 'barh', x = 'funnel', y = col, ax = ax)
+        ax.set_ylabel('')
+    return [fig]
+
+
+def funnel_weekly(funnel_prep_det):
+    """Step 8: weekly users per funnel step."""
+    ax = funnel_prep_det.iloc[:-1].plot(kind = 'line', figsize = (12, 6))
+    ax.legend(bbox_to_anchor = (1.02, 1))
+    return [ax.figure]
+
+
+def app_version_heatmap(t):
+    """Step 9: share of sessions entering the funnel per week and app version."""
+    import seaborn as sns
+    plt = _plt()
+    fig = plt.figure()
+    sns.heatmap(t, annot = True, cmap = 'Blues', ax = fig.gca())
+    return [fig]
+
+
+def entry_points_version(rows, version):
+    """Step 10: weekly users and sessions per entry point of one app version (its rows of ep_groups)."""
+    fig, e = _plt().subplots(nrows = 1, ncols = 2, figsize = (15, 5), constrained_layout = True)
+    rows = rows.iloc[:-1]
+    for ax, col in zip(e, ('PseudoID', 'SessionID')):
+        rows.plot(kind = 'line', y = col, x = 'EventWeek', ax = ax)
+        ax.set_title(f'{version}')
+    return [fig]
+
+
+def entry_points(ep_groups, versions = 4):
+    """Step 10: weekly users and sessions per entry point, for the first `versions` app versions."""
+    figs = []
+    for version in ep_groups['AppVersion'].unique()[:versions]:
+        figs += entry_points_version(ep_groups[ep_groups['AppVersion'] == version], version)
+    return figs
+
+
+def orders_version(rows, version):
+    """Step 11: weekly orders per entry point of one app version (its rows of ep_merge_gr)."""
+    ax = rows.iloc[:-1].plot(kind = 'line', figsize = (10, 6))
+    ax.set_title(f'{version}')
+    return [ax.figure]
+
+
+def total_orders(ep_merge_gr_t):
+    """Step 11: weekly orders per entry point, all app versions."""
+    ax = ep_merge_gr_t.iloc[:-1, ].plot(kind = 'line', figsize = (10, 6))
+    ax.set_title('Total orders')
+    return [ax.figure]
+
+
+def orders_by_entry_point(ep_merge_gr, ep_merge_gr_t, versions = 4):
+    """Step 11: weekly orders per entry point, for the first `versions` app versions and in total."""
+    figs = []
+    for version in ep_merge_gr['AppVersion_o'].unique()[:versions]:
+        figs += orders_version(ep_merge_gr[ep_merge_gr['AppVersion_o'] == version], version)
+    return figs + total_orders(ep_merge_gr_t)
+
+
+SERVICE_TABLES = ['order_types', 'buyers_by_types', 'sessions_by_types', 'orders_per_buyer',
+                  'cancelled_order_fd', 'cancelled_order_gd', 'orders_all']
+
+
+def figure_specs(results, versions = 4):
+    """(name, title, function, arguments) of every figure of the notebook, one figure each, from
+    the results of analysis.run: the arguments are only the tables (or rows) the figure shows."""
+    single = [('baseline', baseline, (results['df_group_week'], results['df_group_month'])),
+              ('rolling_active', rolling_active, (results['active_rolling'],)),
+              ('services', services, ({k: results[k] for k in SERVICE_TABLES},)),
+              ('funnel', funnel, (results['funnel_fin'],)),
+              ('funnel_weekly', funnel_weekly, (results['funnel_prep_det'],)),
+              ('app_version_heatmap', app_version_heatmap, (results['app_entry_rate'],))]
+    specs = [(name, fn.__doc__.split('\n')[0].rstrip('.'), fn, args) for name, fn, args in single]
+    ep_groups, ep_merge_gr = results['ep_groups'], results['ep_merge_gr']
+    for i, version in enumerate(ep_groups['AppVersion'].unique()[:versions]):
+        specs.append((f'entry_points_{i}', f'Step 10: weekly users and sessions per entry point, {version}',
+                      entry_points_version, (ep_groups[ep_groups['AppVersion'] == version], version)))
+    order_versions = ep_merge_gr['AppVersion_o'].unique()[:versions]
+    for i, version in enumerate(order_versions):
+        specs.append((f'orders_by_entry_point_{i}', f'Step 11: weekly orders per entry point, {version}',
+                      orders_version, (ep_merge_gr[ep_merge_gr['AppVersion_o'] == version], version)))
+    specs.append((f'orders_by_entry_point_{len(order_versions)}', 'Step 11: weekly orders per entry point, all app versions',
+                  total_orders, (results['ep_merge_gr_t'],)))
+    return specs
+
+
+def all_figures(results):
+    """Every figure of the notebook from the results of analysis.run, by name."""
+    return {
+        'baseline': baseline(results['df_group_week'], results['df_group_month']),
+        'rolling_active': rolling_active(results['active_rolling']),
+        'services': services(results),
+        'funnel': funnel(results['funnel_fin']),
+        'funnel_weekly': funnel_weekly(results['funnel_prep_det']),
+        'app_version_heatmap': app_version_heatmap(results['app_entry_rate']),
+        'entry_points': entry_points(results['ep_groups']),
+        'orders_by_entry_point': orders_by_entry_point(results['ep_merge_gr'], results['ep_merge_gr_t']),
+    }
@@ -0,0 +1,276 @@
+# Opt-in instrumentation of the pipeline.
+# The stages are wrapped in spans - `traced` for functions, `span` for blocks -
+# that record wall and CPU time, peak resident memory (sampled from a thread
+# every few ms, so Arrow and NumPy buffers count too) and the rows of the
+# frames they return; the largest returned frames are kept with their deep
+# size. Enabled by FUNNEL_RCA_PROFILE=trace.json or `python -m funnel_rca
+# --profile trace.json`; disabled, a traced call costs one global lookup.
+#
+# write() emits a JSON trace (every span, a per-stage summary and the largest
+# frames) and, next to it, a .folded file of collapsed stacks with the self
+# time of every stack in microseconds, for flamegraph.pl, inferno or speedscope.
+# Work done in process pools shows as the span around the pool.
+
+import atexit
+import datetime
+import functools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import pandas as pd
+
+
+ENV = 'FUNNEL_RCA_PROFILE'
+# frames kept in the trace, by deep size
+TOP_FRAMES = 20
+
+_tracer = None
+
+
+def _rss():
+    """Resident set size in bytes (Linux; elsewhere the peak so far)."""
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _frames(value):
+    """(key, frame) of the DataFrames / Series in a result: itself, a tuple or a dict of them."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return [(None, value)]
+    if isinstance(value, (tuple, list)):
+        return [(str(i), v) for i, v in enumerate(value) if isinstance(v, (pd.DataFrame, pd.Series))]
+    if isinstance(value, dict):
+        return [(str(k), v) for k, v in value.items() if isinstance(v, (pd.DataFrame, pd.Series))]
+    return []
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'path', 'thread', 'attrs', 'start', 'cpu', 'rss', 'peak', 'overhead', 'children')
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer, self.name, self.attrs = tracer, name, attrs
+
+    def set(self, **attrs):
+        """Extra attributes of the span, e.g. rows = len(frame)."""
+        self.attrs.update(attrs)
+
+    def result(self, value):
+        """Record the rows of the frames in a stage's result."""
+        rows = {k: len(f) for k, f in _frames(value)}
+        if rows:
+            self.attrs['rows'] = rows.pop(None) if None in rows else rows
+
+    def __enter__(self):
+        t = self.tracer
+        stack = t._stack()
+        self.path = stack[-1].path + (self.name,) if stack else (self.name,)
+        self.thread = threading.current_thread().name
+        stack.append(self)
+        self.children = 0.0
+        self.overhead = t.overhead
+        self.rss = self.peak = _rss()
+        t._live.add(self)
+        self.cpu = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        cpu = time.process_time()
+        t = self.tracer
+        stack = t._stack()
+        stack.pop()
+        t._live.discard(self)
+        wall = end - self.start - (t.overhead - self.overhead)
+        if stack:
+            stack[-1].children += wall
+        self.peak = max(self.peak, _rss())
+        record = {'name': self.name, 'path': ';'.join(self.path), 'thread': self.thread,
+                  'start': round(self.start - t.started, 6), 'wall': round(wall, 6),
+                  'self_time': round(wall - self.children, 6), 'cpu': round(cpu - self.cpu - (t.overhead - self.overhead), 6),
+                  'rss_start_mib': round(self.rss / 2**20, 1), 'rss_peak_mib': round(self.peak / 2**20, 1),
+                  'rss_growth_mib': round((self.peak - self.rss) / 2**20, 1)}
+        record.update(self.attrs)
+        if exc[0] is not None:
+            record['error'] = exc[0].__name__
+        t.spans.append(record)
+        return False
+
+
+class _NullSpan:
+    """What span() gives when profiling is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def result(self, value):
+        pass
+
+
+_NULL = _NullSpan()
+
+
+class Tracer:
+    """Spans and frame sizes of one process, with an RSS sampler thread."""
+
+    def __init__(self, interval = 0.005):
+        self.pid = os.getpid()
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.started_at = datetime.datetime.now().isoformat(timespec = 'seconds')
+        self.cpu_started = time.process_time()
+        self.spans, self.frames = [], []
+        # seconds spent measuring frames, left out of the spans they happened in
+        self.overhead = 0.0
+        self._local = threading.local()
+        # open spans of every thread, for the sampler
+        self._live = set()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target = self._sample, name = 'rss-sampler', daemon = True)
+        self._sampler.start()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = _rss()
+            for s in list(self._live):
+                if rss > s.peak:
+                    s.peak = rss
+
+    def span(self, name, **attrs):
+        return Span(self, name, attrs)
+
+    def frame(self, name, value):
+        """Keep the deep size of the frames in `value` if it is among the TOP_FRAMES largest."""
+        t = time.perf_counter()
+        for key, f in _frames(value):
+            size = f.memory_usage(deep = True)
+            size = int(size.sum() if isinstance(f, pd.DataFrame) else size)
+            self.frames.append({'name': name if key is None else f'{name}[{key}]', 'rows': len(f),
+                                'columns': f.shape[1] if isinstance(f, pd.DataFrame) else 1, 'mib': round(size / 2**20, 2)})
+        self.frames = sorted(self.frames, key = lambda r: -r['mib'])[:TOP_FRAMES]
+        self.overhead += time.perf_counter() - t
+
+    def stop(self):
+        self._stop.set()
+
+    def summary(self):
+        """Calls, total and self wall time, CPU time and peak RSS growth per span name, by self time."""
+        spans = pd.DataFrame(self.spans, columns = ['name', 'wall', 'self_time', 'cpu', 'rss_growth_mib'])
+        out = spans.groupby('name').agg(calls = ('wall', 'size'), wall = ('wall', 'sum'), self_time = ('self_time', 'sum'),
+                                        cpu = ('cpu', 'sum'), rss_growth_mib = ('rss_growth_mib', 'max'))
+        return out.sort_values('self_time', ascending = False)
+
+    def folded(self):
+        """Collapsed stacks: 'a;b;c <self microseconds>' per stack."""
+        stacks = defaultdict(float)
+        for s in self.spans:
+            stacks[s['path'] if s['thread'] == 'MainThread' else f"{s['thread']};{s['path']}"] += s['self_time']
+        return [f'{p} {max(0, round(w * 1e6))}' for p, w in sorted(stacks.items())]
+
+    def write(self, path):
+        """Write the JSON trace to `path` and the collapsed stacks next to it (.folded); returns both paths."""
+        path = Path(path)
+        path.parent.mkdir(parents = True, exist_ok = True)
+        summary = self.summary()
+        trace = {
+            'meta': {'argv': sys.argv, 'pid': self.pid, 'started': self.started_at,
+                     'wall': round(time.perf_counter() - self.started, 3),
+                     'cpu': round(time.process_time() - self.cpu_started, 3),
+                     'rss_mib': round(_rss() / 2**20, 1), 'sample_interval': self.interval,
+                     'profiler_overhead': round(self.overhead, 3)},
+            'summary': json.loads(summary.round(6).reset_index().to_json(orient = 'records')),
+            'spans': sorted(self.spans, key = lambda s: s['start']),
+            'frames': self.frames,
+        }
+        path.write_text(json.dumps(trace, indent = 1))
+        folded = path.with_suffix('.folded')
+        folded.write_text('\n'.join(self.folded()) + '\n')
+        return path, folded
+
+
+def enable(path = None, interval = 0.005):
+    """Start tracing this process; with `path` the trace is written there at exit."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(interval)
+        if path is not None:
+            atexit.register(_write_at_exit, _tracer, path)
+    return _tracer
+
+
+def disable():
+    """Stop tracing; returns the tracer, e.g. to write() it."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.stop()
+    return tracer
+
+
+def active():
+    return _tracer
+
+
+def _write_at_exit(tracer, path):
+    if os.getpid() == tracer.pid:
+        tracer.write(path)
+
+
+def span(name, **attrs):
+    """Context manager timing a block as one stage; set(**attrs) adds to its record."""
+    return _NULL if _tracer is None else _tracer.span(name, **attrs)
+
+
+def frame(name, value):
+    """Record the size of an intermediate frame (or tuple / dict of frames)."""
+    if _tracer is not None:
+        _tracer.frame(name, value)
+
+
+def traced(fn = None, *, name = None):
+    """Decorator: every call is a span named after the function, recording the rows and
+    sizes of the frames it returns."""
+    def wrap(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return fn(*args, **kwargs)
+            with tracer.span(label) as s:
+                out = fn(*args, **kwargs)
+                s.result(out)
+            tracer.frame(label, out)
+            return out
+        return inner
+    return wrap(fn) if fn is not None else wrap
+
+
+# forked pool workers do not trace into (and never write) the parent's trace
+os.register_at_fork(after_in_child = lambda: globals().update(_tracer = None))
+
+if os.environ.get(ENV) and multiprocessing.parent_process() is None:
+    enable(os.environ[ENV])
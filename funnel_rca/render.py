@@ -0,0 +1,162 @@
+# Batch rendering of the notebook's figures to files, for the weekly report.
+# Every figure of plots.figure_specs is drawn in a process pool on the
+# non-interactive Agg backend and saved as PNG and / or SVG. A figure is drawn
+# again only when its content hash changed: the tables it shows, the source of
+# its plotting function and the formats, kept in <out>/render.json; so after a
+# weekly ingest only the figures with new data are redrawn. report() puts the
+# figures into one self-contained HTML page.
+
+import base64
+import datetime
+import hashlib
+import html
+import inspect
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from . import plots
+from .profiling import traced
+
+
+MANIFEST = 'render.json'
+FORMATS = ('png', 'svg')
+
+
+def _digest(h, obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        h.update(repr((type(obj).__name__, obj.shape, list(obj.index.names))).encode())
+        h.update(repr(list(obj.columns) if isinstance(obj, pd.DataFrame) else obj.name).encode())
+        h.update(repr(list(obj.dtypes) if isinstance(obj, pd.DataFrame) else obj.dtype).encode())
+        try:
+            h.update(pd.util.hash_pandas_object(obj, index = True).to_numpy().tobytes())
+        except TypeError:  # unhashable cells
+            h.update(pickle.dumps(obj))
+    elif isinstance(obj, dict):
+        for k in sorted(obj):
+            h.update(repr(k).encode())
+            _digest(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            _digest(h, v)
+    else:
+        h.update(repr(obj).encode())
+
+
+def figure_hash(fn, args, formats):
+    """Content hash of a figure: its plotting function's source, its arguments and the output formats."""
+    import matplotlib
+
+    h = hashlib.sha256()
+    h.update(inspect.getsource(fn).encode())
+    h.update(repr((matplotlib.__version__, tuple(formats))).encode())
+    _digest(h, args)
+    return h.hexdigest()
+
+
+def _agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _draw(name, fn, args, out, formats):
+    """Draw one figure spec and save it; returns (name, files, seconds)."""
+    import matplotlib.pyplot as plt
+
+    t = time.perf_counter()
+    figs = fn(*args)
+    files = []
+    for i, fig in enumerate(figs):
+        stem = name if len(figs) == 1 else f'{name}_{i}'
+        for fmt in formats:
+            fig.savefig(Path(out) / f'{stem}.{fmt}', bbox_inches = 'tight')
+            files.append(f'{stem}.{fmt}')
+        plt.close(fig)
+    return name, files, time.perf_counter() - t
+
+
+@traced
+def render_figures(results, out, formats = ('png',), workers = None, force = False, versions = 4):
+    """Draw every figure of the results of analysis.run into `out` and return one row per figure.
+
+    Figures whose content hash matches the last run's (and whose files are
+    still there) are skipped unless `force`; the others are drawn in a pool of
+    `workers` processes on the Agg backend (in this process with workers=1).
+    Files the last run wrote that this one does not - figures that are gone,
+    e.g. an app version no longer among the first `versions`, or formats no
+    longer asked for - are removed.
+    """
+    formats = tuple(formats)
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError(f'unknown formats {sorted(unknown)}, expected some of {list(FORMATS)}')
+    out = Path(out)
+    out.mkdir(parents = True, exist_ok = True)
+    manifest_file = out / MANIFEST
+    manifest = json.loads(manifest_file.read_text()) if manifest_file.exists() else {}
+
+    specs = plots.figure_specs(results, versions)
+    rows, todo = {}, []
+    for name, title, fn, args in specs:
+        key = figure_hash(fn, args, formats)
+        old = manifest.get(name)
+        if not force and old and old['hash'] == key and all((out / f).exists() for f in old['files']):
+            rows[name] = {'title': title, 'status': 'skipped', 'seconds': 0.0, 'files': old['files'], 'hash': key}
+        else:
+            rows[name] = {'title': title, 'status': 'drawn', 'hash': key}
+            todo.append((name, fn, args))
+
+    workers = workers or min(len(todo), os.cpu_count() or 1) or 1
+    if workers == 1:
+        drawn = [_draw(name, fn, args, out, formats) for name, fn, args in todo]
+    else:
+        with ProcessPoolExecutor(max_workers = workers, initializer = _agg) as pool:
+            drawn = list(pool.map(_draw, *zip(*todo), [out] * len(todo), [formats] * len(todo)))
+    for name, files, seconds in drawn:
+        rows[name].update(files = files, seconds = seconds)
+
+    for name, entry in manifest.items():
+        kept = set(rows[name]['files']) if name in rows else set()
+        for f in set(entry['files']) - kept:
+            (out / f).unlink(missing_ok = True)
+    manifest = {name: {'hash': r['hash'], 'title': r['title'], 'files': r['files']} for name, r in rows.items()}
+    tmp = manifest_file.with_suffix('.tmp')
+    tmp.write_text(json.dumps(manifest, indent = 1))
+    os.replace(tmp, manifest_file)
+    return pd.DataFrame.from_dict(rows, orient = 'index')[['title', 'status', 'seconds', 'files']]
+
+
+def _embed(path):
+    if path.suffix == '.svg':
+        svg = path.read_text()
+        return svg[svg.index('<svg'):]
+    data = base64.b64encode(path.read_bytes()).decode()
+    return f'<img alt="{html.escape(path.stem)}" src="data:image/png;base64,{data}">'
+
+
+def report(out, title = 'Food Delivery funnel: weekly report', file = 'report.html'):
+    """Assemble the figures of the last render_figures(out) into one HTML page with the
+    images embedded; returns its path."""
+    out = Path(out)
+    manifest = json.loads((out / MANIFEST).read_text())
+    sections, toc = [], []
+    for name, entry in manifest.items():
+        # one image per figure: the first format it was saved in
+        images = [f for f in entry['files'] if f.endswith(Path(entry['files'][0]).suffix)]
+        toc.append(f'<li><a href="#{name}">{html.escape(entry["title"])}</a></li>')
+        sections.append(f'<section id="{name}"><h2>{html.escape(entry["title"])}</h2>'
+                        + ''.join(f'<figure>{_embed(out / f)}</figure>' for f in images) + '</section>')
+    generated = datetime.datetime.now().isoformat(sep = ' ', timespec = 'minutes')
+    page = (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>\n'
+            '<style>body{font-family:sans-serif;max-width:1400px;margin:auto}figure{margin:0}'
+            'img,svg{max-width:100%;height:auto}</style></head>\n'
+            f'<body><h1>{html.escape(title)}</h1><p>Generated {generated}</p><ul>{"".join(toc)}</ul>\n'
+            + '\n'.join(sections) + '\n</body></html>\n')
+    path = out / file
+    path.write_text(page)
+    return path
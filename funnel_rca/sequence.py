@@ -0,0 +1,89 @@
+# Strict sequential funnel per session.
+# Events are sorted by (SessionID, EventTimestamp) once; then, step by step,
+# the first occurrence of each funnel step after the session reached the
+# previous one is found with vectorized operations over that step's events
+# only, so the whole pass is one sort plus a linear scan.
+
+import numpy as np
+import pandas as pd
+
+from .profiling import traced
+
+
+_NEVER = np.iinfo(np.int64).max
+
+
+@traced
+def session_paths(data_fin, sequence, step = 'funnel_order', session = 'SessionID'):
+    """Per session: how far it got through `sequence` in order, and when.
+
+    `sequence` lists the step numbers (values of `step`) a session has to pass
+    in this order. Returns a DataFrame indexed by session with
+      furthest        - last step of the sequence reached in order (0 if none)
+      start           - time of the session's first funnel event
+      reached_<s>     - time the session first reached step s in order (NaT if not)
+      hit_<s>         - whether the session had step s anywhere (loose funnel),
+                        for every step present in the data, including steps not in the sequence
+    """
+    events = data_fin.loc[data_fin[step] > 0, [session, 'EventTimestamp', step]]
+    events = events.sort_values([session, 'EventTimestamp'], kind = 'stable')
+    sess_codes, sessions = pd.factorize(events[session], sort = True)
+    steps = events[step].to_numpy()
+    times = events['EventTimestamp'].to_numpy()
+    pos = np.arange(len(events))
+    n = len(sessions)
+
+    # row positions grouped by step, each group still in (session, time) order
+    by_step = np.argsort(steps, kind = 'stable')
+    bounds = np.flatnonzero(np.r_[True, np.diff(steps[by_step]) != 0, True]) if len(steps) else np.array([0])
+    groups = {steps[by_step[a]]: by_step[a:b] for a, b in zip(bounds[:-1], bounds[1:])}
+
+    start = np.r_[True, sess_codes[1:] != sess_codes[:-1]] if len(steps) else np.array([], dtype = bool)
+    paths = pd.DataFrame({'start': times[start]}, index = pd.Index(sessions, name = session))
+    furthest = np.zeros(n, dtype = np.int64)
+    prev = np.full(n, -1, dtype = np.int64)
+    for s in sequence:
+        rows = groups.get(s, np.array([], dtype = np.int64))
+        cand_sess = sess_codes[rows]
+        ok = pos[rows] > prev[cand_sess]
+        # rows are in position order, so the first row per session is the earliest valid one
+        first_sess, first_idx = np.unique(cand_sess[ok], return_index = True)
+        reached = np.full(n, _NEVER, dtype = np.int64)
+        reached[first_sess] = rows[ok][first_idx]
+        col = np.full(n, np.datetime64('NaT'), dtype = times.dtype)
+        col[first_sess] = times[reached[first_sess]]
+        paths[f'reached_{s}'] = col
+        furthest[first_sess] = s
+        prev = reached
+    paths.insert(0, 'furthest', furthest)
+
+    for s in sorted(groups):
+        hit = np.zeros(n, dtype = bool)
+        hit[sess_codes[groups[s]]] = True
+        paths[f'hit_{s}'] = hit
+    return paths
+
+
+@traced
+def sequence_funnel(paths, sequence, labels = None):
+    """Strict and loose funnel from session_paths.
+
+    strict - sessions that reached the step in order
+    loose  - sessions that had the step anywhere
+    plus conversion from the first step / the previous step, and the median time
+    from the previous step for sessions that reached the step in order.
+    """
+    rows = []
+    for i, s in enumerate(sequence):
+        reached = paths[f'reached_{s}']
+        step_time = (reached - paths[f'reached_{sequence[i - 1]}']).median() if i else pd.NaT
+        rows.append({'funnel_order': s, 'strict': int(reached.notna().sum()),
+                     'loose': int(paths.get(f'hit_{s}', pd.Series(False, index = paths.index)).sum()),
+                     'time_from_prev': step_time})
+    funnel = pd.DataFrame(rows).set_index('funnel_order')
+    if labels is not None:
+        funnel.insert(0, 'funnel', [labels.get(s, '') for s in funnel.index])
+    for kind in ('strict', 'loose'):
+        funnel[f'{kind}_CR_1st'] = funnel[kind] / funnel[kind].iloc[0]
+        funnel[f'{kind}_CR_prev'] = funnel[kind] / funnel[kind].shift(1)
+    return funnel
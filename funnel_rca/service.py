@@ -0,0 +1,307 @@
+# Local HTTP/JSON query service for the dashboard metrics.
+# Loads the event cache once - into a cube of distinct users, sessions, active
+# users, buyers and orders (funnel_rca.cube) and the attributed orders of step
+# 11 - and answers the notebook's tables as GET endpoints with filters, e.g.
+#
+#   /entry_points?weeks=2025-11-17:2025-12-14&service=food_delivery&version=5.9.0
+#
+# weeks is 'first:last' or one date (any day of the week), service and version
+# are one value or a comma separated list (see ENDPOINTS for which endpoint
+# takes which; GET / lists them). Encoded responses are kept in an LRU
+# cache keyed by the data version - a hash of the cache manifest - so they are
+# dropped when a new week is ingested: POST /refresh (or --poll) syncs the
+# cache and reloads when the manifest changed. Requests are served by threads.
+#
+#   python -m funnel_rca.service [--data .] [--cache event_cache] [--port 8765] [--cache-size 1024] [--poll 300]
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from .analysis import BASELINE_COLS, funnel_tables, order_attribution, prepare
+from .cache import read_manifest, sync_cache
+from .cube import DIMENSIONS, Cube
+from .drilldown import week_range
+from .profiling import traced
+
+
+FILTERS = ('weeks', 'service', 'version')
+# measures of the service cube: the baseline columns
+MEASURES = BASELINE_COLS
+
+Snapshot = namedtuple('Snapshot', ['version', 'cube', 'orders', 'weeks', 'loaded'])
+
+
+def data_version(cache_dir):
+    """Hash of the partitions and content hashes in the cache manifest."""
+    manifest = sorted((e['partition'], e['sha256']) for e in read_manifest(cache_dir).values())
+    return hashlib.sha256(json.dumps(manifest).encode()).hexdigest()[:16]
+
+
+def frame_json(df):
+    """{columns, index, data} of a table, with periods and tuples as strings and NaN as null."""
+    df = df.copy()
+    df.columns = [' / '.join(map(str, c)) if isinstance(c, tuple) else str(c) for c in df.columns]
+    df.index = [' / '.join(map(str, i)) if isinstance(i, tuple) else str(i) for i in df.index]
+    return json.loads(df.to_json(orient = 'split'))
+
+
+class ResultCache:
+    """Thread-safe LRU of encoded responses."""
+
+    def __init__(self, maxsize = 1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last = False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+class QueryService:
+    """The dashboard metrics over the event cache; see ENDPOINTS for what query() answers."""
+
+    def __init__(self, data_dir = '.', cache_dir = 'event_cache', cache_size = 1024, attribution_model = 'last',
+                 attribution_window = None):
+        self.data_dir, self.cache_dir = data_dir, cache_dir
+        self.attribution = (attribution_model, attribution_window)
+        self.cache = ResultCache(cache_size)
+        self.snapshot = None
+        self._reload = threading.Lock()
+        self.refresh()
+
+    @traced
+    def load(self):
+        """Snapshot of the cache as it is now: the cube and the attributed orders with their service."""
+        version = data_version(self.cache_dir)
+        data_fin = prepare(self.cache_dir)
+        cube = Cube.build(data_fin, DIMENSIONS, MEASURES)
+        orders = order_attribution(data_fin, *self.attribution)[0]
+        with_service = data_fin.loc[data_fin['order_id'].notna() & data_fin['service'].notna(), ['order_id', 'service']]
+        service = with_service.drop_duplicates('order_id').set_index('order_id')['service']
+        orders['service'] = orders['order_id'].map(service).astype(object)
+        orders['AppVersion_o'] = orders['AppVersion_o'].astype(object)
+        weeks = sorted(cube.tables['SessionID']['EventWeek'].unique())
+        return Snapshot(version, cube, orders, weeks, time.time())
+
+    def refresh(self):
+        """Sync the event cache with the exports and reload if a week was ingested or changed; True if reloaded."""
+        with self._reload:
+            sync_cache(self.data_dir, self.cache_dir)
+            if self.snapshot is not None and self.snapshot.version == data_version(self.cache_dir):
+                return False
+            self.snapshot = self.load()
+            self.cache.clear()
+            return True
+
+    def status(self):
+        snap = self.snapshot
+        return {'version': snap.version, 'loaded': snap.loaded, 'weeks': [str(w) for w in snap.weeks],
+                'endpoints': {name: list(filters) for name, (_, filters) in ENDPOINTS.items()}, 'cache': self.cache.stats()}
+
+    def query(self, endpoint, params):
+        """Encoded JSON response of an endpoint for {filter: value}, from the result cache if there."""
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f'unknown endpoint {endpoint!r}, expected one of {sorted(ENDPOINTS)}')
+        fn, filters = ENDPOINTS[endpoint]
+        unknown = set(params) - set(filters)
+        if unknown:
+            raise ValueError(f'{endpoint} does not take {sorted(unknown)}, only {list(filters)}')
+        snap = self.snapshot
+        key = (snap.version, endpoint, tuple(sorted(params.items())))
+        body = self.cache.get(key)
+        if body is None:
+            tables = fn(snap, self._filters(snap, params))
+            body = json.dumps({'endpoint': endpoint, 'params': params, 'version': snap.version,
+                               'tables': {name: frame_json(df) for name, df in tables.items()}}).encode()
+            self.cache.put(key, body)
+        return body
+
+    @staticmethod
+    def _filters(snap, params):
+        where = {}
+        if 'weeks' in params:
+            spec = params['weeks']
+            weeks = week_range(snap.weeks, tuple(spec.split(':', 1)) if ':' in spec else spec)
+            where['EventWeek'] = weeks
+        if 'service' in params:
+            where['service'] = params['service'].split(',')
+        if 'version' in params:
+            where['AppVersion'] = params['version'].split(',')
+        return where
+
+
+def _unstack(series):
+    return series.unstack() if len(series) else pd.DataFrame()
+
+
+def baseline_endpoint(snap, where):
+    """Weekly distinct sessions, users, active users, purchase sessions, buyers and orders."""
+    return {'baseline': snap.cube.query('EventWeek', MEASURES, where)}
+
+
+def service_split_endpoint(snap, where):
+    """Weekly orders, buyers and purchase sessions per service."""
+    where = dict(where, service = where.get('service', lambda s: s.notna()))
+    counts = snap.cube.query(['EventWeek', 'service'], ['order_id', 'UserswPurchases', 'SessionswPurchases'], where)
+    return {'order_types': _unstack(counts['order_id']), 'buyers_by_types': _unstack(counts['UserswPurchases']),
+            'sessions_by_types': _unstack(counts['SessionswPurchases'])}
+
+
+def funnel_endpoint(snap, where):
+    """Sessions and users per funnel step with conversion, and users per step and week."""
+    where = dict(where, funnel = lambda f: f != '')
+    by_step = snap.cube.query(['funnel', 'funnel_order'], ['SessionID', 'PseudoID'], where)
+    if not (by_step.index.get_level_values('funnel') == 'Enter Funnel').any():
+        return {'funnel': pd.DataFrame(), 'funnel_weekly': pd.DataFrame()}
+    by_week_step = snap.cube.query(['EventWeek', 'funnel', 'funnel_order'], ['SessionID', 'PseudoID'], where)
+    funnel_fin, funnel_prep_det = funnel_tables(by_step, by_week_step)
+    return {'funnel': funnel_fin, 'funnel_weekly': funnel_prep_det}
+
+
+def versions_endpoint(snap, where):
+    """Weekly sessions per app version, all and entering the funnel, and the share entering it
+    (for every week, where step 9 leaves out the last one)."""
+    sessions = snap.cube.query(['EventWeek', 'AppVersion'], 'SessionID', where)['SessionID']
+    entering = snap.cube.query(['EventWeek', 'AppVersion'], 'SessionID', dict(where, funnel_order = 1))['SessionID']
+    return {'sessions': _unstack(sessions), 'funnel_sessions': _unstack(entering),
+            'entry_rate': _unstack((entering / sessions).dropna())}
+
+
+def entry_points_endpoint(snap, where):
+    """Weekly orders per entry point they are attributed to (step 11)."""
+    orders = snap.orders
+    mask = pd.Series(True, index = orders.index)
+    for dim, column in (('EventWeek', 'EventWeek'), ('service', 'service'), ('AppVersion', 'AppVersion_o')):
+        if dim in where:
+            mask &= orders[column].isin(where[dim])
+    counts = orders[mask].groupby(['EventWeek', 'EntryPoint'])['order_id'].nunique()
+    return {'orders': _unstack(counts)}
+
+
+# endpoint -> (tables of a snapshot for a cube `where`, the filters it takes). Only the service
+# funnel steps and orders carry a service, so the funnel (which starts at 'Enter Funnel') and the
+# share of sessions entering it are not filtered by service.
+ENDPOINTS = {
+    'baseline': (baseline_endpoint, FILTERS),
+    'service_split': (service_split_endpoint, FILTERS),
+    'funnel': (funnel_endpoint, ('weeks', 'version')),
+    'versions': (versions_endpoint, ('weeks', 'version')),
+    'entry_points': (entry_points_endpoint, FILTERS),
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes: with Nagle's algorithm every keep-alive
+    # response waits for the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+    service = None
+    log = False
+
+    def _send(self, status, body):
+        body = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        endpoint = url.path.strip('/')
+        if endpoint in ('', 'status'):
+            return self._send(200, self.service.status())
+        if endpoint not in ENDPOINTS:
+            return self._send(404, {'error': f'unknown endpoint {endpoint!r}', 'endpoints': sorted(ENDPOINTS)})
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            self._send(200, self.service.query(endpoint, params))
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+
+    def do_POST(self):
+        if urlsplit(self.path).path.strip('/') != 'refresh':
+            return self._send(404, {'error': 'only /refresh accepts POST'})
+        before = self.service.snapshot.version
+        reloaded = self.service.refresh()
+        self._send(200, {'reloaded': reloaded, 'previous': before, 'version': self.service.snapshot.version})
+
+    def log_message(self, format, *args):
+        if self.log:
+            super().log_message(format, *args)
+
+
+def make_server(service, host = '127.0.0.1', port = 8765, log = False):
+    """A threading HTTP server answering from `service`; port 0 picks a free one."""
+    handler = type('ServiceHandler', (Handler,), {'service': service, 'log': log})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _poll(service, seconds):
+    while True:
+        time.sleep(seconds)
+        service.refresh()
+
+
+def main(argv = None):
+    ap = argparse.ArgumentParser(prog = 'funnel_rca.service', description = 'Dashboard metrics as a local HTTP/JSON service.')
+    ap.add_argument('--data', default = '.', help = 'directory with the weekly exports')
+    ap.add_argument('--cache', default = 'event_cache')
+    ap.add_argument('--host', default = '127.0.0.1')
+    ap.add_argument('--port', type = int, default = 8765, help = '0 picks a free port')
+    ap.add_argument('--cache-size', type = int, default = 1024, help = 'responses kept in the LRU result cache')
+    ap.add_argument('--poll', type = float, default = None, help = 'seconds between checks for newly ingested weeks')
+    ap.add_argument('--attribution-model', choices = ['last', 'first'], default = 'last')
+    ap.add_argument('--attribution-window', default = None, help = "e.g. '30min'")
+    ap.add_argument('--log', action = 'store_true', help = 'log every request')
+    args = ap.parse_args(argv)
+
+    t = time.perf_counter()
+    service = QueryService(args.data, args.cache, args.cache_size, args.attribution_model, args.attribution_window)
+    server = make_server(service, args.host, args.port, args.log)
+    if args.poll:
+        threading.Thread(target = _poll, args = (service, args.poll), daemon = True).start()
+    host, port = server.server_address[:2]
+    print(f'serving {len(service.snapshot.weeks)} weeks on http://{host}:{port} (loaded in {time.perf_counter() - t:.1f}s)', flush = True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
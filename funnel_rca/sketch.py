@@ -0,0 +1,127 @@
+# Approximate distinct counting with mergeable HyperLogLog sketches.
+# A SketchFrame holds one HLL register array per (group, column); groups can be
+# rolled up (days -> weeks -> months, or any range) by taking the register-wise
+# max, so coarser periods never need another pass over the raw events.
+
+import math
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_ERROR = 0.01
+
+
+def precision_for(error):
+    """Smallest HLL precision p whose standard error 1.04 / sqrt(2**p) is <= error."""
+    return min(max(math.ceil(math.log2((1.04 / error) ** 2)), 4), 18)
+
+
+def hash64(values):
+    """Stable 64-bit hashes of a Series (missing values must be dropped first)."""
+    return pd.util.hash_pandas_object(values, index = False).to_numpy(dtype = np.uint64)
+
+
+def _bit_length(x):
+    n = np.zeros(x.shape, dtype = np.uint8)
+    for s in (32, 16, 8, 4, 2, 1):
+        big = x >= (np.uint64(1) << np.uint64(s))
+        n[big] += s
+        x = np.where(big, x >> np.uint64(s), x)
+    return n + (x > 0)
+
+
+def registers(hashes, groups, n_groups, p):
+    """HLL registers (n_groups, 2**p) from hashes and their group number."""
+    m = 1 << p
+    idx = (hashes >> np.uint64(64 - p)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - p)) - 1)
+    rho = (64 - p) - _bit_length(rest).astype(np.int64) + 1
+    regs = np.zeros(n_groups * m, dtype = np.uint8)
+    np.maximum.at(regs, groups * m + idx, rho.astype(np.uint8))
+    return regs.reshape(n_groups, m)
+
+
+def estimate(regs):
+    """Cardinality estimate per row of a register array, with the small-range correction."""
+    m = regs.shape[-1]
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    raw = alpha * m * m / np.sum(np.ldexp(1.0, -regs.astype(np.int64)), axis = -1)
+    zeros = np.count_nonzero(regs == 0, axis = -1)
+    linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+class SketchFrame:
+    """HLL sketches of several columns for every group of a groupby."""
+
+    def __init__(self, index, sketches, p):
+        self.index = index
+        self.sketches = sketches
+        self.p = p
+
+    @classmethod
+    def build(cls, data_fin, by, columns, error = DEFAULT_ERROR):
+        """One pass over the events: sketches of `columns` per `by` group."""
+        p = precision_for(error)
+        keys = data_fin[by] if isinstance(by, str) else [data_fin[b] for b in by]
+        groups = data_fin.groupby(keys, observed = True, sort = True, dropna = False).ngroup().to_numpy()
+        index = data_fin.groupby(keys, observed = True, sort = True, dropna = False).size().index
+        sketches = {}
+        for col in columns:
+            values = data_fin[col]
+            known = values.notna().to_numpy() & (groups >= 0)
+            sketches[col] = registers(hash64(values[known]), groups[known], len(index), p)
+        return cls(index, sketches, p)
+
+    @property
+    def error(self):
+        return 1.04 / math.sqrt(1 << self.p)
+
+    def estimate(self):
+        """Approximate distinct counts per group, shaped like groupby(...).nunique()."""
+        return pd.DataFrame({col: np.rint(estimate(regs)).astype(np.int64) for col, regs in self.sketches.items()},
+                            index = self.index)
+
+    def rollup(self, labels):
+        """Merge groups that share a label; `labels` is a function of the index or an Index aligned with it."""
+        labels = labels(self.index) if callable(labels) else labels
+        if not isinstance(labels, pd.Index):
+            labels = pd.Index(labels)
+        codes, index = labels.factorize(sort = True)
+        if isinstance(labels, pd.MultiIndex):
+            index = pd.MultiIndex.from_tuples(index, names = labels.names)
+        else:
+            index = index.set_names(labels.names)
+        if not len(codes):
+            return SketchFrame(index, {c: r[:0] for c, r in self.sketches.items()}, self.p)
+        order = np.argsort(codes, kind = 'stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+        sketches = {col: np.maximum.reduceat(regs[order], starts, axis = 0) for col, regs in self.sketches.items()}
+        return SketchFrame(index, sketches, self.p)
+
+    def select(self, mask):
+        """Subset of the groups, e.g. a date range."""
+        mask = np.asarray(mask(self.index) if callable(mask) else mask, dtype = bool)
+        return SketchFrame(self.index[mask], {c: r[mask] for c, r in self.sketches.items()}, self.p)
+
+    def merge(self, other):
+        """Union with another SketchFrame (e.g. sketches of a newly ingested week)."""
+        if other.p != self.p:
+            raise ValueError(f'cannot merge sketches of precision {self.p} and {other.p}')
+        index = self.index.append(other.index)
+        combined = SketchFrame(index, {c: np.concatenate([self.sketches[c], other.sketches[c]]) for c in self.sketches}, self.p)
+        return combined.rollup(index)
+
+
+def period_labels(freq, level = 0, name = None):
+    """Rollup labels turning the date level of the index into periods ('W-SUN', 'M', ...)."""
+    def labels(index):
+        periods = pd.to_datetime(index.get_level_values(level)).to_period(freq)
+        names = list(index.names)
+        names[level] = name or names[level]
+        if index.nlevels == 1:
+            return periods.rename(names[0])
+        return pd.MultiIndex.from_arrays([periods if i == level else index.get_level_values(i)
+                                          for i in range(index.nlevels)], names = names)
+    return labels
@@ -0,0 +1,221 @@
+# Out-of-core backend: the metrics of funnel_rca.analysis as SQL in an embedded
+# DuckDB, straight over the Parquet event cache or the weekly CSV exports.
+# Nothing is loaded into pandas except the aggregated counts; DuckDB streams
+# the files and spills its hash tables to `temp_directory` when a query does
+# not fit in `memory_limit`. The CSV exports are parsed (JSON keys included)
+# once, with small read buffers, into a temporary table the queries read. The flags, funnel steps and entry points of step 3
+# are compiled into SQL expressions from the same definitions (ACTIVE_EVENTS,
+# FUNNELS), and the counts go through the same pandas post-processing as the
+# pandas path, so both return the same tables.
+
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # only needed for backend = 'duckdb'
+    duckdb = None
+
+from .analysis import BASELINE_COLS, app_version_tables, attribution_tables, entry_point_table, funnel_tables, service_tables
+from .attribution import ORDER_STEPS
+from .cache import MANIFEST
+from .flags import ACTIVE_EVENTS
+from .funnels import FUNNELS, KEYS
+from .loader import find_exports
+from .params import EVENT_PARAMS, USER_PROPERTIES
+from .profiling import traced
+from .stages import parse_size
+
+
+# read buffer of the CSV scan (DuckDB's default is 16 x max_line_size, 32MB) and the
+# longest line it accepts; an export line with its JSON blobs is a few KB
+CSV_BUFFER = 4 << 20
+CSV_MAX_LINE = 1 << 20
+# memory a thread of the CSV parse needs: its read buffer and the rows it appends
+PARSE_THREAD_MEMORY = 64 << 20
+
+
+def _lit(value):
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+def _in(column, values):
+    values = [values] if isinstance(values, str) else list(values)
+    return f'{column} IN ({", ".join(_lit(v) for v in values)})'
+
+
+def rule_case(rules, field, default):
+    """CASE expression giving `field` of the last rule a row matches (like classify), else `default`."""
+    whens = []
+    for rule in reversed(rules):
+        conds = [_in(key, getattr(rule, key)) for key in KEYS if getattr(rule, key) is not None]
+        whens.append(f'WHEN {" AND ".join(conds) or "TRUE"} THEN {_lit(getattr(rule, field))}')
+    return f'CASE {" ".join(whens)} ELSE {_lit(default)} END'
+
+
+def active_condition(active_events = ACTIVE_EVENTS):
+    by_event = {}
+    for event, screen in sorted(active_events):
+        by_event.setdefault(event, []).append(screen)
+    return '(' + ' OR '.join(f'(EventName = {_lit(e)} AND {_in("screen", s)})' for e, s in by_event.items()) + ')'
+
+
+def _csv_source(data_dir):
+    """Raw exports with the JSON keys of funnel_rca.params pulled out by DuckDB's JSON functions."""
+    files = [str(f) for _, _, f in find_exports(data_dir)]
+    keys = ([f"json_extract_string(EventParams, '$.{k}') AS {k}" for k in EVENT_PARAMS]
+            + [f"json_extract_string(UserProperties, '$.{k}') AS {k}" for k in USER_PROPERTIES])
+    return (f"""SELECT EventDate, epoch_ms(EventTimestamp) AS EventTimestamp, PseudoID, SessionID, EventName,
+                       TrafficSource, DeviceCategory, AppVersion, {', '.join(keys)}
+                FROM read_csv({files!r}, header = true, all_varchar = true, types = {{'EventTimestamp': 'BIGINT'}},
+                              buffer_size = {CSV_BUFFER}, max_line_size = {CSV_MAX_LINE})""")
+
+
+def _cache_source(cache_dir):
+    cache_dir = Path(cache_dir)
+    manifest = json.loads((cache_dir / MANIFEST).read_text())
+    files = [str(cache_dir / e['partition'] / 'part.parquet') for e in sorted(manifest.values(), key = lambda e: e['start'])]
+    # EventWeek / EventMonth are recomputed below, the stored ones are pandas period ordinals
+    return f'SELECT * EXCLUDE (EventWeek, EventMonth) FROM read_parquet({files!r})'
+
+
+class DuckDBBackend:
+    """The analysis metrics as SQL over the event cache (`cache_dir`) or the raw exports (`data_dir`)."""
+
+    def __init__(self, cache_dir = None, data_dir = None, funnel = 'food_delivery', active_events = ACTIVE_EVENTS,
+                 memory_limit = None, temp_directory = None, threads = None):
+        if duckdb is None:
+            raise ImportError("backend = 'duckdb' needs the duckdb package")
+        if (cache_dir is None) == (data_dir is None):
+            raise ValueError('pass either cache_dir or data_dir')
+        config = {'preserve_insertion_order': False}
+        if memory_limit is not None:
+            config['memory_limit'] = memory_limit
+        if threads is not None:
+            config['threads'] = threads
+        config['temp_directory'] = str(temp_directory or Path(cache_dir or data_dir) / 'duckdb_tmp')
+        self.con = duckdb.connect(config = config)
+
+        if cache_dir is not None:
+            source = _cache_source(cache_dir)
+        else:
+            source = self._parse_csv(data_dir, memory_limit, threads)
+        purchase = "order_id IS NOT NULL AND screen = 'payment'"
+        steps, entry_points = FUNNELS[funnel]['steps'], FUNNELS[funnel]['entry_points']
+        self.con.execute(f"""
+            CREATE VIEW events AS
+            SELECT *,
+                   date_trunc('week', CAST(EventDate AS DATE)) AS EventWeek,
+                   date_trunc('month', CAST(EventDate AS DATE)) AS EventMonth,
+                   CASE WHEN {active_condition(active_events)} THEN PseudoID END AS ActiveUsers,
+                   CASE WHEN {purchase} THEN PseudoID END AS UserswPurchases,
+                   CASE WHEN {purchase} THEN SessionID END AS SessionswPurchases,
+                   {rule_case(steps, 'label', '')} AS funnel,
+                   CAST({rule_case(steps, 'order', 0)} AS BIGINT) AS funnel_order,
+                   {rule_case(entry_points, 'label', '')} AS EntryPoint
+            FROM ({source})""")
+
+    @traced
+    def _parse_csv(self, data_dir, memory_limit, threads):
+        """Parse the exports once into a temporary table, so every query reads its columns instead of
+        parsing the CSV and its JSON again (DuckDB spills the table to temp_directory when it does not
+        fit); returns the query over it. The scan runs on as many threads as fit PARSE_THREAD_MEMORY
+        each into memory_limit."""
+        threads = threads or os.cpu_count() or 1
+        if memory_limit is not None:
+            threads = max(1, min(threads, parse_size(memory_limit) // PARSE_THREAD_MEMORY))
+        previous = self.con.execute("SELECT current_setting('threads')").fetchone()[0]
+        self.con.execute(f'SET threads = {threads}')
+        self.con.execute(f'CREATE TEMP TABLE parsed AS {_csv_source(data_dir)}')
+        self.con.execute(f'SET threads = {previous}')
+        return 'SELECT * FROM parsed'
+
+    def sql(self, query):
+        """Result of a query over the `events` view as a DataFrame, with weeks and months as periods."""
+        df = self.con.execute(query).df()
+        for col, freq in (('EventWeek', 'W-SUN'), ('EventMonth', 'M')):
+            if col in df:
+                df[col] = pd.to_datetime(df[col]).dt.to_period(freq)
+        return df
+
+    def nunique(self, by, measures, where = 'TRUE'):
+        """Like cube.query: distinct non-missing `measures` per `by` group (missing keys dropped)."""
+        by = [by] if isinstance(by, str) else list(by)
+        measures = [measures] if isinstance(measures, str) else list(measures)
+        known = ' AND '.join(f'{b} IS NOT NULL' for b in by)
+        counts = ', '.join(f'count(DISTINCT {m}) AS {m}' for m in measures)
+        any_known = ' OR '.join(f'{m} IS NOT NULL' for m in measures)
+        df = self.sql(f'SELECT {", ".join(by)}, {counts} FROM events WHERE ({where}) AND {known} AND ({any_known}) '
+                      f'GROUP BY ALL ORDER BY ALL').set_index(by)
+        # a group without a single value of a measure is missing for it, as in the cube
+        return df.where(df > 0) if (df == 0).any().any() else df
+
+    @traced
+    def baseline(self):
+        counts = ', '.join(f'count(DISTINCT {c}) AS {c}' for c in BASELINE_COLS)
+        return tuple(self.sql(f'SELECT {period}, {counts} FROM events GROUP BY 1 ORDER BY 1').set_index(period)
+                     for period in ('EventWeek', 'EventMonth'))
+
+    @traced
+    def service_split(self):
+        order_types = self.nunique(['EventWeek', 'service'], 'order_id')['order_id'].unstack()
+        # pivot_table(aggfunc = 'nunique') counts 0 for (week, service) groups without buyers
+        per_service = self.sql("""SELECT EventWeek, service, count(DISTINCT UserswPurchases) AS UserswPurchases,
+                                         count(DISTINCT SessionswPurchases) AS SessionswPurchases
+                                  FROM events WHERE service IS NOT NULL GROUP BY ALL ORDER BY ALL""").set_index(['EventWeek', 'service'])
+        buyers_by_types = per_service['UserswPurchases'].unstack()
+        sessions_by_types = per_service['SessionswPurchases'].unstack()
+        cancelled = {}
+        for service, suffix in (('food_delivery', 'fd'), ('grocery_delivery', 'gd')):
+            cancelled[suffix] = self.sql(f"""SELECT EventWeek, count(DISTINCT order_id) AS order_id FROM events
+                                             WHERE service = {_lit(service)} AND reason IS NOT NULL
+                                             GROUP BY 1 ORDER BY 1""").set_index('EventWeek')
+        return service_tables(order_types, buyers_by_types, sessions_by_types, cancelled['fd'], cancelled['gd'])
+
+    @traced
+    def funnel_counts(self):
+        return funnel_tables(self.nunique(['funnel', 'funnel_order'], ['SessionID', 'PseudoID'], "funnel <> ''"),
+                             self.nunique(['EventWeek', 'funnel', 'funnel_order'], ['SessionID', 'PseudoID'], "funnel <> ''"))
+
+    @traced
+    def app_version_rate(self):
+        return app_version_tables(self.nunique(['EventWeek', 'AppVersion'], 'SessionID'),
+                                  self.nunique(['EventWeek', 'AppVersion'], 'SessionID', 'funnel_order = 1'))
+
+    @traced
+    def entry_points(self):
+        return entry_point_table(self.nunique(['EventWeek', 'AppVersion', 'EntryPoint'], ['PseudoID', 'SessionID'], "EntryPoint <> ''"))
+
+    @traced
+    def order_attribution(self, model = 'last', window = None):
+        """Same rule as funnel_rca.attribution.attribute, as a DuckDB ASOF join."""
+        if model not in ('last', 'first'):
+            raise ValueError(f"unknown attribution model {model!r}, expected 'last' or 'first'")
+        keys = 'o.PseudoID = e.PseudoID AND o.SessionID = e.SessionID AND o.EventDate = e.EventDate'
+        window = f"INTERVAL '{pd.Timedelta(window).total_seconds()} seconds'" if window is not None else None
+        if model == 'last':
+            start, on = 'EventTimestamp', 'o._t > e.EventTimestamp'
+            after = f'e.EventTimestamp >= o.EventTimestamp - {window}' if window else 'TRUE'
+        else:
+            # earliest entry point of the session before the order, at or after the window start; without
+            # a window from the earliest entry point click of all, so the whole session counts
+            start = f'EventTimestamp - {window}' if window else '(SELECT min(EventTimestamp) FROM entries)'
+            on, after = 'o._t <= e.EventTimestamp', 'e.EventTimestamp < o.EventTimestamp'
+        ep_merge = self.sql(f"""
+            WITH entries AS (SELECT DISTINCT PseudoID, SessionID, EventDate, EventTimestamp, AppVersion, EntryPoint
+                             FROM events WHERE EntryPoint <> ''),
+                 orders AS (SELECT DISTINCT PseudoID, SessionID, EventDate, EventTimestamp, AppVersion, order_id
+                            FROM events WHERE order_id IS NOT NULL AND {_in('funnel_order', ORDER_STEPS)}),
+                 o AS (SELECT *, {start} AS _t FROM orders)
+            SELECT o.EventDate, o.order_id, e.EntryPoint, o.AppVersion AS AppVersion_o
+            FROM o ASOF JOIN entries e ON {keys} AND {on}
+            WHERE {after}""")
+        return attribution_tables(ep_merge)
+
+    def close(self):
+        self.con.close()
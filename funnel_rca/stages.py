@@ -0,0 +1,249 @@
+# Stage-level memoization of the analysis.
+# The pandas path of analysis.run as a DAG of named stages: events (load +
+# flatten, from the event cache) -> funnel steps / entry points -> cube,
+# strict funnel and attribution, and with the flags -> data_fin -> the
+# baseline and service tables. A stage's fingerprint hashes its definition -
+# the parameters it depends on, such as the active events, the funnel rules or
+# the attribution model, and the source of its function and of the functions
+# and modules it calls - with the fingerprints of the stages it reads, down to
+# the content hashes in the cache manifest. Results are pickled into a MemoStore
+# under that fingerprint and evicted least recently used beyond a size limit,
+# so a rerun recomputes only the stages whose inputs or definitions changed,
+# and does not even load the events when nothing upstream of a table did.
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import pandas as pd
+
+from . import active, attribution, cache, cube, encoding, flags, funnels, loader, params, sequence, sketch
+from .analysis import (app_version_rate, app_version_tables, attribution_tables, baseline, entry_point_table,
+                       entry_points, funnel_counts, funnel_tables, order_attribution, rolling_active, service_split,
+                       service_tables, strict_funnel)
+from .cache import open_cache, read_manifest
+from .cube import Cube
+from .encoding import Codebook, encode_frame
+from .flags import ACTIVE_EVENTS, add_flags
+from .funnels import FUNNELS, classify
+from .params import EVENT_PARAMS, USER_PROPERTIES
+from .profiling import span
+from .sketch import DEFAULT_ERROR
+
+
+DEFAULT_SIZE = '2GB'
+_UNITS = {'KB': 1 << 10, 'MB': 1 << 20, 'GB': 1 << 30, 'TB': 1 << 40}
+
+Stage = namedtuple('Stage', ['name', 'fn', 'deps', 'definition', 'persist', 'uses'])
+
+
+def parse_size(size):
+    """Bytes of 123, '512MB' or '2GB'."""
+    if isinstance(size, (int, float)):
+        return int(size)
+    size = size.strip().upper().removesuffix('IB').removesuffix('B')
+    unit = size[-1] + 'B' if size and size[-1] in 'KMGT' else None
+    return int(float(size[:-1] if unit else size) * (_UNITS[unit] if unit else 1))
+
+
+def _canonical(obj):
+    """JSON-able form of a stage definition, independent of set and dict ordering."""
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in sorted(obj.items(), key = lambda kv: str(kv[0]))}
+    if isinstance(obj, (set, frozenset)):
+        return sorted((_canonical(v) for v in obj), key = repr)
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    return repr(obj)
+
+
+def _source(fn):
+    """Source of a function or a whole module."""
+    try:
+        return inspect.getsource(fn)
+    except (OSError, TypeError):
+        if inspect.ismodule(fn):
+            return fn.__name__
+        return f'{fn.__module__}.{fn.__qualname__}:{fn.__code__.co_code.hex()}'
+
+
+class MemoStore:
+    """Pickled stage results by fingerprint in a directory, evicted least recently used beyond `max_size`."""
+
+    def __init__(self, path, max_size = DEFAULT_SIZE):
+        self.path = Path(path)
+        self.path.mkdir(parents = True, exist_ok = True)
+        self.max_bytes = parse_size(max_size)
+        index = self.path / 'index.json'
+        self.index = json.loads(index.read_text()) if index.exists() else {}
+
+    def _write_index(self):
+        tmp = self.path / 'index.json.tmp'
+        tmp.write_text(json.dumps(self.index, indent = 1, sort_keys = True))
+        os.replace(tmp, self.path / 'index.json')
+
+    @property
+    def size(self):
+        return sum(e['bytes'] for e in self.index.values())
+
+    def get(self, key):
+        """(True, value) for a stored key - which becomes the most recently used - else (False, None)."""
+        entry = self.index.get(key)
+        if entry is None or not (self.path / entry['file']).exists():
+            return False, None
+        with open(self.path / entry['file'], 'rb') as fh:
+            value = pickle.load(fh)
+        entry['used'] = time.time()
+        self._write_index()
+        return True, value
+
+    def put(self, key, stage, value):
+        """Store `value` under `key`, then evict the least recently used other entries beyond max_size."""
+        file = f'{stage}-{key[:16]}.pkl'
+        tmp = self.path / (file + '.tmp')
+        with open(tmp, 'wb') as fh:
+            pickle.dump(value, fh, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path / file)
+        self.index[key] = {'stage': stage, 'file': file, 'bytes': (self.path / file).stat().st_size, 'used': time.time()}
+        for old in sorted((k for k in self.index if k != key), key = lambda k: self.index[k]['used']):
+            if self.size <= self.max_bytes:
+                break
+            (self.path / self.index.pop(old)['file']).unlink(missing_ok = True)
+        self._write_index()
+        return self.index[key]['bytes']
+
+
+class Pipeline:
+    """Named stages with dependencies, run on demand with results memoized in a MemoStore."""
+
+    def __init__(self, store = None):
+        self.stages = {}
+        self.store = store
+        self.report = None
+        self._fingerprints = {}
+
+    def add(self, name, fn, deps = (), definition = None, persist = True, uses = ()):
+        """Stage `name` computes fn(*values of deps). `definition` and the source of fn and of the
+        functions and modules in `uses` - everything it calls that may change its result - are part
+        of its fingerprint; persist=False stages are never stored."""
+        self.stages[name] = Stage(name, fn, tuple(deps), definition, persist, tuple(uses))
+        self._fingerprints.clear()
+        return self
+
+    def fingerprint(self, name):
+        if name not in self._fingerprints:
+            stage = self.stages[name]
+            key = {'stage': name, 'definition': _canonical(stage.definition),
+                   'code': [_source(f) for f in (stage.fn,) + stage.uses],
+                   'deps': [self.fingerprint(d) for d in stage.deps]}
+            self._fingerprints[name] = hashlib.sha256(json.dumps(key, sort_keys = True).encode()).hexdigest()
+        return self._fingerprints[name]
+
+    def run(self, targets = None):
+        """Values of `targets` (default: every stage), computing only what the store does not have.
+
+        self.report then lists every stage with hit / miss (stored stages),
+        computed (persist=False) or skipped, its own seconds and stored MiB.
+        """
+        targets = list(self.stages) if targets is None else list(targets)
+        values, rows = {}, {}
+
+        def get(name):
+            if name in values:
+                return values[name]
+            stage = self.stages[name]
+            key = self.fingerprint(name)
+            if stage.persist and self.store is not None:
+                t = time.perf_counter()
+                found, value = self.store.get(key)
+                if found:
+                    rows[name] = ('hit', time.perf_counter() - t, self.store.index[key]['bytes'] / 2**20)
+                    values[name] = value
+                    return value
+            args = [get(d) for d in stage.deps]
+            t = time.perf_counter()
+            with span(f'stage:{name}') as s:
+                value = stage.fn(*args)
+                s.result(value)
+            seconds = time.perf_counter() - t
+            if stage.persist and self.store is not None:
+                rows[name] = ('miss', seconds, self.store.put(key, name, value) / 2**20)
+            else:
+                rows[name] = ('computed', seconds, None)
+            values[name] = value
+            return value
+
+        for name in targets:
+            get(name)
+        self.report = pd.DataFrame([(n,) + rows.get(n, ('skipped', None, None)) for n in self.stages],
+                                   columns = ['stage', 'status', 'seconds', 'MiB']).set_index('stage')
+        return {name: values[name] for name in targets}
+
+
+def _concat_columns(events, *columns):
+    return pd.concat([events] + list(columns), axis = 1)
+
+
+def analysis_pipeline(cache_dir = 'event_cache', funnel = 'food_delivery', active_events = ACTIVE_EVENTS,
+                      approx = False, error = DEFAULT_ERROR, attribution_model = 'last', attribution_window = None,
+                      store = None):
+    """The stages of analysis.run (pandas backend) over an up to date event cache; see results()."""
+    manifest = {e['partition']: e['sha256'] for e in read_manifest(cache_dir).values()}
+    steps, entry_rules = FUNNELS[funnel]['steps'], FUNNELS[funnel]['entry_points']
+    p = Pipeline(store)
+    # stored as well: encoding the IDs takes several times longer than loading the pickled result
+    p.add('events', lambda: encode_frame(open_cache(cache_dir), Codebook(f'{cache_dir}/codes')),
+          definition = {'manifest': manifest, 'event_params': EVENT_PARAMS, 'user_properties': USER_PROPERTIES},
+          uses = (cache, encoding, loader, params))
+    p.add('flags', lambda ev: add_flags(ev[['EventName', 'screen', 'order_id', 'PseudoID', 'SessionID']].copy(), active_events)
+          [['ActiveUsers', 'UserswPurchases', 'SessionswPurchases']],
+          ['events'], {'active_events': active_events}, uses = (flags,))
+    p.add('funnel', lambda ev: classify(ev, steps), ['events'], {'steps': steps}, uses = (funnels,))
+    p.add('entry_points', lambda ev: classify(ev, entry_rules, label = 'EntryPoint')[['EntryPoint']],
+          ['events'], {'entry_points': entry_rules}, uses = (funnels,))
+    # the events with their funnel step and entry point: all the cube, the strict funnel and the
+    # attribution read, so a change of the active events does not reach them
+    p.add('classified', _concat_columns, ['events', 'funnel', 'entry_points'], persist = False)
+    p.add('data_fin', _concat_columns, ['classified', 'flags'], persist = False)
+    p.add('cube', Cube.build, ['classified'], uses = (cube, sketch))
+    p.add('active_rolling', lambda: rolling_active(cache_dir, active_events),
+          definition = {'manifest': manifest, 'active_events': active_events},
+          uses = (rolling_active, active, cache, encoding, flags))
+    p.add('baseline', lambda df: baseline(df, approx, error), ['data_fin'], {'approx': approx, 'error': error},
+          uses = (baseline, sketch))
+    p.add('service_split', lambda df, cube: service_split(df, cube, approx, error), ['data_fin', 'cube'],
+          {'approx': approx, 'error': error}, uses = (service_split, service_tables, cube, sketch))
+    p.add('funnel_counts', funnel_counts, ['cube'], uses = (funnel_tables, cube))
+    p.add('strict_funnel', lambda df: strict_funnel(df, funnel), ['classified'],
+          {'sequence': FUNNELS[funnel]['sequence'], 'steps': steps}, uses = (strict_funnel, sequence))
+    p.add('app_version', app_version_rate, ['cube'], uses = (app_version_tables, cube))
+    p.add('entry_point_groups', entry_points, ['cube'], uses = (entry_point_table, cube))
+    p.add('attribution', lambda df: order_attribution(df, attribution_model, attribution_window), ['classified'],
+          {'model': attribution_model, 'window': attribution_window},
+          uses = (order_attribution, attribution_tables, attribution))
+    return p
+
+
+TABLE_STAGES = ['active_rolling', 'baseline', 'service_split', 'funnel_counts', 'strict_funnel', 'app_version',
+                'entry_point_groups', 'attribution']
+
+
+def results(pipeline):
+    """The result tables of analysis.run from the table stages of `pipeline`."""
+    v = pipeline.run(TABLE_STAGES)
+    out = {'active_rolling': v['active_rolling']}
+    out['df_group_week'], out['df_group_month'] = v['baseline']
+    out.update(v['service_split'])
+    out['funnel_fin'], out['funnel_prep_det'] = v['funnel_counts']
+    out['funnel_seq'] = v['strict_funnel']
+    out['app'], out['app_entry_rate'] = v['app_version']
+    out['ep_groups'] = v['entry_point_groups']
+    _, out['ep_merge_gr'], out['ep_merge_gr_t'] = v['attribution']
+    return out
@@ -0,0 +1,201 @@
+# Memory-mapped event store for session-ordered scans.
+# The columns the attribution and the strict funnel read, integer encoded and
+# fixed width, one .npy file each, sorted once by (PseudoID, SessionID,
+# EventDate, EventTimestamp) - the session of funnel_rca.attribution - with an
+# offset index: the rows of session i are offsets[i]:offsets[i + 1]. Opened
+# with np.load(mmap_mode = 'r'), so a session scan reads the pages in place
+# without copies, and worker processes opening the same store share those
+# pages through the OS page cache instead of each holding its own frame.
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .active import day_numbers
+from .attribution import ORDER_STEPS
+from .cache import read_manifest
+from .funnels import FUNNELS, definition
+from .profiling import traced
+from .sequence import session_paths
+
+
+# column -> dtype on disk; missing codes are -1
+COLUMNS = {
+    'PseudoID': np.int32,
+    'SessionID': np.int32,
+    'EventDate': np.int32,        # days since 1970-01-01
+    'EventTimestamp': np.int64,   # ms since 1970-01-01
+    'EventName': np.int16,
+    'screen': np.int16,
+    'button': np.int16,
+    'service': np.int16,
+    'AppVersion': np.int16,
+    'order_id': np.int32,
+    'funnel_order': np.int8,
+    'EntryPoint': np.int8,        # order of the entry point rule, 0 for none
+}
+# a session lasts less than 2**27 ms (37 hours), see _keys
+_TIME_BITS = 27
+
+
+def _fingerprint(cache_dir, funnel):
+    manifest = {e['partition']: e['sha256'] for e in read_manifest(cache_dir).values()}
+    return {'manifest': manifest, **definition(funnel)}
+
+
+class EventStore:
+    """The session-ordered, memory-mapped event columns in `path` (see build)."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / 'store.json').read_text())
+        self.columns = {c: np.load(self.path / f'{c}.npy', mmap_mode = 'r') for c in self.meta['columns']}
+        self.offsets = np.load(self.path / 'offsets.npy', mmap_mode = 'r')
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    @property
+    def sessions(self):
+        return len(self.offsets) - 1
+
+    def session(self, i):
+        """Zero-copy views of every column for the rows of session i."""
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return {c: col[a:b] for c, col in self.columns.items()}
+
+    def categories(self, column):
+        return self.meta['categories'][column]
+
+    @classmethod
+    @traced
+    def build(cls, data_fin, path, funnel = 'food_delivery', fingerprint = None):
+        """Write the store of an encoded data_fin (see analysis.prepare) to `path` and open it."""
+        path = Path(path)
+        path.mkdir(parents = True, exist_ok = True)
+        codes, categories = {}, {}
+        for col in ('PseudoID', 'SessionID'):
+            codes[col] = data_fin[col].fillna(-1).to_numpy(dtype = np.int64)
+        codes['EventDate'] = day_numbers(data_fin['EventDate'])
+        codes['EventTimestamp'] = data_fin['EventTimestamp'].to_numpy(dtype = 'datetime64[ms]').astype(np.int64)
+        for col in ('EventName', 'screen', 'button', 'service', 'AppVersion'):
+            cat = data_fin[col].astype('category')
+            codes[col], categories[col] = cat.cat.codes.to_numpy(), [str(c) for c in cat.cat.categories]
+        order_codes, order_values = pd.factorize(data_fin['order_id'], sort = True)
+        codes['order_id'], categories['order_id'] = order_codes, None
+        codes['funnel_order'] = data_fin['funnel_order'].to_numpy()
+        labels = [r.label for r in FUNNELS[funnel]['entry_points']]
+        codes['EntryPoint'] = pd.Categorical(data_fin['EntryPoint'], categories = labels).codes + 1
+        categories['EntryPoint'] = [''] + labels
+
+        order = np.lexsort((codes['EventTimestamp'], codes['EventDate'], codes['SessionID'], codes['PseudoID']))
+        for col, dtype in COLUMNS.items():
+            np.save(path / f'{col}.npy', codes[col][order].astype(dtype))
+        keys = [codes[c][order] for c in ('PseudoID', 'SessionID', 'EventDate')]
+        new = np.ones(len(order), dtype = bool)
+        new[1:] = np.any([k[1:] != k[:-1] for k in keys], axis = 0)
+        np.save(path / 'offsets.npy', np.r_[np.flatnonzero(new), len(order)].astype(np.int64))
+        pd.DataFrame({'value': np.asarray(order_values, dtype = object)}).to_parquet(path / 'order_id.parquet', index = False)
+        meta = {'rows': len(order), 'columns': list(COLUMNS), 'categories': categories, 'fingerprint': fingerprint}
+        (path / 'store.json').write_text(json.dumps(meta))
+        return cls(path)
+
+    def session_index(self, rows = slice(None)):
+        """Session number of every row (of `rows`)."""
+        return np.repeat(np.arange(self.sessions), np.diff(self.offsets))[rows]
+
+    def _rows(self, sessions):
+        if sessions is None:
+            return slice(0, len(self))
+        first, last = sessions
+        return slice(int(self.offsets[first]), int(self.offsets[last]))
+
+    def _keys(self, rows):
+        # (session, time since the session's first event) packed into one sortable int64
+        sess = self.session_index(rows)
+        ts = np.asarray(self['EventTimestamp'][rows])
+        rel = ts - self['EventTimestamp'][self.offsets[:-1]][sess]
+        if len(rel) and rel.max() >= 1 << _TIME_BITS:
+            raise ValueError('a session lasts longer than the store keys allow')
+        return sess, ts, sess << _TIME_BITS | rel
+
+    @traced
+    def attribute(self, model = 'last', window = None, order_steps = ORDER_STEPS, sessions = None):
+        """Orders with the entry point they are attributed to, like analysis.order_attribution's ep_merge.
+
+        Same rule as funnel_rca.attribution.attribute, as one binary search of
+        every order among the entry points by (session, time) key. `sessions`
+        limits it to the sessions in [first, last), e.g. one range per worker.
+        """
+        if model not in ('last', 'first'):
+            raise ValueError(f"unknown attribution model {model!r}, expected 'last' or 'first'")
+        rows = self._rows(sessions)
+        sess, ts, key = self._keys(rows)
+        known = (np.asarray(self['PseudoID'][rows]) >= 0) & (np.asarray(self['SessionID'][rows]) >= 0)
+        entry = np.flatnonzero(known & (np.asarray(self['EntryPoint'][rows]) > 0))
+        order = np.flatnonzero(known & (np.asarray(self['order_id'][rows]) >= 0)
+                               & np.isin(self['funnel_order'][rows], order_steps))
+        window = pd.Timedelta(window) // pd.Timedelta('1ms') if window is not None else None
+
+        if model == 'last':
+            # latest entry point strictly before the order, at most `window` before it
+            j = np.searchsorted(key[entry], key[order], side = 'left') - 1
+            hit = entry[np.maximum(j, 0)]
+            ok = (j >= 0) & (sess[hit] == sess[order])
+            if window is not None:
+                ok &= ts[order] - ts[hit] <= window
+        else:
+            # earliest entry point from the window start (or the session start) on, before the order
+            start = sess[order] << _TIME_BITS
+            lo = np.maximum(key[order] - window, start) if window is not None else start
+            j = np.searchsorted(key[entry], lo, side = 'left')
+            hit = entry[np.minimum(j, len(entry) - 1)] if len(entry) else np.zeros(len(order), dtype = np.int64)
+            ok = (j < len(entry)) & (sess[hit] == sess[order]) & (ts[hit] < ts[order])
+        order, hit = order[ok], hit[ok]
+
+        base = rows.start
+        versions = self.categories('AppVersion')
+        order_ids = pd.read_parquet(self.path / 'order_id.parquet')['value'].to_numpy(dtype = object)
+        ep_merge = pd.DataFrame({
+            '_row': sess[order],
+            '_t': ts[order],
+            'EventDate': np.asarray(self['EventDate'][base + order]).astype('datetime64[D]').astype(str),
+            'order_id': order_ids[self['order_id'][base + order]],
+            'EntryPoint': np.array(self.categories('EntryPoint'), dtype = object)[self['EntryPoint'][base + hit]],
+            'AppVersion_o': pd.Categorical.from_codes(self['AppVersion'][base + order], categories = versions),
+        })
+        # one row per distinct order event, as touchpoints keeps them
+        return ep_merge.drop_duplicates(['_row', '_t', 'order_id', 'AppVersion_o']).drop(columns = ['_row', '_t']).reset_index(drop = True)
+
+    @traced
+    def session_paths(self, sequence):
+        """sequence.session_paths over the store's sessions, indexed by session number; the rows are
+        already in (session, time) order, so its sort is a pass over sorted data."""
+        steps = np.asarray(self['funnel_order'])
+        rows = np.flatnonzero(steps > 0)
+        frame = pd.DataFrame({'session': self.session_index(rows),
+                              'EventTimestamp': np.asarray(self['EventTimestamp'])[rows].astype('datetime64[ms]'),
+                              'funnel_order': steps[rows].astype(np.int64)})
+        return session_paths(frame, sequence, session = 'session')
+
+
+@traced
+def open_store(cache_dir = 'event_cache', data_fin = None, funnel = 'food_delivery'):
+    """The EventStore of the event cache in <cache_dir>/store, rebuilt from data_fin (prepared
+    from the cache if not given) when the cache or the rules of the funnel changed."""
+    path = Path(cache_dir) / 'store'
+    fingerprint = _fingerprint(cache_dir, funnel)
+    if (path / 'store.json').exists():
+        store = EventStore(path)
+        if store.meta['fingerprint'] == fingerprint:
+            return store
+    if data_fin is None:
+        from .analysis import prepare
+
+        data_fin = prepare(cache_dir, funnel)
+    return EventStore.build(data_fin, path, funnel, fingerprint)